@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, join(dirname(abspath(__file__)), "../usr/lib/solydxk/constructor"))
+
+# The package computation does not need apt or GTK: guestapt and functions import them
+for module in ['apt', 'apt_pkg', 'gi', 'gi.repository']:
+    sys.modules.setdefault(module, types.ModuleType(module))
+sys.modules['apt'].Cache = lambda *args, **kwargs: None
+sys.modules['gi.repository'].Gtk = None
+
+import prune
+import guestapt
+from prune import PrunePackages
+from dpkgstatus import DpkgStatus
+
+STATUS = """Package: base-files
+Status: install ok installed
+Priority: required
+Section: admin
+Architecture: amd64
+Version: 9
+
+Package: editor
+Status: install ok installed
+Priority: optional
+Section: editors
+Architecture: amd64
+Version: 1
+Depends: libused1
+
+Package: libused1
+Status: install ok installed
+Priority: optional
+Section: libs
+Architecture: amd64
+Multi-Arch: same
+Version: 1
+
+Package: libold1
+Status: install ok installed
+Priority: optional
+Section: oldlibs
+Architecture: amd64
+Version: 1
+Depends: libdep1
+
+Package: libdep1
+Status: install ok installed
+Priority: optional
+Section: libs
+Architecture: amd64
+Version: 1
+
+Package: libheld1
+Status: hold ok installed
+Priority: optional
+Section: libs
+Architecture: amd64
+Version: 1
+
+Package: libbaloo5
+Status: install ok installed
+Priority: optional
+Section: libs
+Architecture: amd64
+Version: 1
+
+Package: wine32
+Status: install ok installed
+Priority: optional
+Section: otherosfs
+Architecture: i386
+Version: 1
+
+Package: gone
+Status: deinstall ok config-files
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1
+
+"""
+
+
+class Version(object):
+
+    def __init__(self, downloadable):
+        self.downloadable = downloadable
+
+
+class Package(object):
+
+    def __init__(self, downloadable=True):
+        self.versions = [Version(downloadable)]
+
+
+# Apt cache with the packages of the status file that are in an archive
+class FakeGuestApt(object):
+
+    cache = {}
+
+    def __init__(self, rootPath):
+        pass
+
+    def open(self):
+        return FakeGuestApt.cache
+
+    def close(self):
+        pass
+
+
+class PruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.distroPath = tempfile.mkdtemp()
+        self.rootPath = join(self.distroPath, "root")
+        os.makedirs(join(self.rootPath, "var/lib/dpkg"))
+        with open(join(self.rootPath, "var/lib/dpkg/status"), 'w') as f:
+            f.write(STATUS)
+        self.savedGuestApt = prune.GuestApt
+        prune.GuestApt = FakeGuestApt
+        FakeGuestApt.cache = dict([(name, Package()) for name in
+                                   ['base-files', 'editor', 'libused1:amd64', 'libold1', 'libdep1',
+                                    'libheld1', 'libbaloo5', 'wine32:i386']])
+
+    def tearDown(self):
+        prune.GuestApt = self.savedGuestApt
+        shutil.rmtree(self.distroPath)
+
+    def test_orphans_closure(self):
+        pp = PrunePackages(self.distroPath)
+        removal = pp.getRemovalSet()
+        self.assertIn('libold1', removal)
+        # Only kept by an orphan
+        self.assertIn('libdep1', removal)
+        self.assertNotIn('libused1:amd64', removal)
+
+    def test_orphans_keep_held_and_not_orphan(self):
+        removal = PrunePackages(self.distroPath).getRemovalSet()
+        self.assertNotIn('libheld1', removal)
+        self.assertNotIn('libbaloo5', removal)
+        self.assertNotIn('base-files', removal)
+
+    def test_orphans_only_libraries(self):
+        pp = PrunePackages(self.distroPath)
+        remaining = dict([(name, {'Section': 'editors', 'Priority': 'optional'}) for name in ['a', 'b']])
+        self.assertEqual(pp.getOrphans(remaining), set())
+
+    def test_config_files(self):
+        self.assertIn('gone', PrunePackages(self.distroPath).getRemovalSet())
+
+    def test_foreign_packages_are_available(self):
+        self.assertNotIn('wine32:i386', PrunePackages(self.distroPath).getRemovalSet())
+
+    def test_unavailable(self):
+        FakeGuestApt.cache['editor'] = Package(downloadable=False)
+        removal = PrunePackages(self.distroPath).getRemovalSet()
+        self.assertIn('editor', removal)
+        # No longer kept by editor
+        self.assertIn('libused1:amd64', removal)
+
+    def test_unavailable_held(self):
+        del FakeGuestApt.cache['libheld1']
+        self.assertNotIn('libheld1', PrunePackages(self.distroPath).getRemovalSet())
+
+    def test_refuse_without_package_lists(self):
+        FakeGuestApt.cache = {}
+        pruneList = join(self.rootPath, "prune.list")
+        with self.assertRaises(Exception):
+            PrunePackages(self.distroPath).writeList(pruneList)
+        self.assertFalse(os.path.exists(pruneList))
+
+    def test_refuse_too_many_unavailable(self):
+        for name in ['editor', 'libold1', 'libdep1']:
+            del FakeGuestApt.cache[name]
+        with self.assertRaises(Exception):
+            PrunePackages(self.distroPath).getRemovalSet()
+
+    def test_foreign_architectures(self):
+        with open(join(self.rootPath, "var/lib/dpkg/arch"), 'w') as f:
+            f.write("amd64\ni386\n")
+        self.assertEqual(guestapt.getForeignArchitectures(self.rootPath, 'amd64'), ['i386'])
+
+    def test_native_architecture(self):
+        # More foreign than native packages: the native architecture comes from dpkg
+        foreign = "".join(["Package: lib%d\nStatus: install ok installed\nArchitecture: i386\nVersion: 1\n\n" % i
+                           for i in range(10)])
+        with open(join(self.rootPath, "var/lib/dpkg/status"), 'a') as f:
+            f.write(foreign)
+        with open(join(self.rootPath, "var/lib/dpkg/arch"), 'w') as f:
+            f.write("amd64\ni386\n")
+        packages = DpkgStatus(self.rootPath).getPackages()
+        self.assertIn('editor', packages)
+        self.assertIn('lib0:i386', packages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+from os.path import basename, dirname
+from solydxk import DistroGeneral
+from testiso import TestIso
+from qemu import Qemu
+
+# Boot milestones in boot order (seconds since QEMU started)
+# firmware: firmware and boot loader, up to the start of the kernel clock
+MILESTONES = ['firmware', 'initrd', 'squashfs', 'rootfs', 'target']
+
+# Not ordered after multi-user.target, which wants it (an ordering cycle):
+# the script waits for the default target and does not hold it up (Type=simple)
+UNITS = [("constructor-bootbench.service", "multi-user.target", """[Unit]
+Description=Constructor boot benchmark
+After=display-manager.service
+
+[Service]
+Type=simple
+ExecStart=/usr/local/sbin/constructor-bootbench
+""")]
+
+
+# Boot the ISO headless in QEMU through its own boot loaders, in BIOS mode (isolinux)
+# and in EFI mode (OVMF with the EFI files of build_efi_files), and record a boot time
+# breakdown from the serial console of a benchmark variant of the ISO.
+# A boot that is more than maxSlowdown percent slower than the last passing run fails.
+class BootBench(object):
+
+    def __init__(self, distroPath, firmwares=['bios', 'efi'], maxSlowdown=20, timeout=900):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.dg = DistroGeneral(distroPath)
+        self.firmwares = firmwares
+        self.maxSlowdown = maxSlowdown
+        self.timeout = timeout
+        # OVMF boots the alternative El Torito entry: only the benchmark ISO gets it
+        self.testIso = TestIso(distroPath, "bootbench", "bootbench.sh", UNITS, {'timeout': 1},
+                               {'efiBoot': 'efi' in self.firmwares})
+
+    # Boot once and return the milestones
+    def boot(self, firmware):
+        qemu = Qemu(self.testIso.isoFile, self.testIso.getLogFile("serial-%s" % firmware), firmware=firmware)
+        result = {'accel': 'kvm' if qemu.kvm else 'tcg'}
+        done = None
+        for elapsed, line in qemu.run("CONSTRUCTOR-BENCH-DONE", self.timeout):
+            parts = line.split()
+            if len(parts) == 3 and parts[0] == "CONSTRUCTOR-BENCH" and parts[2] != '-':
+                result[parts[1]] = float(parts[2])
+            elif len(parts) == 2 and parts[0] == "CONSTRUCTOR-BENCH-DONE":
+                done = (elapsed, float(parts[1]))
+        if done is None:
+            raise Exception("%s boot did not finish (see %s)" % (firmware.upper(), qemu.serialLog))
+        # Guest times count from the start of the kernel clock
+        elapsed, uptime = done
+        kernelStart = max(elapsed - uptime, 0)
+        for milestone in MILESTONES[1:]:
+            if milestone in result:
+                result[milestone] = round(result[milestone] + kernelStart, 2)
+        result['firmware'] = round(kernelStart, 2)
+        result['total'] = round(elapsed, 2)
+        return result
+
+    # Return the errors of a boot compared with the previous one
+    def compare(self, firmware, result, previous):
+        if previous is None or previous.get('accel') != result['accel'] or not previous.get('total'):
+            return []
+        slowdown = (result['total'] - previous['total']) * 100 / previous['total']
+        if slowdown > self.maxSlowdown:
+            return ["%s boot took %.1f s: %.0f%% slower than the previous %.1f s (maximum %d%%)" %
+                    (firmware.upper(), result['total'], slowdown, previous['total'], self.maxSlowdown)]
+        return []
+
+    # Benchmark all firmwares and return (results, errors)
+    def run(self):
+        previous = self.dg.readMetrics("bootbench") or {}
+        results = {}
+        errors = []
+        try:
+            self.testIso.build()
+            for firmware in self.firmwares:
+                print(("Boot benchmark: %s" % firmware.upper()))
+                try:
+                    results[firmware] = self.boot(firmware)
+                except Exception as detail:
+                    errors.append(str(detail))
+                    continue
+                errors.extend(self.compare(firmware, results[firmware], previous.get(firmware)))
+                for line in formatBootBench(firmware, results[firmware], previous.get(firmware)):
+                    print(line)
+        finally:
+            self.testIso.remove()
+
+        # The last passing run is the reference for the next one
+        self.dg.writeMetrics("bootbench-last", results)
+        if not errors:
+            self.dg.writeMetrics("bootbench", results)
+        return (results, errors)
+
+
+# Return the boot time breakdown as printable lines
+def formatBootBench(firmware, result, previous=None):
+    lines = ["%s boot (%s):" % (firmware.upper(), result['accel'].upper())]
+    for milestone in MILESTONES + ['total']:
+        if milestone in result:
+            line = "  %-10s %7.2f s" % (milestone, result[milestone])
+            if previous is not None and milestone in previous:
+                line += "  (previous %.2f s)" % previous[milestone]
+            lines.append(line)
+    return lines
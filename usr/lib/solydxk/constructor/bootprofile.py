@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+import os
+from os.path import join, exists, basename, dirname
+from solydxk import DistroGeneral
+from testiso import TestIso
+from qemu import Qemu, USB_THROTTLE
+
+# Boot stages in boot order: files first read in an earlier stage are packed first
+STAGES = ['sysinit', 'basic', 'graphical', 'session']
+
+# mksquashfs -sort priority of the first stage (higher is packed first)
+FIRST_PRIORITY = 32000
+
+# Systemd units of the profiling layer: (unit name, wanted by, unit file)
+UNITS = [
+    ("constructor-profile-sysinit.service", "basic.target", """[Unit]
+Description=Constructor boot profile: sysinit
+DefaultDependencies=no
+After=sysinit.target
+
+[Service]
+Type=oneshot
+ExecStart=/usr/local/sbin/constructor-bootprofile sysinit
+"""),
+    ("constructor-profile-basic.service", "multi-user.target", """[Unit]
+Description=Constructor boot profile: basic
+After=basic.target
+
+[Service]
+Type=oneshot
+ExecStart=/usr/local/sbin/constructor-bootprofile basic
+"""),
+    # Not ordered after graphical.target, which wants it (an ordering cycle):
+    # the script waits for the target and does not hold it up (Type=simple)
+    ("constructor-profile-graphical.service", "graphical.target", """[Unit]
+Description=Constructor boot profile: graphical
+After=display-manager.service
+
+[Service]
+Type=simple
+ExecStart=/bin/sh -c '/usr/local/sbin/constructor-bootprofile graphical; sleep 30; /usr/local/sbin/constructor-bootprofile session poweroff'
+""")
+]
+
+
+# Record which files of the squashfs root are read while the live ISO boots,
+# turn that into a mksquashfs -sort file (<working directory>/.constructor/squashfs.sort)
+# and measure the boot time.
+# A profiling variant of the ISO gets an extra layer with systemd units that write
+# stage markers and the files in the page cache to the serial console.
+# It boots twice in QEMU: once to time the boot, once to list the files.
+class BootProfile(object):
+
+    def __init__(self, distroPath, throttle=True, timeout=900):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.distroPath = distroPath
+        self.dg = DistroGeneral(distroPath)
+        self.sortFile = join(self.dg.statePath, "squashfs.sort")
+        self.throttle = USB_THROTTLE if throttle else None
+        self.timeout = timeout
+        self.testIso = TestIso(distroPath, "bootprofile", "bootprofile.sh", UNITS)
+
+    # Boot the profiling ISO
+    # mode: time (stage markers only) or files (stage markers and file lists)
+    # Return (stage -> guest uptime in seconds, [(stage, path)] in order of appearance)
+    def boot(self, mode):
+        livePath = join(self.testIso.variant.bootPath, "live")
+        append = "boot=live components quiet splash console=tty0 console=ttyS0,115200n8 constructor.profile={}".format(mode)
+        qemu = Qemu(self.testIso.isoFile, self.testIso.getLogFile("serial-%s" % mode),
+                    kernel=join(livePath, "vmlinuz"), initrd=join(livePath, "initrd.img"),
+                    append=append, throttle=self.throttle)
+        stages = {}
+        files = []
+        for elapsed, line in qemu.run("CONSTRUCTOR-PROFILE-DONE", self.timeout):
+            parts = line.split(' ', 2)
+            if parts[0] == "CONSTRUCTOR-PROFILE-STAGE" and len(parts) == 3:
+                stages[parts[1]] = float(parts[2])
+            elif parts[0] == "CONSTRUCTOR-PROFILE-FILE" and len(parts) == 3:
+                files.append((parts[1], parts[2]))
+            elif parts[0] == "CONSTRUCTOR-PROFILE-ERROR":
+                print(("ERROR: BootProfile: %s" % line))
+        if 'session' not in stages:
+            raise Exception("The boot profile ISO did not reach the desktop session (see %s)" % qemu.serialLog)
+        return (stages, files)
+
+    # Write the sort file: the earlier the stage a file is first read in, the higher its priority
+    # Paths that mksquashfs cannot read from a sort file (white space, escaped characters) are left out
+    def writeSortFile(self, files):
+        priorities = {}
+        for stage, path in files:
+            if path not in priorities and stage in STAGES and not any([c in path for c in ' \t\\']):
+                priorities[path] = FIRST_PRIORITY - STAGES.index(stage) * 1000
+        tmpFile = "%s.tmp" % self.sortFile
+        with open(tmpFile, 'w') as f:
+            for path, priority in sorted(priorities.items(), key=lambda item: (-item[1], item[0])):
+                f.write("%s %d\n" % (path, priority))
+        os.replace(tmpFile, self.sortFile)
+        return len(priorities)
+
+    # Profile the boot and return the boot metrics
+    def run(self):
+        # The squashfs root is built with the sort file of the previous profile, if any
+        isSorted = exists(self.sortFile)
+        try:
+            self.testIso.build()
+            print("Boot profile: timing the boot...")
+            stages, files = self.boot("time")
+            print("Boot profile: recording the files read during boot...")
+            profileStages, files = self.boot("files")
+        finally:
+            self.testIso.remove()
+        count = self.writeSortFile(files)
+        print(("Boot profile: {} files written to {}".format(count, self.sortFile)))
+
+        metrics = {'sorted': isSorted, 'stages': stages, 'files': count,
+                   'throttle': self.throttle, 'previous': None}
+        previous = self.dg.readMetrics("bootprofile")
+        if previous is not None:
+            previous.pop('previous', None)
+            metrics['previous'] = previous
+        for stage in STAGES:
+            if stage in stages:
+                line = "Boot to %s: %.1f s" % (stage, stages[stage])
+                if previous is not None and stage in previous.get('stages', {}):
+                    before = previous['stages'][stage]
+                    line += " (previous %.1f s%s, %+.1f%%)" % (before, ", sorted" if previous.get('sorted') else "",
+                                                                (stages[stage] - before) * 100 / before if before else 0)
+                print(line)
+        self.dg.writeMetrics("bootprofile", metrics)
+        return metrics
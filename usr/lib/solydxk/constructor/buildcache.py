@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from os.path import exists, basename
+from execcmd import ExecCmd
+
+# Packages of the tools that produce the build artifacts
+TOOL_PACKAGES = ['squashfs-tools', 'genisoimage', 'syslinux-utils', 'isolinux', 'mktorrent']
+
+
+# Return the installed versions of the build tools
+def getToolVersions():
+    versions = {}
+    ec = ExecCmd()
+    lines = ec.run("dpkg-query -W -f '${Package} ${Version}\\n' %s 2>/dev/null" % " ".join(TOOL_PACKAGES), False)
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 2:
+            versions[parts[0]] = parts[1]
+    return versions
+
+
+# Return the files produced for an ISO
+def getIsoArtifacts(isoFileName):
+    return [isoFileName, "%s.md5" % isoFileName, "%s.torrent" % isoFileName]
+
+
+# Return the files a build profile produces for an ISO
+def getIsoOutputs(isoFileName, profile):
+    iso, md5, torrent = getIsoArtifacts(isoFileName)
+    return [iso] + ([md5] if profile['md5sums'] else []) + ([torrent] if profile['torrent'] else [])
+
+
+# Content-addressed cache of a working directory's last build
+# The fingerprint covers the root and boot manifests, the build settings,
+# the tool versions and the ISO name: when it matches the last build,
+# that build's artifacts are reused.
+class BuildCache(object):
+
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.record = {}
+        if exists(self.cacheFile):
+            try:
+                with open(self.cacheFile, 'r') as f:
+                    self.record = json.load(f)
+            except Exception as detail:
+                print(("ERROR: BuildCache: cannot read {}: {}".format(self.cacheFile, detail)))
+                self.record = {}
+
+    def getFingerprint(self, rootHash, bootHash, settings, isoBaseName):
+        data = {'root': rootHash,
+                'boot': bootHash,
+                'settings': settings,
+                'tools': getToolVersions(),
+                'name': isoBaseName}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    # Check if the fingerprint matches the last build and the files its build profile
+    # produces are still there
+    # Artifacts that were moved to another directory (e.g. a renamed working directory)
+    # are renamed to the given ISO files.
+    def lookup(self, fingerprint, isoFiles, profile):
+        if not self.record or self.record.get('fingerprint') != fingerprint:
+            return False
+        cachedIsos = self.record.get('isoFiles', [])
+        if [basename(iso) for iso in cachedIsos] != [basename(iso) for iso in isoFiles]:
+            return False
+        for cachedIso, iso in zip(cachedIsos, isoFiles):
+            for cached, target in zip(getIsoOutputs(cachedIso, profile), getIsoOutputs(iso, profile)):
+                if not exists(target) and not exists(cached):
+                    return False
+        for cachedIso, iso in zip(cachedIsos, isoFiles):
+            for cached, target in zip(getIsoOutputs(cachedIso, profile), getIsoOutputs(iso, profile)):
+                if not exists(target):
+                    print(("Rename cached artifact: {} -> {}".format(cached, target)))
+                    os.rename(cached, target)
+        if cachedIsos != isoFiles:
+            self.record['isoFiles'] = isoFiles
+            self.writeRecord()
+        return True
+
+    # Store the fingerprint of the finished build
+    def save(self, fingerprint, isoFiles, durations={}):
+        self.record = {'fingerprint': fingerprint,
+                       'isoFiles': isoFiles,
+                       'time': datetime.now().isoformat(),
+                       'durations': durations}
+        self.writeRecord()
+
+    def writeRecord(self):
+        tmpFile = "%s.tmp" % self.cacheFile
+        with open(tmpFile, 'w') as f:
+            json.dump(self.record, f, indent=2, sort_keys=True)
+        os.replace(tmpFile, self.cacheFile)
@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from os.path import exists
+
+
+# Return the fingerprint of the inputs of a build stage
+def getInputHash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Return the input of a stage that reads a file: its size and modification time
+def getFileStamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+# Checkpoints of the build stages: {<stage>: {"input": ..., "outputs": [...], "time": ...}}
+# A stage is done when its input fingerprint did not change and its outputs are still there:
+# a build that failed or was cancelled continues with the first stage that is not done.
+class BuildCheckpoints(object):
+
+    def __init__(self, checkpointFile):
+        self.checkpointFile = checkpointFile
+        self.record = {}
+        if exists(self.checkpointFile):
+            try:
+                with open(self.checkpointFile, 'r') as f:
+                    self.record = json.load(f)
+            except Exception as detail:
+                print(("ERROR: BuildCheckpoints: cannot read {}: {}".format(self.checkpointFile, detail)))
+                self.record = {}
+
+    def isDone(self, stage, inputHash):
+        checkpoint = self.record.get(stage)
+        if checkpoint is None or checkpoint.get('input') != inputHash:
+            return False
+        return all([exists(path) for path in checkpoint.get('outputs', [])])
+
+    # Record a finished stage
+    def done(self, stage, inputHash, outputs=[]):
+        self.record[stage] = {'input': inputHash,
+                              'outputs': outputs,
+                              'time': datetime.now().isoformat()}
+        self.writeRecord()
+
+    # Forget a stage before it runs: its outputs are about to change
+    def reset(self, stage):
+        if stage in self.record:
+            del self.record[stage]
+            self.writeRecord()
+
+    def writeRecord(self):
+        tmpFile = "%s.tmp" % self.checkpointFile
+        with open(tmpFile, 'w') as f:
+            json.dump(self.record, f, indent=2, sort_keys=True)
+        os.replace(tmpFile, self.checkpointFile)
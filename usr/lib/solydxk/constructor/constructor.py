@@ -8,17 +8,25 @@
 # sudo apt-get install python3-gi
 # from gi.repository import Gtk, GdkPixbuf, GObject, Pango, Gdk
 from gi.repository import Gtk, GObject
-from os import makedirs, remove, system, listdir
-from shutil import copy, move, rmtree
+from os import makedirs, system, listdir
 import functions
 import threading
-import operator
+import argparse
+import sys
 from queue import Queue
 # abspath, dirname, join, expanduser, exists, basename
-from os.path import join, abspath, dirname, exists
+from os.path import join, abspath, dirname, exists, basename
 from execcmd import ExecCmd
-from solydxk import IsoUnpack, EditDistro, BuildIso, DistroGeneral
+from solydxk import IsoUnpack, EditDistro, BuildIso
 from treeview import TreeViewHandler
+from offline import OfflinePackages
+from predict import SizePredictor, formatPrediction, parseSize
+from bootprofile import BootProfile
+from bootbench import BootBench
+from efi import EfiArtifacts, buildEfiArtifacts, getMenuModules, EFI_MODULES, EFI_PLATFORMS
+from registry import DistroRegistry, formatDistros
+from mounts import MountManager
+from profiles import BUILD_PROFILES, DEFAULT_PROFILE
 from dialogs import MessageDialogSafe, SelectFileDialog, SelectDirectoryDialog, QuestionDialog
 
 # i18n: http://docs.python.org/3/library/gettext.html
@@ -30,7 +38,7 @@ gettext.textdomain('solydxk-constructor')
 #class for the main window
 class Constructor(object):
 
-    def __init__(self):
+    def __init__(self, buildOptions=None):
         self.scriptDir = abspath(dirname(__file__))
         self.shareDir = join(self.scriptDir, '../../../share/solydxk/constructor')
 
@@ -84,7 +92,7 @@ class Constructor(object):
         self.ec.run("modprobe loop", False)
         self.queue = Queue()
         self.mountDir = "/mnt/constructor"
-        self.distroFile = join(self.scriptDir, "distros.list")
+        self.registry = DistroRegistry(join(self.scriptDir, "distros.json"), join(self.scriptDir, "distros.list"))
         self.distroAdded = False
         self.iso = None
         self.dir = None
@@ -94,6 +102,16 @@ class Constructor(object):
         self.chkFromIso.set_active(True)
         self.toggleGuiElements(False)
         self.hostEfiArchitecture = functions.getHostEfiArchitecture()
+        self.buildOptions = buildOptions
+        # Running build and the distributions that still need to be built
+        self.buildThread = None
+        self.buildPaths = []
+        self.buildMessage = ""
+        # Refills of the distro list: results of an older probe thread are dropped
+        self.distroGeneration = 0
+        # Threads of the ISO unpack and the offline package downloads
+        self.unpackThread = None
+        self.offlineThread = None
 
         # Treeviews
         self.tvHandlerDistros = TreeViewHandler(self.tvDistros)
@@ -126,7 +144,7 @@ class Constructor(object):
         self.fillTreeViewDistros()
 
     def on_btnEdit_clicked(self, widget):
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
+        selected = self.getSelectedDistros()
         for path in selected:
             de = EditDistro(path)
             services = []
@@ -144,15 +162,19 @@ class Constructor(object):
                     msg += "\nservice %s stop" % service
                 self.showInfo(_("Services detected"), msg, self.window)
                 functions.repaintGui()
+            de.startSession()
             de.openTerminal()
+            de.endSession()
 
     def on_btnUpgrade_clicked(self, widget):
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
+        selected = self.getSelectedDistros()
         upgraded = False
         for path in selected:
             upgraded = True
             rootPath = "%s/root" % path
             de = EditDistro(path)
+            # Expensive triggers (e.g. update-initramfs) run once at the end of the session
+            de.startSession()
             de.openTerminal("apt-get update")
             if exists(join(rootPath, 'etc/apache2/apache2.conf')):
                 de.openTerminal("service apache2 start")
@@ -165,15 +187,10 @@ class Constructor(object):
                 de.openTerminal("service mysql stop")
 
             # Cleanup old kernel and headers
-            script = "rmoldkernel.sh"
-            scriptSource = join(self.scriptDir, "files/{}".format(script))
-            scriptTarget = join(rootPath, script)
-            if exists(scriptSource):
-                copy(scriptSource, scriptTarget)
-                self.ec.run("chmod a+x %s" % scriptTarget)
-                de.openTerminal("/bin/bash %s" % script)
-                remove(scriptTarget)
+            de.runScript("rmoldkernel.sh")
+            de.endSession()
 
+        if upgraded:
             # Build EFI files
             if self.hostEfiArchitecture != "":
                 print(">> Start building EFI files")
@@ -188,128 +205,106 @@ class Constructor(object):
 
     def on_btnLocalize_clicked(self, widget):
         # Set locale
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
+        selected = self.getSelectedDistros()
         for path in selected:
-            rootPath = "%s/root" % path
-            de = EditDistro(path)
-            script = "setlocale.sh"
-            scriptSource = join(self.scriptDir, "files/{}".format(script))
-            scriptTarget = join(rootPath, script)
-            if exists(scriptSource):
-                copy(scriptSource, scriptTarget)
-                self.ec.run("chmod a+x %s" % scriptTarget)
-                de.openTerminal("/bin/bash %s" % script)
-                remove(scriptTarget)
+            EditDistro(path).localize()
 
+    # Build the EFI files of the selected distributions: the files are built once per
+    # architecture and module list (in parallel when more are needed) and installed from the cache
     def build_efi_files(self):
-
-        # TODO - also 32-bit installs (haven't tested this)
-
-        modules = "part_gpt part_msdos ntfs ntfscomp hfsplus fat ext2 normal chain boot configfile linux " \
-                "multiboot iso9660 gfxmenu gfxterm loadenv efi_gop efi_uga loadbios fixvideo png " \
-                "ext2 ntfscomp loopback search minicmd cat cpuid appleldr elf usb videotest " \
-                "halt help ls reboot echo test normal sleep memdisk tar font video_fb video " \
-                "gettext true  video_bochs video_cirrus multiboot2 acpi gfxterm_background gfxterm_menu"
-
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
-        for path in selected:
-            rootPath = "%s/root" % path
-            bootPath = "{}/boot".format(path)
-            arch = functions.getGuestEfiArchitecture(rootPath)
-
-            grubEfiName = "bootx64"
-            efiName = "x64"
-            if arch != "x86_64":
-                arch = "i386"
-                grubEfiName = "bootia32"
-                efiName = "ia32"
-
+        selected = self.getSelectedDistros()
+        try:
+            artifacts = {}
+            paths = []
+            for path in selected:
+                arch = functions.getGuestEfiArchitecture(join(path, "root"))
+                if arch != "x86_64":
+                    arch = "i386"
+                # The modules the boot menus load must be on the ISO too
+                modules = " ".join([EFI_MODULES] + getMenuModules(join(path, "boot"), "%s-efi" % EFI_PLATFORMS[arch][0]))
+                key = (arch, modules)
+                if key not in artifacts:
+                    artifacts[key] = EfiArtifacts(arch, modules)
+                paths.append((path, key))
+            buildEfiArtifacts(list(artifacts.values()))
+            for path, key in paths:
+                artifacts[key].install(join(path, "boot"))
+            print((">> Finished building EFI files"))
+        except Exception as detail:
+            self.showError("Error: build EFI files", detail, self.window)
+
+    # Download the offline packages of the selected distributions in a thread
+    def download_offline_packages(self):
+        selected = self.getSelectedDistros()
+        if self.offlineThread is not None and self.offlineThread.is_alive():
+            self.showOutput(_("Offline packages are still being downloaded"))
+            return
+        self.offlineThread = threading.Thread(target=self.downloadOfflinePackages, args=(selected,))
+        self.offlineThread.daemon = True
+        self.offlineThread.start()
+
+    # Runs in a thread: report back in the GTK thread
+    def downloadOfflinePackages(self, paths):
+        for path in paths:
             try:
-                if not exists("{}/efi/boot".format(bootPath)):
-                    makedirs("{}/efi/boot".format(bootPath))
-
-                self.ec.run("efi-image {}/~tmp {}-efi {}".format(bootPath, arch, efiName))
-                if exists("{}/~tmp/efi.img".format(bootPath) and
-                   exists("{}/~tmp/boot/grub/{}-efi".format(bootPath, arch))):
-                    self.ec.run("rm -r {}/boot/grub/{}-efi".format(bootPath, arch))
-                    self.ec.run("mv -vf {}/~tmp/boot/grub/{}-efi {}/boot/grub/".format(bootPath, arch, bootPath))
-                    self.ec.run("mv -vf {}/~tmp/efi.img {}/boot/grub/".format(bootPath, bootPath))
-                    self.ec.run("rm -r {}/~tmp".format(bootPath))
-
-                self.ec.run("grub-mkimage -O {}-efi -d /usr/lib/grub/{}-efi "
-                            "-o {}/efi/boot/{}.efi "
-                            "-p \"/boot/grub\" {}".format(arch, arch, bootPath, grubEfiName, modules))
+                OfflinePackages(path).run()
+            except Exception as detail:
+                GObject.idle_add(self.showError, "Error: getting offline packages", str(detail), self.window)
+        GObject.idle_add(self.showOutput, ">> Finished downloading offline packages")
 
-                print((">> Finished building EFI files"))
+    def on_btnBuildIso_clicked(self, widget):
+        # While building, the Build button cancels the build
+        if self.buildThread is not None:
+            self.showOutput(_("Cancelling the build..."))
+            self.buildPaths = []
+            self.btnBuildIso.set_sensitive(False)
+            self.buildThread.cancel()
+            return
+        self.buildPaths = self.getSelectedDistros()
+        self.buildMessage = ""
+        if self.buildPaths:
+            self.toggleGuiElements(True)
+            self.btnBuildIso.set_label("_{}".format(_("Cancel")))
+            self.btnBuildIso.set_sensitive(True)
+            self.startBuild()
+
+    # Build the ISO of the next selected distribution in a thread
+    def startBuild(self):
+        path = self.buildPaths.pop(0)
+        self.showOutput("Start building ISO in: %s" % path)
+        self.buildThread = BuildIso(path, self.queue, self.buildOptions)
+        self.buildThread.start()
+        GObject.timeout_add(500, self.checkBuild, path)
+
+    def checkBuild(self, path):
+        if self.buildThread.is_alive():
+            return True
 
-            except Exception as detail:
-                self.showError("Error: build EFI files", detail, self.window)
+        # Thread is done
+        # Get the data from the queue
+        ret = self.queue.get()
+        self.queue.task_done()
+        self.buildThread = None
 
-    def download_offline_packages(self):
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
-        for path in selected:
-            rootPath = "%s/root" % path
-            arch = functions.getGuestEfiArchitecture(rootPath)
-            de = EditDistro(path)
-            script = "offline.sh"
-            scriptSource = join(self.scriptDir, "files/{}".format(script))
-            scriptTarget = join(rootPath, script)
-            offlineSource = join(rootPath, "offline")
-            offlineTarget = join(rootPath, "../boot/offline")
-            if exists(scriptSource):
-                try:
-                    copy(scriptSource, scriptTarget)
-                    self.ec.run("chmod a+x %s" % scriptTarget)
-                    # Run the script
-                    de.openTerminal("/bin/bash {} {}".format(script, arch))
-                    # Remove script
-                    remove(scriptTarget)
-                    # Move offline directory to boot directory
-                    if exists(offlineSource):
-                        print(("%s exists" % offlineSource))
-                        if exists(offlineTarget):
-                            print((">> Remove %s" % offlineTarget))
-                            rmtree(offlineTarget)
-                        print((">> Move %s to %s" % (offlineSource, offlineTarget)))
-                        move(offlineSource, offlineTarget)
-                    else:
-                        print((">> Cannot find: %s" % offlineSource))
-                except Exception as detail:
-                    self.showError("Error: getting offline packages", detail, self.window)
+        self.registry.update(path)
+        if ret is not None:
+            self.showOutput(ret)
+            if "error" in ret.lower():
+                self.showError("Error", ret, self.window)
             else:
-                print((">> Cannot find: %s" % scriptSource))
+                self.buildMessage += "%s\n" % ret
 
+        if self.buildPaths:
+            self.startBuild()
+            return False
 
-    def on_btnBuildIso_clicked(self, widget):
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
-        msg = ""
-        for path in selected:
-            self.toggleGuiElements(True)
-            self.showOutput("Start building ISO in: %s" % path)
-            functions.repaintGui()
-
-            # Start building the ISO in a thread
-            t = BuildIso(path, self.queue)
-            t.start()
-            self.queue.join()
-
-            # Thread is done
-            # Get the data from the queue
-            ret = self.queue.get()
-            self.queue.task_done()
-
-            if ret is not None:
-                self.showOutput(ret)
-                if "error" in ret.lower():
-                    self.showError("Error", ret, self.window)
-                else:
-                    msg += "%s\n" % ret
-
-        if msg != "":
+        if self.buildMessage != "":
             if exists("/usr/bin/aplay") and exists(self.doneWav):
                 self.ec.run("/usr/bin/aplay '%s'" % self.doneWav, False)
-            self.showInfo("", msg, self.window)
+            self.showInfo("", self.buildMessage, self.window)
+        self.btnBuildIso.set_label("_{}".format(_("Build")))
         self.toggleGuiElements(False)
+        return False
 
     def on_chkSelectAll_toggled(self, widget):
         self.tvHandlerDistros.treeviewToggleAll(toggleColNrList=[0], toggleValue=widget.get_active())
@@ -324,38 +319,71 @@ class Constructor(object):
             system("xdg-open file://%s &" % self.help)
 
     def on_btnOpenDir_clicked(self, widget):
-        selected = self.tvHandlerDistros.getToggledValues(toggleColNr=0, valueColNr=2)
+        selected = self.getSelectedDistros()
         for path in selected:
             system("xdg-open %s &" % path)
 
+    # Fill the distro list with the cached metadata and probe the directories in a thread
     def fillTreeViewDistros(self, selectDistros=[]):
-        contentList = [[_("Select"), _("Distribution"), _("Working directory")]]
+        contentList = [[_("Select"), _("Distribution"), _("Working directory"), _("Status")]]
         distros = self.getDistros()
         for distro in distros:
             select = False
             for selectDistro in selectDistros:
                 if distro[0] == selectDistro:
                     select = True
-            contentList.append([select, distro[0], distro[1]])
-        self.tvHandlerDistros.fillTreeview(contentList=contentList, columnTypesList=['bool', 'str', 'str'], firstItemIsColName=True)
+            contentList.append([select, distro[0], distro[1], _("Checking")])
+        self.tvHandlerDistros.fillTreeview(contentList=contentList, columnTypesList=['bool', 'str', 'str', 'str'], firstItemIsColName=True)
+
+        self.distroGeneration += 1
+        t = threading.Thread(target=self.probeDistros, args=([distro[1] for distro in distros], self.distroGeneration))
+        t.daemon = True
+        t.start()
 
     def getDistros(self):
         distros = []
-        if exists(self.distroFile):
-            with open(self.distroFile, 'r') as f:
-                lines = f.readlines()
-            for line in lines:
-                line = line.strip().rstrip('/')
-                print(line)
-                if exists(line):
-                    dg = DistroGeneral(line)
-                    isoName = dg.description
-                    distros.append([isoName, line])
-            # Sort on iso name
-            if distros:
-                distros = sorted(distros, key=operator.itemgetter(0))
+        for path, entry in self.registry.getCachedDistros():
+            distros.append([entry.get('description') or basename(path), path])
         return distros
 
+    # Runs in a thread: check the directories and probe the stale ones
+    def probeDistros(self, paths, generation):
+        for path in paths:
+            if not exists(path):
+                GObject.idle_add(self.updateDistroRow, generation, path, None, _("Unavailable"))
+                continue
+            if self.registry.isStale(path):
+                GObject.idle_add(self.updateDistroRow, generation, path, None, _("Stale"))
+                try:
+                    entry = self.registry.refresh(path)
+                except Exception as detail:
+                    print(("ERROR: probeDistros: {}: {}".format(path, detail)))
+                    GObject.idle_add(self.updateDistroRow, generation, path, None, _("Error"))
+                    continue
+            else:
+                entry = self.registry.distros.get(path, {})
+            GObject.idle_add(self.updateDistroRow, generation, path, entry.get('description'), "")
+
+    # Return the selected working directories, without those that are unavailable
+    def getSelectedDistros(self):
+        model = self.tvDistros.get_model()
+        if model is None:
+            return []
+        return [row[2] for row in model if row[0] and row[3] != _("Unavailable") and exists(row[2])]
+
+    # Update the row of a working directory (in the GTK thread)
+    def updateDistroRow(self, generation, path, description, status):
+        model = self.tvDistros.get_model()
+        if generation != self.distroGeneration or model is None:
+            return False
+        for row in model:
+            if row[2] == path:
+                if description:
+                    row[1] = description
+                row[3] = status
+                break
+        return False
+
     # ===============================================
     # Add ISO Window Functions
     # ===============================================
@@ -414,8 +442,8 @@ class Constructor(object):
 
                 self.showOutput("Start unpacking the ISO...")
                 self.toggleGuiElements(True)
-                t = IsoUnpack(self.mountDir, self.iso, self.dir, self.queue)
-                t.start()
+                self.unpackThread = IsoUnpack(self.mountDir, self.iso, self.dir, self.queue)
+                self.unpackThread.start()
                 self.queue.join()
                 GObject.timeout_add(1000, self.checkThread, True)
             else:
@@ -489,10 +517,11 @@ class Constructor(object):
         functions.pushMessage(self.statusbar, message)
 
     def checkThread(self, addDistro=None):
-        #print 'Thread count = ' + str(threading.active_count())
-        # As long there's a thread active, keep spinning
-        if threading.active_count() > 1:
+        # As long as the unpack thread is active, keep spinning
+        # Other threads (probes, downloads) do not count
+        if self.unpackThread is not None and self.unpackThread.is_alive():
             return True
+        self.unpackThread = None
 
         # Thread is done
         # Get the data from the queuez
@@ -502,7 +531,7 @@ class Constructor(object):
         # Thread is done
         if addDistro is not None:
             self.saveDistroFile(self.dir, addDistro)
-            self.fillTreeViewDistros(self.isoName)
+            self.fillTreeViewDistros([self.isoName])
         self.toggleGuiElements(False)
         if exists("/usr/bin/aplay") and exists(self.doneWav):
             self.ec.run("/usr/bin/aplay '%s'" % self.doneWav, False)
@@ -533,37 +562,148 @@ class Constructor(object):
             self.btnUpgrade.set_sensitive(True)
 
     def saveDistroFile(self, distroPath, addDistro=True):
-        newCont = []
-        dg = DistroGeneral(distroPath)
-        self.isoName = dg.description
-
-        cfg = []
-        if exists(self.distroFile):
-            with open(self.distroFile, 'r') as f:
-                cfg = f.readlines()
-            for line in cfg:
-                line = line.strip()
-                if distroPath not in line and exists(line):
-                    newCont.append(line)
-
         if addDistro:
-            newCont.append(distroPath)
-
-        with open(self.distroFile, 'w') as f:
-            f.write('\n'.join(newCont))
+            self.isoName = self.registry.add(distroPath)['description']
+        else:
+            self.registry.remove(distroPath)
 
         self.iso = ""
         self.dir = ""
 
     # Close the gui
     def on_constructorWindow_destroy(self, widget):
+        # Stop a running build
+        if self.buildThread is not None:
+            self.buildPaths = []
+            self.buildThread.cancel()
+            self.buildThread.join()
         # Close the app
         Gtk.main_quit()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=_("SolydXK Constructor"))
+    parser.add_argument('--force-cleanup', action='store_true',
+                        help=_("Run all cleanup steps, even when nothing changed since the last build"))
+    parser.add_argument('--overlay-cleanup', action='store_true',
+                        help=_("Run the cleanup on a throwaway overlay: the working directory keeps its caches and state. "
+                               "Every cleanup step runs on each build: its results are dropped with the overlay"))
+    parser.add_argument('--localize', metavar='LOCALE',
+                        help=_("Localize the given working directories without user interaction (e.g. de_DE.UTF-8)"))
+    parser.add_argument('--timezone', metavar='TIMEZONE', default='',
+                        help=_("Timezone to use with --localize (e.g. Europe/Berlin)"))
+    parser.add_argument('--build', action='store_true',
+                        help=_("Build the ISOs of the given working directories without GUI"))
+    parser.add_argument('--build-profile', metavar='PROFILE', choices=sorted(BUILD_PROFILES), default=DEFAULT_PROFILE,
+                        help=_("Build profile: release (default) or fast (quick test ISO: lz4/zstd on all processors, no cleanup, md5 sums, isohybrid or torrent)"))
+    parser.add_argument('--variant', metavar='NAME', action='append',
+                        help=_("Only build this variant (see variants.json) from the current root; can be repeated"))
+    parser.add_argument('--predict', action='store_true',
+                        help=_("Estimate the SquashFS and ISO size and the build time of the given working directories"))
+    parser.add_argument('--target-size', metavar='SIZE',
+                        help=_("Maximum ISO size (e.g. 4G): warn and suggest settings when the ISO would be larger"))
+    parser.add_argument('--initrd', metavar='COMPRESSOR', choices=['gzip', 'lz4', 'lzop', 'xz', 'zstd'],
+                        help=_("Regenerate the live initrd with this compressor and the modules in initrd.modules"))
+    parser.add_argument('--read-bench', action='store_true',
+                        help=_("Measure how fast the SquashFS root reads back (after the build with --build)"))
+    parser.add_argument('--profile-boot', action='store_true',
+                        help=_("Boot the ISO in QEMU, record the files read during boot and pack them first in the next build"))
+    parser.add_argument('--boot-bench', action='store_true',
+                        help=_("Boot the ISO in QEMU in BIOS and EFI mode and record the boot time (after the build with --build)"))
+    parser.add_argument('--max-slowdown', metavar='PERCENT', type=int, default=20,
+                        help=_("Fail --boot-bench when the boot is this much slower than the previous one (default: 20)"))
+    parser.add_argument('--list', action='store_true',
+                        help=_("List the registered working directories with their cached metadata"))
+    parser.add_argument('paths', metavar='DIRECTORY', nargs='*',
+                        help=_("Working directories"))
+    args = parser.parse_args()
+    targetSize = None
+    if args.target_size:
+        try:
+            targetSize = parseSize(args.target_size)
+        except ValueError as detail:
+            parser.error(str(detail))
+    # Mounts left behind by a constructor that crashed
+    try:
+        MountManager().cleanupStale()
+    except Exception as detail:
+        print(("ERROR: cleanup stale mounts: {}".format(detail)))
+
+    buildOptions = {'forceCleanup': args.force_cleanup, 'variants': args.variant, 'targetSize': targetSize,
+                    'initrd': args.initrd, 'readBench': args.read_bench, 'overlayCleanup': args.overlay_cleanup,
+                    'profile': args.build_profile}
+
+    # Registered working directories without GUI
+    if args.list:
+        scriptDir = abspath(dirname(__file__))
+        registry = DistroRegistry(join(scriptDir, "distros.json"), join(scriptDir, "distros.list"))
+        for line in formatDistros(registry.getDistros()):
+            print(line)
+        sys.exit(0)
+
+    # Size and time estimate without GUI
+    if args.predict:
+        for path in args.paths:
+            print((">> Predict %s" % path))
+            bi = BuildIso(path, Queue(), buildOptions)
+            for line in formatPrediction(SizePredictor(path, bi.getRootMksquashfsCommand()).predict(targetSize)):
+                print(line)
+        sys.exit(0)
+
+    # Batch localization without GUI
+    if args.localize:
+        if not args.timezone:
+            parser.error(_("--localize needs --timezone"))
+        for path in args.paths:
+            print((">> Localize %s: %s, %s" % (path, args.localize, args.timezone)))
+            EditDistro(path).localize(args.localize, args.timezone, interactive=False)
+        sys.exit(0)
+
+    # Read performance of the current SquashFS root without GUI
+    if args.read_bench and not args.build:
+        for path in args.paths:
+            print((">> Read benchmark %s" % path))
+            BuildIso(path, Queue(), buildOptions).readBench()
+        sys.exit(0)
+
+    # Boot profile without GUI
+    if args.profile_boot:
+        for path in args.paths:
+            print((">> Profile boot %s" % path))
+            try:
+                BootProfile(path).run()
+            except Exception as detail:
+                sys.exit("ERROR: %s" % detail)
+        sys.exit(0)
+
+    # Build without GUI
+    if args.build or args.boot_bench:
+        ret = None
+        for path in args.paths:
+            if args.build:
+                queue = Queue()
+                t = BuildIso(path, queue, buildOptions)
+                t.start()
+                # Ctrl-C cancels the build: the next build continues where it stopped
+                try:
+                    while t.is_alive():
+                        t.join(0.5)
+                except KeyboardInterrupt:
+                    t.cancel()
+                    t.join()
+                ret = queue.get()
+                if ret is not None and ("error" in ret.lower() or ret.startswith("CANCELLED")):
+                    sys.exit(ret)
+                DistroRegistry(join(abspath(dirname(__file__)), "distros.json")).update(path)
+            if args.boot_bench:
+                print((">> Boot benchmark %s" % path))
+                results, errors = BootBench(path, maxSlowdown=args.max_slowdown).run()
+                if errors:
+                    sys.exit("ERROR: %s" % "\n".join(errors))
+        sys.exit(0)
+
     # Create an instance of our GTK application
     try:
-        gui = Constructor()
+        gui = Constructor(buildOptions)
         Gtk.main()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+import os
+import threading
+from collections import OrderedDict, Counter
+from os.path import join, exists
+from execcmd import ExecCmd
+
+# Fields kept from the dpkg status file
+FIELDS = ['Package', 'Status', 'Priority', 'Section', 'Installed-Size', 'Architecture',
+          'Multi-Arch', 'Essential', 'Version', 'Provides', 'Depends', 'Pre-Depends', 'Recommends', 'Suggests']
+
+# Parsed status files: status path -> (mtime, size, packages)
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+# Class to read var/lib/dpkg/status of a root directory without chrooting
+# Parsed packages are cached against the mtime of the status file
+# so that all stages of a build can use them
+class DpkgStatus(object):
+
+    def __init__(self, rootPath):
+        self.rootPath = rootPath
+        self.statusPath = join(rootPath, "var/lib/dpkg/status")
+
+    # Return an ordered dictionary: binary package name -> fields
+    def getPackages(self):
+        if not exists(self.statusPath):
+            return OrderedDict()
+        st = os.stat(self.statusPath)
+        with _cacheLock:
+            cached = _cache.get(self.statusPath)
+            if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                return cached[2]
+        packages = self.parse()
+        with _cacheLock:
+            _cache[self.statusPath] = (st.st_mtime_ns, st.st_size, packages)
+        return packages
+
+    # Stream the status file stanza by stanza
+    def parse(self):
+        stanzas = []
+        stanza = {}
+        field = None
+        with open(self.statusPath, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if line == '\n':
+                    if stanza:
+                        stanzas.append(stanza)
+                    stanza = {}
+                    field = None
+                elif line[0] in ' \t':
+                    # Continuation line of a multi-line field: not needed
+                    continue
+                else:
+                    field, sep, value = line.partition(':')
+                    if field in FIELDS:
+                        stanza[field] = value.strip()
+            if stanza:
+                stanzas.append(stanza)
+
+        nativeArch = self.getNativeArchitecture()
+        if not nativeArch:
+            # Guess: the most used architecture
+            archs = Counter([s.get('Architecture') for s in stanzas if s.get('Architecture', 'all') != 'all'])
+            nativeArch = archs.most_common(1)[0][0] if archs else ''
+
+        packages = OrderedDict()
+        for stanza in stanzas:
+            name = stanza.get('Package')
+            if name is None:
+                continue
+            arch = stanza.get('Architecture', 'all')
+            if stanza.get('Multi-Arch') == 'same' or (arch != 'all' and arch != nativeArch):
+                name = "%s:%s" % (name, arch)
+            status = stanza.get('Status', '').split()
+            stanza['Want'] = status[0] if status else ''
+            stanza['State'] = status[-1] if status else ''
+            packages[name] = stanza
+        return packages
+
+    # Return the native architecture of dpkg: the first line of var/lib/dpkg/arch,
+    # or dpkg --print-architecture in the chroot when dpkg did not write that file
+    def getNativeArchitecture(self):
+        archFile = join(self.rootPath, "var/lib/dpkg/arch")
+        if exists(archFile):
+            with open(archFile, 'r') as f:
+                lines = f.read().split()
+                if lines:
+                    return lines[0]
+        if exists(join(self.rootPath, "usr/bin/dpkg")):
+            return ExecCmd().run("chroot '%s' dpkg --print-architecture 2>/dev/null" % self.rootPath, False, False).strip()
+        return ''
+
+    # Packages that dpkg -l lists as "ii"
+    def getInstalled(self):
+        return OrderedDict([(name, fields) for name, fields in self.getPackages().items()
+                            if fields['Want'] == 'install' and fields['State'] == 'installed'])
+
+    # Write the package list: "name<tab>version" for each installed package
+    def writePackages(self, path):
+        with open(path, 'w') as f:
+            installed = self.getInstalled()
+            for name in sorted(installed):
+                f.write("%s\t%s\n" % (name, installed[name].get('Version', '')))
+
+    # Write a manifest like: dpkg-query -W --showformat='${binary:Package}\t${Version}\n'
+    def writeManifest(self, path):
+        lines = []
+        for name, fields in self.getPackages().items():
+            if fields['State'] != 'not-installed':
+                lines.append("%s\t%s\n" % (name, fields.get('Version', '')))
+        with open(path, 'w') as f:
+            f.write(''.join(sorted(lines)))
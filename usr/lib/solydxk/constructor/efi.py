@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import errno
+import hashlib
+import tempfile
+from shutil import rmtree, copy2, which
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, exists, isdir, relpath
+from execcmd import ExecCmd
+from manifest import getFileHash
+import functions
+
+# Shared cache for the EFI files: for a given GRUB version, platform,
+# module list and prefix, efi-image and grub-mkimage produce the same files
+EFI_CACHE = "/var/cache/solydxk-constructor/efi"
+
+# Modules of the EFI files: only these, the modules the boot menus need
+# (see getMenuModules) and their dependencies end up on the ISO
+EFI_MODULES = "part_gpt part_msdos ntfs ntfscomp hfsplus fat ext2 normal chain boot configfile linux " \
+              "multiboot iso9660 gfxmenu gfxterm loadenv efi_gop efi_uga loadbios fixvideo png " \
+              "ext2 ntfscomp loopback search minicmd cat cpuid appleldr elf usb videotest " \
+              "halt help ls reboot echo test normal sleep memdisk tar font video_fb video " \
+              "gettext true  video_bochs video_cirrus multiboot2 acpi gfxterm_background gfxterm_menu " \
+              "all_video gzio"
+
+EFI_PREFIX = "/boot/grub"
+
+# Boot menus (relative to the boot directory): the modules they load with insmod
+# and the modules of the commands they use are added to EFI_MODULES
+EFI_MENUS = ["boot/grub/grub.cfg", "boot/grub/loopback.cfg"]
+
+# Words after which a menu line continues with a command
+COMMAND_PREFIXES = ['if', 'elif', 'while', 'until', 'then', 'do', 'else', '!']
+
+# Guest architecture: (GRUB architecture, EFI name, GRUB package)
+EFI_PLATFORMS = {'x86_64': ('x86_64', 'x64', 'grub-efi-amd64-bin'),
+                 'i386': ('i386', 'ia32', 'grub-efi-ia32-bin')}
+
+
+# Files that are hardlinked from the cache: the images and modules
+# Other files (grub.cfg, *.lst) are small and copied: an edit in one working directory
+# would otherwise change the cache and every other working directory
+EFI_LINKED = ['.img', '.efi', '.mod']
+
+# Hashes of the cached files, in the cache directory of the files
+EFI_MANIFEST = ".files.json"
+
+
+# Link a file, or copy it when the target is on another file system
+def linkFile(source, target):
+    if exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError as detail:
+        if detail.errno != errno.EXDEV:
+            raise
+        copy2(source, target)
+
+
+# Return {command: module} of the commands GRUB autoloads on a platform (command.lst)
+def getCommandModules(platform):
+    commands = {}
+    path = "/usr/lib/grub/{}/command.lst".format(platform)
+    if exists(path):
+        with open(path, 'r', errors='replace') as f:
+            for line in f.readlines():
+                command, sep, module = line.partition(':')
+                if sep:
+                    commands[command.strip().lstrip('*')] = module.strip()
+    return commands
+
+
+# Return the modules the boot menus of a boot directory load with insmod,
+# and the modules of the commands they use, which GRUB loads when the command runs
+def getMenuModules(bootPath, platform):
+    modules = []
+    commands = getCommandModules(platform)
+    for menu in EFI_MENUS:
+        path = join(bootPath, menu)
+        if exists(path):
+            with open(path, 'r', errors='replace') as f:
+                for line in f.readlines():
+                    words = line.split()
+                    if len(words) == 2 and words[0] == "insmod" and '$' not in words[1] and words[1] not in modules:
+                        modules.append(words[1])
+                    for i, word in enumerate(words):
+                        if word.startswith('#'):
+                            break
+                        if i == 0 or words[i - 1] in COMMAND_PREFIXES or words[i - 1].endswith(';'):
+                            module = commands.get(word.rstrip(';'))
+                            if module is not None and module not in modules:
+                                modules.append(module)
+    return modules
+
+
+# The EFI files of an ISO for one architecture:
+# boot/grub/efi.img, boot/grub/<platform>/ and efi/boot/boot<efi name>.efi
+# They are built once in <cache>/<key>: the images and modules are hardlinked into
+# the boot directories, the other files are copied
+class EfiArtifacts(object):
+
+    def __init__(self, architecture, modules=EFI_MODULES, prefix=EFI_PREFIX, cacheDir=EFI_CACHE):
+        self.ec = ExecCmd()
+        if architecture != "x86_64":
+            architecture = "i386"
+        grubArch, self.efiName, self.package = EFI_PLATFORMS[architecture]
+        self.platform = "%s-efi" % grubArch
+        self.grubEfiName = "boot%s" % self.efiName
+        self.modules = functions.getGrubModules(modules, self.platform)
+        missing = sorted(set([module for module in modules.split() if module not in self.modules]))
+        if missing:
+            print(("WARNING: GRUB modules not found for %s: %s" % (self.platform, " ".join(missing))))
+        self.prefix = prefix
+        self.cacheDir = cacheDir
+        self.path = join(self.cacheDir, self.getKey())
+
+    # Cache key: GRUB version, platform, modules, prefix and the scripts that build the files
+    def getKey(self):
+        version = self.ec.run("dpkg-query -W -f '${Version}' %s 2>/dev/null" % self.package, False, False).strip()
+        scripts = {}
+        for script in ["efi-image", "grub-cpmodules"]:
+            path = which(script)
+            scripts[script] = getFileHash(path) if path else None
+        data = {'grub': version, 'platform': self.platform, 'modules': self.modules,
+                'prefix': self.prefix, 'scripts': scripts}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    # Return {relative path: hash} of the files in a directory
+    def getFileHashes(self, path):
+        hashes = {}
+        for dirPath, dirNames, fileNames in os.walk(path):
+            for name in fileNames:
+                relPath = relpath(join(dirPath, name), path)
+                if relPath != EFI_MANIFEST:
+                    hashes[relPath] = getFileHash(join(dirPath, name))
+        return hashes
+
+    # The files are cached when they are all there and unchanged
+    def isCached(self):
+        manifest = join(self.path, EFI_MANIFEST)
+        if not exists(join(self.path, "boot/grub/efi.img")) or \
+           not exists(join(self.path, "efi/boot/%s.efi" % self.grubEfiName)) or not exists(manifest):
+            return False
+        with open(manifest, 'r') as f:
+            if json.load(f) != self.getFileHashes(self.path):
+                print(("WARNING: cached EFI files of %s changed: build them again" % self.platform))
+                return False
+        return True
+
+    # Build the files in a temporary directory and move it into the cache
+    def build(self):
+        if self.isCached():
+            print(("EFI files of %s are cached: %s" % (self.platform, self.path)))
+            return
+        print(("Building EFI files of %s" % self.platform))
+        if not exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        tmpDir = tempfile.mkdtemp(prefix=".build-", dir=self.cacheDir)
+        try:
+            outDir = join(tmpDir, "out")
+            modules = " ".join(self.modules)
+            # efi-image creates its temporary files in the current directory
+            self.ec.run("cd '{}' && efi-image '{}' {} {} {}".format(tmpDir, outDir, self.platform, self.efiName, modules))
+            if not exists(join(outDir, "efi.img")):
+                raise Exception("efi-image did not create %s" % join(outDir, "efi.img"))
+            os.rename(join(outDir, "efi.img"), join(outDir, "boot/grub/efi.img"))
+            os.makedirs(join(outDir, "efi/boot"))
+            efiFile = join(outDir, "efi/boot/%s.efi" % self.grubEfiName)
+            self.ec.run("grub-mkimage -O {0} -d /usr/lib/grub/{0} -o '{1}' -p \"{2}\" {3}".format(
+                self.platform, efiFile, self.prefix, modules))
+            if not exists(efiFile):
+                raise Exception("grub-mkimage did not create %s" % efiFile)
+            # The cached files are read-only and their hashes are checked before use
+            with open(join(outDir, EFI_MANIFEST), 'w') as f:
+                json.dump(self.getFileHashes(outDir), f, indent=2, sort_keys=True)
+            for dirPath, dirNames, fileNames in os.walk(outDir):
+                for name in fileNames:
+                    os.chmod(join(dirPath, name), 0o444)
+            # Another build may have finished first
+            if not self.isCached():
+                if exists(self.path):
+                    rmtree(self.path)
+                os.rename(outDir, self.path)
+        finally:
+            rmtree(tmpDir)
+
+    # Hardlink the cached images and copy the other files into a boot directory
+    def install(self, bootPath):
+        platformPath = join(bootPath, "boot/grub", self.platform)
+        if exists(platformPath):
+            rmtree(platformPath)
+        for dirPath, dirNames, fileNames in os.walk(self.path):
+            targetDir = join(bootPath, relpath(dirPath, self.path))
+            if not isdir(targetDir):
+                os.makedirs(targetDir)
+            for name in fileNames:
+                source = join(dirPath, name)
+                target = join(targetDir, name)
+                if relpath(source, self.path) == EFI_MANIFEST:
+                    continue
+                if os.path.splitext(name)[1] in EFI_LINKED:
+                    linkFile(source, target)
+                else:
+                    if exists(target):
+                        os.remove(target)
+                    copy2(source, target)
+                    os.chmod(target, 0o644)
+        print(("EFI files of %s installed in: %s" % (self.platform, bootPath)))
+
+
+# Build the EFI files of several architectures in parallel
+def buildEfiArtifacts(artifacts):
+    with ThreadPoolExecutor(max_workers=max(len(artifacts), 1)) as executor:
+        for result in executor.map(lambda a: a.build(), artifacts):
+            pass
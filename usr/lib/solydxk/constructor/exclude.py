@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+
+import re
+import stat
+from os.path import exists
+from fnmatch import fnmatchcase
+
+# Directories left out of the squashfs root and created empty in the image: (path, mode)
+EXCLUDE_DIRS = [('tmp', 0o1777), ('var/tmp', 0o1777), ('media', 0o755), ('var/backups', 0o755)]
+
+# Other paths left out of the squashfs root (mksquashfs wildcards, relative to root)
+EXCLUDE_WILDCARDS = ['offline', 'prune.list', 'boot/grub/grub.cfg', 'root/.nano_history', 'root/.bash_history',
+                     'var/cache/apt/*.bin', 'var/cache/apt/archives/*.deb', 'var/cache/apt/archives/partial/*',
+                     'var/cache/constructor', 'var/lib/constructor/deferred']
+
+# Files left out of the squashfs root (regular expressions on the path relative to root)
+# Directories are kept: the expressions are expanded to the matching files in the file index
+EXCLUDE_REGEXES = [r'^var/log/.+']
+
+
+# Escape the characters mksquashfs wildcards give a meaning
+def escapeWildcard(path):
+    return re.sub(r'([\\*?\[\]])', r'\\\1', path)
+
+
+# Check if a relative path is (inside) a path that matches a wildcard
+def matchWildcard(pattern, relPath):
+    patternParts = pattern.split('/')
+    pathParts = relPath.split('/')
+    if len(pathParts) < len(patternParts):
+        return False
+    for patternPart, pathPart in zip(patternParts, pathParts):
+        if not fnmatchcase(pathPart, patternPart):
+            return False
+    return True
+
+
+# Exclusion list and pseudo file definitions for mksquashfs: caches, logs and temporary
+# files stay in the working tree and are left out of the squashfs root at squash time
+class SquashfsExcludes(object):
+
+    def __init__(self, index, tree="root"):
+        self.index = index
+        self.tree = tree
+        self.wildcards = [path for path, mode in EXCLUDE_DIRS] + EXCLUDE_WILDCARDS
+        self.regexes = [re.compile(regex) for regex in EXCLUDE_REGEXES]
+        # The literal start of a wildcard filters most paths without matching
+        self.prefixes = [(re.split(r'[*?\[]', pattern)[0], pattern) for pattern in self.wildcards]
+        self.files = None
+
+    def isExcluded(self, relPath):
+        for prefix, pattern in self.prefixes:
+            if relPath.startswith(prefix) and matchWildcard(pattern, relPath):
+                return True
+        return False
+
+    # Return the files in the index that match the regular expressions
+    def getFiles(self):
+        if self.files is None:
+            self.files = []
+            for relPath, mode, size in self.index.getEntries(self.tree):
+                if stat.S_ISDIR(mode) or '\n' in relPath or self.isExcluded(relPath):
+                    continue
+                if any([regex.search(relPath) for regex in self.regexes]):
+                    self.files.append(relPath)
+            self.files.sort()
+        return self.files
+
+    # Return the size of the files that end up in the squashfs root (like du -b)
+    def getSize(self):
+        files = set(self.getFiles())
+        return sum([size for relPath, mode, size in self.index.getEntries(self.tree)
+                    if relPath not in files and not self.isExcluded(relPath)])
+
+    # Settings that change the exclusion list
+    def getSettings(self):
+        return {'dirs': EXCLUDE_DIRS, 'wildcards': EXCLUDE_WILDCARDS, 'regexes': EXCLUDE_REGEXES}
+
+    # Write the exclude file (-wildcards -ef) and the pseudo file (-pf)
+    def write(self, excludeFile, pseudoFile):
+        lines = self.wildcards + [escapeWildcard(relPath) for relPath in self.getFiles()]
+        self.writeFile(excludeFile, "%s\n" % "\n".join(lines))
+        lines = ["%s d %o 0 0" % (path, mode) for path, mode in EXCLUDE_DIRS]
+        self.writeFile(pseudoFile, "%s\n" % "\n".join(lines))
+
+    def writeFile(self, path, content):
+        if exists(path):
+            with open(path, 'r') as f:
+                if f.read() == content:
+                    return
+        with open(path, 'w') as f:
+            f.write(content)
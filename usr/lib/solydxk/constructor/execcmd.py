@@ -1,14 +1,33 @@
 #! /usr/bin/env python3
 
+import os
 import sys
+import time
+import signal
+import threading
 import subprocess
 
+# Seconds a cancelled command gets to terminate before it is killed
+KILL_TIMEOUT = 10
+
+
+# Raised when a command was killed because its cancel event was set
+class CommandCancelled(Exception):
+    pass
+
 
 # Class to execute a command and return the output in an array
+# cancelEvent: a threading.Event; setting it kills the running command and all
+#              its child processes. Commands started after the event was set
+#              (e.g. restoring a chroot) are not killed.
+# cancellable: set to False to run commands that must not be interrupted
+#              (e.g. dpkg transactions) to the end; the caller checks the event afterwards
 class ExecCmd(object):
 
-    def __init__(self, loggerObject=None):
+    def __init__(self, loggerObject=None, cancelEvent=None):
         self.log = loggerObject
+        self.cancelEvent = cancelEvent
+        self.cancellable = True
 
     def run(self, cmd, realTime=True, returnAsList=True):
         msg = "Command to execute: %(cmd)s" % { "cmd": cmd }
@@ -17,7 +36,15 @@ class ExecCmd(object):
         else:
             print(msg)
 
-        p = subprocess.Popen([cmd], shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # A cancellable command runs in its own process group
+        cancellable = self.cancellable and self.cancelEvent is not None and not self.cancelEvent.is_set()
+        p = subprocess.Popen([cmd], shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             start_new_session=cancellable)
+        cancelled = threading.Event()
+        if cancellable:
+            watcher = threading.Thread(target=self.killOnCancel, args=(p, cancelled))
+            watcher.daemon = True
+            watcher.start()
         lstOut = []
         while True:
             line = p.stdout.readline()
@@ -32,8 +59,29 @@ class ExecCmd(object):
                 else:
                     print(line)
             sys.stdout.flush()
+        p.wait()
+        if cancelled.is_set():
+            raise CommandCancelled("Cancelled: %s" % cmd)
 
         ret = lstOut
         if not returnAsList:
             ret = "\n".join(lstOut)
         return ret
+
+    # Terminate the process group of a command when the cancel event is set
+    # and kill it when it did not stop within KILL_TIMEOUT seconds
+    def killOnCancel(self, process, cancelled):
+        while process.poll() is None:
+            if self.cancelEvent.wait(0.5):
+                cancelled.set()
+                for sig in [signal.SIGTERM, signal.SIGKILL]:
+                    try:
+                        os.killpg(process.pid, sig)
+                    except ProcessLookupError:
+                        return
+                    deadline = time.time() + KILL_TIMEOUT
+                    while process.poll() is None and time.time() < deadline:
+                        time.sleep(0.2)
+                    if process.poll() is not None:
+                        return
+                return
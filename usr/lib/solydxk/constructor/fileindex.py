@@ -0,0 +1,230 @@
+#! /usr/bin/env python3
+
+import os
+import stat
+import sqlite3
+import hashlib
+from datetime import datetime
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os.path import join, exists, basename, dirname
+from manifest import getManifestEntry
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS files (tree TEXT, path BLOB, inode INTEGER, size INTEGER, mtime INTEGER, "
+    "mode INTEGER, uid INTEGER, gid INTEGER, link BLOB, md5 TEXT, gen INTEGER, deleted INTEGER DEFAULT 0, "
+    "PRIMARY KEY (tree, path))",
+    "CREATE INDEX IF NOT EXISTS files_gen ON files (gen)",
+    "CREATE INDEX IF NOT EXISTS files_inode ON files (inode, size, mtime)",
+    "CREATE TABLE IF NOT EXISTS builds (name TEXT PRIMARY KEY, gen INTEGER, time TEXT)",
+    "CREATE TABLE IF NOT EXISTS generation (gen INTEGER)"
+]
+
+
+# Scan one directory: return its entries (relative path, stat, link target) and sub directories
+def scanDirectory(top, relDir):
+    entries = []
+    subDirs = []
+    try:
+        with os.scandir(join(top, relDir)) as it:
+            for entry in it:
+                relPath = join(relDir, entry.name)
+                st = entry.stat(follow_symlinks=False)
+                link = None
+                if stat.S_ISLNK(st.st_mode):
+                    link = os.readlink(entry.path)
+                elif stat.S_ISDIR(st.st_mode):
+                    subDirs.append(relPath)
+                entries.append((relPath, st, link))
+    except (FileNotFoundError, NotADirectoryError, PermissionError) as detail:
+        # The directory vanished or cannot be read while walking
+        print(("ERROR: scanDirectory: {}".format(detail)))
+    return (entries, subDirs)
+
+
+# Walk a directory tree with several directories scanned at the same time
+# Return a list of (relative path, stat, link target)
+def scanTree(top, workers=8):
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set([executor.submit(scanDirectory, top, '')])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subDirs = future.result()
+                results.extend(entries)
+                for relDir in subDirs:
+                    pending.add(executor.submit(scanDirectory, top, relDir))
+    return results
+
+
+# Return the md5 of a file
+def getFileMd5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+# Order of os.walk with sorted directories: the entries of a directory before those of its sub directories
+def walkOrder(relPath):
+    parent = dirname(relPath)
+    return (tuple(parent.split('/')) if parent else (), basename(relPath))
+
+
+# Persistent index of the files in the trees (root, boot, ...) of a working directory
+# Stored in <working directory>/.constructor/index.db
+# Each refresh is a new generation: entries that were added, changed or deleted get
+# that generation, so changes since a build are the entries with a newer generation.
+# md5 sums are kept as long as inode, size and modification time do not change.
+class FileIndex(object):
+
+    def __init__(self, distroPath, indexFile=None):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.distroPath = distroPath
+        self.indexFile = indexFile
+        if self.indexFile is None:
+            statePath = join(distroPath, ".constructor")
+            if not exists(statePath):
+                os.makedirs(statePath)
+            self.indexFile = join(statePath, "index.db")
+
+    # Connections are not shared: BuildIso runs the index in its own thread
+    def connect(self):
+        db = sqlite3.connect(self.indexFile)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        return db
+
+    def getGeneration(self, db):
+        row = db.execute("SELECT gen FROM generation").fetchone()
+        return row[0] if row else 0
+
+    # Tree name of a path in the working directory (e.g. boot or variants/de/boot)
+    def getTreeName(self, path):
+        return os.path.relpath(path, self.distroPath)
+
+    # Bring the index of a tree up to date with one walk
+    # Return the number of added, changed and deleted entries
+    def refresh(self, tree):
+        top = join(self.distroPath, tree)
+        scanned = scanTree(top) if exists(top) else []
+        with closing(self.connect()) as db:
+            with db:
+                gen = self.getGeneration(db) + 1
+                db.execute("DELETE FROM generation")
+                db.execute("INSERT INTO generation (gen) VALUES (?)", (gen,))
+
+                stored = {}
+                for row in db.execute("SELECT path, inode, size, mtime, mode, uid, gid, link, md5, deleted FROM files WHERE tree=?", (tree,)):
+                    stored[row[0]] = row[1:]
+
+                updates = []
+                for relPath, st, link in scanned:
+                    path = os.fsencode(relPath)
+                    link = os.fsencode(link) if link is not None else None
+                    state = (st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode, st.st_uid, st.st_gid, link)
+                    old = stored.pop(path, None)
+                    if old is not None and old[:7] == state and not old[8]:
+                        continue
+                    # Content is unchanged when inode, size and modification time are
+                    md5 = old[7] if old is not None and old[:3] == state[:3] else None
+                    updates.append((tree, path) + state + (md5, gen))
+                db.executemany("INSERT OR REPLACE INTO files (tree, path, inode, size, mtime, mode, uid, gid, link, md5, gen, deleted) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)", updates)
+
+                deletes = [(gen, tree, path) for path, old in stored.items() if not old[8]]
+                db.executemany("UPDATE files SET deleted=1, gen=? WHERE tree=? AND path=?", deletes)
+        print(("Index {}: {} changed, {} deleted".format(tree, len(updates), len(deletes))))
+        return len(updates) + len(deletes)
+
+    # Remember the current generation as a build
+    def markBuild(self, name):
+        with closing(self.connect()) as db:
+            with db:
+                db.execute("INSERT OR REPLACE INTO builds (name, gen, time) VALUES (?, ?, ?)",
+                           (name, self.getGeneration(db), datetime.now().isoformat()))
+
+    # Return the entries that changed and were deleted since a build: ([(tree, path)], [(tree, path)])
+    # Everything is changed for an unknown build
+    def getChanges(self, build, tree=None):
+        changed = []
+        deleted = []
+        with closing(self.connect()) as db:
+            row = db.execute("SELECT gen FROM builds WHERE name=?", (build,)).fetchone()
+            gen = row[0] if row else -1
+            query = "SELECT tree, path, deleted FROM files WHERE gen > ?"
+            args = [gen]
+            if tree is not None:
+                query += " AND tree=?"
+                args.append(tree)
+            for rowTree, path, isDeleted in db.execute(query, args):
+                if isDeleted:
+                    deleted.append((rowTree, os.fsdecode(path)))
+                else:
+                    changed.append((rowTree, os.fsdecode(path)))
+        return (changed, deleted)
+
+    # Return (relative path, mode, size) of the entries of an indexed tree
+    def getEntries(self, tree):
+        with closing(self.connect()) as db:
+            return [(os.fsdecode(path), mode, size) for path, mode, size in
+                    db.execute("SELECT path, mode, size FROM files WHERE tree=? AND deleted=0", (tree,))]
+
+    # Return the manifest hash and the latest modification time (seconds) of an indexed tree
+    # Entries are hashed in walk order with manifest.getManifestEntry
+    def getManifest(self, tree, excludes=[]):
+        excludes = [e.strip('/') for e in excludes]
+        entries = []
+        with closing(self.connect()) as db:
+            for row in db.execute("SELECT path, mode, uid, gid, size, mtime, link FROM files WHERE tree=? AND deleted=0", (tree,)):
+                relPath = os.fsdecode(row[0])
+                if any([relPath == e or relPath.startswith(e + '/') for e in excludes]):
+                    continue
+                entries.append((walkOrder(relPath), relPath, row))
+        entries.sort(key=lambda e: e[0])
+        sha = hashlib.sha256()
+        latest = 0
+        for order, relPath, (path, mode, uid, gid, size, mtime, link) in entries:
+            sha.update(getManifestEntry(relPath, mode, uid, gid, size, mtime, os.fsdecode(link) if link is not None else None))
+            latest = max(latest, mtime // 1000000000)
+        return (sha.hexdigest(), latest)
+
+    # Write an md5sum file of the regular files of an indexed tree
+    # Only files without a known md5 are read: hardlinked copies in other trees share theirs
+    def writeMd5sums(self, tree, target, excludeNames=[], workers=4):
+        top = join(self.distroPath, tree)
+        with closing(self.connect()) as db:
+            rows = [row for row in db.execute("SELECT path, inode, size, mtime, mode, md5 FROM files WHERE tree=? AND deleted=0", (tree,))
+                    if stat.S_ISREG(row[4]) and basename(os.fsdecode(row[0])) not in excludeNames]
+
+            sums = {}
+            found = {}
+            missing = []
+            for path, inode, size, mtime, mode, md5 in rows:
+                if md5 is None:
+                    shared = db.execute("SELECT md5 FROM files WHERE inode=? AND size=? AND mtime=? AND md5 IS NOT NULL AND deleted=0 LIMIT 1",
+                                        (inode, size, mtime)).fetchone()
+                    if shared:
+                        found[path] = shared[0]
+                    else:
+                        missing.append(path)
+                sums[path] = md5
+
+            if missing:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for path, md5 in zip(missing, executor.map(lambda p: getFileMd5(join(top, os.fsdecode(p))), missing)):
+                        found[path] = md5
+            sums.update(found)
+            with db:
+                db.executemany("UPDATE files SET md5=? WHERE tree=? AND path=?", [(md5, tree, path) for path, md5 in found.items()])
+        print(("Md5 sums {}: {} of {} files read".format(tree, len(missing), len(sums))))
+
+        lines = [b"%s  ./%s\n" % (sums[path].encode('ascii'), path) for path in sorted(sums)]
+        with open(target, 'wb') as f:
+            f.write(b''.join(lines))
@@ -0,0 +1,30 @@
+#!/bin/bash
+
+# Boot benchmark of a live session, written to the serial console
+# Prints the boot milestones (seconds since the kernel started) and powers off
+
+CONSOLE='/dev/ttyS0'
+
+function milestone {
+  echo "CONSTRUCTOR-BENCH $1 ${2:--}" > $CONSOLE
+}
+
+# Time stamp of the first kernel message that matches
+function kernel_time {
+  dmesg | grep -m1 -E "$1" | sed -n 's/^\[ *\([0-9.]*\)\].*/\1/p'
+}
+
+milestone initrd "$(kernel_time 'Run /init as init process|Freeing unused kernel (image )?memory')"
+milestone squashfs "$(kernel_time 'squashfs: version|SQUASHFS')"
+milestone rootfs "$(kernel_time 'systemd\[1\]: (systemd [0-9]+ running|Detected virtualization|Detected architecture)')"
+
+# Wait until the default target (graphical.target or multi-user.target) is reached
+TARGET=$(systemctl get-default)
+until systemctl -q is-active "$TARGET"; do
+  sleep 0.5
+done
+MONOTONIC=$(systemctl show -p ActiveEnterTimestampMonotonic $TARGET | cut -d'=' -f2)
+milestone target "$(awk -v us="$MONOTONIC" 'BEGIN { if (us > 0) printf "%.3f", us / 1000000 }')"
+
+echo "CONSTRUCTOR-BENCH-DONE $(cut -d' ' -f1 /proc/uptime)" > $CONSOLE
+systemctl poweroff
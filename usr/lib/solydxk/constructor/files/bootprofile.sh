@@ -0,0 +1,36 @@
+#!/bin/bash
+
+# Boot profile of a live session, written to the serial console
+# Usage: bootprofile.sh STAGE [poweroff]
+# Prints a marker for the stage and, when booted with constructor.profile=files,
+# the files of the squashfs root that have been read so far (page cache residency)
+
+STAGE=$1
+CONSOLE='/dev/ttyS0'
+[ -w $CONSOLE ] || CONSOLE='/dev/console'
+
+# The graphical stage starts with the display manager: wait until the default target is reached
+if [ "$STAGE" == "graphical" ]; then
+  TARGET=$(systemctl get-default)
+  until systemctl -q is-active "$TARGET"; do
+    sleep 0.5
+  done
+fi
+
+echo "CONSTRUCTOR-PROFILE-STAGE $STAGE $(cut -d' ' -f1 /proc/uptime)" > $CONSOLE
+
+if grep -qw 'constructor.profile=files' /proc/cmdline; then
+  ROOTFS=$(awk '$3=="squashfs" && $2 ~ /filesystem\.squashfs$/ {print $2; exit}' /proc/mounts)
+  if [ -n "$ROOTFS" ] && which fincore >/dev/null; then
+    cd "$ROOTFS"
+    find . -xdev -type f -print0 | xargs -0 fincore --noheadings --raw --bytes --output RES,FILE 2>/dev/null | \
+      awk -v stage="$STAGE" '{ res = $1; sub(/^[0-9]+ +\.\//, ""); if (res > 0) print "CONSTRUCTOR-PROFILE-FILE " stage " " $0 }' > $CONSOLE
+  else
+    echo "CONSTRUCTOR-PROFILE-ERROR squashfs root or fincore not found" > $CONSOLE
+  fi
+fi
+
+if [ "$2" == "poweroff" ]; then
+  echo "CONSTRUCTOR-PROFILE-DONE $(cut -d' ' -f1 /proc/uptime)" > $CONSOLE
+  systemctl poweroff
+fi
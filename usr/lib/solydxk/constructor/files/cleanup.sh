@@ -1,8 +1,5 @@
 #!/bin/bash
 
-# Packages that deborphan must NOT treat as orphans - comma separated list
-NotOrphan='baloo'
-
 function sed_append_sting {
   PATTERN=$1
   LINE=$2
@@ -19,8 +16,71 @@ function sed_append_sting {
   fi
 }
 
+# Stamps of expensive steps: a step is skipped when the dpkg status
+# and the step's inputs did not change since the step last ran
+STAMPDIR='/var/cache/constructor/stamps'
+REPORT='/var/cache/constructor/cleanup.report'
+FORCE=false
+
+function input_key {
+  {
+    md5sum /var/lib/dpkg/status
+    for INPUT in "$@"; do
+      if [ -d "$INPUT" ]; then
+        find "$INPUT" -type f -printf '%p %s %T@\n' | sort
+      elif [ -f "$INPUT" ]; then
+        md5sum "$INPUT"
+      else
+        echo "$INPUT"
+      fi
+    done
+  } | md5sum | cut -d' ' -f1
+}
+
+# Usage: run_step NAME "INPUTS" COMMAND [ARGUMENTS]
+# INPUTS is a space separated list of files, directories and strings
+function run_step {
+  NAME=$1
+  INPUTS=$2
+  shift 2
+  STAMP="$STAMPDIR/$NAME"
+  KEY=$(input_key $INPUTS)
+  if ! $FORCE && [ -e "$STAMP" ] && grep -qx "$KEY" "$STAMP"; then
+    echo "Skip unchanged step: $NAME"
+    printf "%-20s %-8s %8s\n" "$NAME" "skipped" "0.00s" >> "$REPORT"
+    return 0
+  fi
+  START=$(date +%s%N)
+  "$@"
+  RET=$?
+  END=$(date +%s%N)
+  SECS=$(awk "BEGIN { printf \"%.2f\", ($END - $START) / 1000000000 }")
+  if [ $RET -ne 0 ]; then
+    # No stamp: a failed step runs again on the next build
+    rm -f "$STAMP"
+    printf "%-20s %-8s %7ss\n" "$NAME" "failed" "$SECS" >> "$REPORT"
+    return $RET
+  fi
+  # Keep the key before and after the step: the step itself may change the dpkg status
+  printf "%s\n%s\n" "$KEY" "$(input_key $INPUTS)" > "$STAMP"
+  printf "%-20s %-8s %7ss\n" "$NAME" "ran" "$SECS" >> "$REPORT"
+}
+
+while [ "${1:0:2}" == "--" ]; do
+  case $1 in
+    --force) FORCE=true ;;
+  esac
+  shift
+done
+
 PLYMOUTHTHEME=$1
 
+mkdir -p "$STAMPDIR"
+printf "%-20s %-8s %8s\n" "STEP" "STATUS" "TIME" > "$REPORT"
+
+# Finish package transactions an earlier session left unfinished
+dpkg --configure -a
+
 # Remove fake mime types in kde
 if [ -e /usr/share/mime/packages/kde.xml ]; then
   sed -i -e /\<.*fake.*\>/,/^$/d /usr/share/mime/packages/kde.xml
@@ -37,47 +97,38 @@ if [ -e '/usr/lib/solydxk/updatemanager/files' ]; then
 fi
 
 # Make sure all firmware drivers are installed
-sudo apt-get -y --force-yes install $(aptitude search ^firmware | grep ^p | awk '{print $2}')
+function install_firmware {
+  sudo apt-get -y --force-yes install $(aptitude search ^firmware | grep ^p | awk '{print $2}')
+}
+run_step firmware "/var/lib/apt/lists" install_firmware
+
+# Purge unavailable packages (when not manually held back), orphaned packages
+# and left over configuration files in a single transaction
+# The list is computed by the constructor before running this script:
+# only purge what is still known to dpkg, or apt refuses the whole transaction
+if [ -s /prune.list ]; then
+  PRUNE=$(dpkg-query -W -f='${db:Status-Status} ${binary:Package}\n' | awk '$1 != "not-installed" {print $2}' | grep -Fx -f /prune.list)
+  if [ "$PRUNE" != "" ]; then
+    echo "Purging $(echo "$PRUNE" | wc -l) packages . . ."
+    apt-get -y --force-yes purge $PRUNE
+  fi
+fi
 
 # Cleanup
-apt-get -y --force-yes clean
+# The apt archives, caches, logs and temporary files stay: the constructor leaves them out of the squashfs
 apt-get -y --force-yes autoremove
 aptitude -y purge ~c
 aptitude -y unmarkauto ~M
 find . -type f -name "*.dpkg*" -exec rm {} \;
 
-# Remove unavailable packages only when not manually held back
-for PCK in $(env LANG=C bash -c "apt-show-versions | grep 'available' | cut -d':' -f1"); do
-  REMOVE=true
-  for HELDPCK in $(env LANG=C dpkg --get-selections | grep hold$ | awk '{print $1}'); do
-    if [ $PCK == $HELDPCK ]; then
-      REMOVE=false
-    fi
-  done
-  if $REMOVE; then
-    apt-get purge -y --force-yes $PCK
-  fi
-done
-
-# Removing orphaned packages, except the ones listed in NotOrphan
-echo "Removing orphaned packages . . ."
-Exclude=${NotOrphan//,/\/d;/}
-Orphaned=$(deborphan | sed '/'$Exclude'/d')
-while [ "$Orphaned" ]; do
-   apt-get -y --force-yes purge $Orphaned
-   RC=$(dpkg-query -l | sed -n 's/^rc\s*\(\S*\).*/\1/p')
-   [ "$RC" ] && apt-get -y --force-yes purge $RC
-   Orphaned=$(deborphan | sed '/'$Exclude':/d')
-done
-
 # Disable memtest in Grub
 chmod -x /etc/grub.d/20_memtest86+
 
 # Set plymouth theme
 if [ "$PLYMOUTHTHEME" != "" ]; then
-  plymouth-set-default-theme -R $PLYMOUTHTHEME
+  run_step plymouth "$PLYMOUTHTHEME /etc/initramfs-tools $(readlink /vmlinuz)" plymouth-set-default-theme -R $PLYMOUTHTHEME
   echo "Plymouth theme set: $(plymouth-set-default-theme)"
-  update-grub
+  run_step update-grub "$PLYMOUTHTHEME /etc/default/grub /etc/grub.d" update-grub
 fi
 
 # Configure LightDM
@@ -109,14 +160,14 @@ fi
 /usr/lib/solydxk/system/adjust.py
 
 # Refresh xapian database
-update-apt-xapian-index
+run_step xapian "/var/lib/apt/lists" update-apt-xapian-index
 
 # Update database for mlocate
-updatedb
+run_step updatedb "/etc/updatedb.conf" updatedb
 
-# Update geoip database
+# Update geoip database (at least once a month)
 if [ -e /usr/sbin/update-geoip-database ]; then
-  /usr/sbin/update-geoip-database
+  run_step geoip "$(date +%Y%m)" /usr/sbin/update-geoip-database
 fi
 
 # Recreate pixbuf cache
@@ -136,23 +187,6 @@ ufw default allow outgoing
 ufw allow CIFS
 ufw enable
 
-# Cleanup temporary files
-rm -rf /media/*
-rm -rf /var/backups/*
-rm -rf /tmp/*
-rm -rf /tmp/.??*
-rm -rf /var/tmp/*
-rm -rf /var/tmp/.??*
-if [ -d /offline ]; then
-  rm -rf /offline
-fi
-
-# Delete all log files
-find /var/log -type f -delete
-
-# Delete grub.cfg: it will be generated during install
-rm -rf /boot/grub/grub.cfg
-
 # Removing redundant kernel module structure(s) from /lib/modules (if any)
 VersionPlusArch=$(ls -l /vmlinuz | sed 's/.*\/vmlinuz-\(.*\)/\1/')
 L=${#VersionPlusArch}
@@ -162,3 +196,8 @@ for I in /lib/modules/*; do
       rm -fr $I
    fi
 done
+
+# Show which steps ran and how long they took
+echo "=================================="
+cat "$REPORT"
+echo "=================================="
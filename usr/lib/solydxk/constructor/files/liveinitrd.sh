@@ -0,0 +1,48 @@
+#!/bin/bash
+
+# Build the initrd of the live ISO with its own compression and module list
+# Usage: liveinitrd.sh COMPRESS OUTPUT [MODULES]
+# MODULES: file with the modules to include (MODULES=list); without it the module set is not changed
+
+COMPRESS=$1
+OUTPUT=$2
+MODULES=$3
+
+if [ -z "$COMPRESS" ] || [ -z "$OUTPUT" ]; then
+  echo "Usage: $0 COMPRESS OUTPUT [MODULES]"
+  exit 1
+fi
+
+VERSION=$(readlink /vmlinuz | sed 's/.*vmlinuz-//')
+if [ ! -d "/lib/modules/$VERSION" ]; then
+  echo "Cannot find the modules of kernel $VERSION"
+  exit 1
+fi
+
+# The compressor must be installed and known to this version of initramfs-tools
+if ! command -v $COMPRESS >/dev/null; then
+  echo "$COMPRESS not found"
+  exit 1
+fi
+if ! grep -Eq "^[[:space:]]*$COMPRESS\)" "$(command -v mkinitramfs)"; then
+  echo "initramfs-tools cannot compress with $COMPRESS"
+  exit 1
+fi
+
+# Work on a copy of the configuration: the installed system keeps its own
+CONFDIR=$(mktemp -d /tmp/initramfs-live.XXXXXX)
+cp -a /etc/initramfs-tools/. $CONFDIR/
+
+sed -i '/^COMPRESS=/d' $CONFDIR/initramfs.conf
+echo "COMPRESS=$COMPRESS" >> $CONFDIR/initramfs.conf
+
+if [ -f "$MODULES" ]; then
+  sed -i '/^MODULES=/d' $CONFDIR/initramfs.conf
+  echo "MODULES=list" >> $CONFDIR/initramfs.conf
+  cp -f "$MODULES" $CONFDIR/modules
+fi
+
+mkinitramfs -d $CONFDIR -o "$OUTPUT" $VERSION
+RET=$?
+rm -rf $CONFDIR
+exit $RET
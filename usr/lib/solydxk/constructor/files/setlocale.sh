@@ -10,24 +10,60 @@ ko_KR='fonts-unfonts* im-config fcitx fcitx-hangul fcitx-frontend-gtk3 fcitx-ui-
 ja_JP='fonts-vlgothic fonts-takao im-config fcitx fcitx-mozc fcitx-frontend-gtk3 fcitx-ui-classic fcitx-config-gtk mozc-utils-gui'
 
 
+# Indexes of installed packages and of package names in the repositories
+# They are loaded once: see loadIndexes
+declare -A INSTALLED
+declare -A AVAILABLE
+
+function loadIndexes {
+    INSTALLED=()
+    AVAILABLE=()
+    while read PKG; do
+        INSTALLED[$PKG]=1
+    done < <(dpkg-query -W -f '${Status} ${Package}\n' | awk '$3 == "installed" {print $4}')
+    while read PKG; do
+        AVAILABLE[$PKG]=1
+    done < <(apt-cache pkgnames)
+}
+
 # Check if package is installed
 function isInstalled() {
-    PKG=$(dpkg-query -l $1 | grep ^i)
-    if [ "${PKG:0:1}" == "i" ]; then
-        return 0
-    else
-        return 1
-    fi
+    [ -n "${INSTALLED[$1]}" ]
 }
 
 # Check if package exists in the repositories
 function doesExist() {
-    PKG=$(apt-cache pkgnames | grep ^"$1"$)
-    if [ "$PKG" == "$1" ]; then
-        return 0
-    else
-        return 1
+    [ -n "${AVAILABLE[$1]}" ]
+}
+
+# Packages to install in a single transaction
+PACKAGES=''
+
+# Add the first package that exists in the repositories
+function addPackage() {
+    for PKG in "$@"; do
+        if doesExist "$PKG"; then
+            PACKAGES="$PACKAGES $PKG"
+            return 0
+        fi
+    done
+    echo "No package found: $*"
+    return 1
+}
+
+# Add all packages in the repositories that match a pattern (e.g. fonts-unfonts*)
+function addPattern() {
+    local FOUND=1
+    for PKG in "${!AVAILABLE[@]}"; do
+        if [[ "$PKG" == $1 ]]; then
+            PACKAGES="$PACKAGES $PKG"
+            FOUND=0
+        fi
+    done
+    if [ $FOUND -ne 0 ]; then
+        echo "No package found: $1"
     fi
+    return $FOUND
 }
 
 # Change FF/TB prefs.js file
@@ -51,18 +87,34 @@ function localizeLive() {
         PRM=$1
         VAL=$2
         if grep -q $PRM "$LIVE"; then
-            sed -i -e "s/.*$PRM.*/export $PRM=\"$VAL\"" "$LIVE"
+            sed -i -e "s|.*$PRM.*|export $PRM=\"$VAL\"|" "$LIVE"
         else
             echo "export $PRM=\"$VAL\"" >> "$LIVE"
         fi
     fi
 }
 
+# Usage: setlocale.sh [LOCALE TIMEZONE]
+# e.g.: setlocale.sh de_DE.UTF-8 Europe/Berlin
+# Without parameters, locales and tzdata are configured interactively
+LOCALE=$1
+TIMEZONE=$2
+
 # Set locale
-#echo "$LOC.UTF-8 UTF-8" >> /etc/locale.gen
-#locale-gen
-#update-locale LANG="$LOC.UTF-8"
-dpkg-reconfigure locales
+if [ "$LOCALE" != "" ]; then
+    if [ "${LOCALE/./}" == "$LOCALE" ]; then
+        LOCALE="$LOCALE.UTF-8"
+    fi
+    if grep -q "^#\s*$LOCALE\s" /etc/locale.gen; then
+        sed -i -e "s/^#\s*\($LOCALE\s\)/\1/" /etc/locale.gen
+    elif ! grep -q "^$LOCALE\s" /etc/locale.gen; then
+        echo "$LOCALE ${LOCALE#*.}" >> /etc/locale.gen
+    fi
+    locale-gen
+    update-locale LANG="$LOCALE"
+else
+    dpkg-reconfigure locales
+fi
 . /etc/default/locale
 LOC=$(echo $LANG | cut -d'.' -f 1)
 LOC1=$(echo $LOC | cut -d'_' -f 1)
@@ -71,50 +123,53 @@ LOC2L=${LOC2U,,}
 
 
 # Set timezone
-dpkg-reconfigure  tzdata
-TIMEZONE=$(cat /etc/timezone)
-cp -vf /usr/share/zoneinfo/$TIMEZONE /etc/localtime
+if [ "$TIMEZONE" != "" ]; then
+    if [ ! -e "/usr/share/zoneinfo/$TIMEZONE" ]; then
+        echo "Unknown timezone: $TIMEZONE"
+        exit 1
+    fi
+    echo "$TIMEZONE" > /etc/timezone
+    cp -vf /usr/share/zoneinfo/$TIMEZONE /etc/localtime
+    dpkg-reconfigure -f noninteractive tzdata
+else
+    dpkg-reconfigure  tzdata
+    TIMEZONE=$(cat /etc/timezone)
+    cp -vf /usr/share/zoneinfo/$TIMEZONE /etc/localtime
+fi
 
 # Live configuration
 localizeLive 'LIVE_LOCALES' "$LANG"
 localizeLive 'LIVE_TIMEZONE' "$TIMEZONE"
 localizeLive 'LIVE_UTC' 'no'
 
-# Update cache before installing packages
+# Update cache before resolving packages
 apt-get update
+loadIndexes
 
 # KDE
 if isInstalled "kde-runtime"; then
     echo "Localizing KDE..."
-    if doesExist "kde-l10n-$LOC1$LOC2L"; then
-        apt-get install --yes --force-yes kde-l10n-$LOC1$LOC2L
-    else
-        apt-get install --yes --force-yes kde-l10n-$LOC1
-    fi
+    addPackage kde-l10n-$LOC1$LOC2L kde-l10n-$LOC1
 fi
 
 # LibreOffice
 if isInstalled "libreoffice"; then
     echo "Localizing LibreOffice..."
     if doesExist "libreoffice-l10n-$LOC1-$LOC2L"; then
-        apt-get install --yes --force-yes libreoffice-l10n-$LOC1-$LOC2L
-        apt-get install --yes --force-yes libreoffice-help-$LOC1-$LOC2L
-        apt-get install --yes --force-yes myspell-$LOC1-$LOC2L
+        addPackage libreoffice-l10n-$LOC1-$LOC2L
+        addPackage libreoffice-help-$LOC1-$LOC2L libreoffice-help-$LOC1
+        addPackage myspell-$LOC1-$LOC2L myspell-$LOC1
     else
-        apt-get install --yes --force-yes libreoffice-l10n-$LOC1
-        apt-get install --yes --force-yes libreoffice-help-$LOC1
-        apt-get install --yes --force-yes myspell-$LOC1
+        addPackage libreoffice-l10n-$LOC1
+        addPackage libreoffice-help-$LOC1
+        addPackage myspell-$LOC1
     fi
 fi
 
 # Firefox ESR
 if isInstalled "firefox-esr"; then
     echo "Localizing Firefox ESR..."
-    if doesExist "firefox-esr-l10n-$LOC1-$LOC2L"; then
-        apt-get install --yes --force-yes firefox-esr-l10n-$LOC1-$LOC2L
-    else
-        apt-get install --yes --force-yes firefox-esr-l10n-$LOC1
-    fi
+    addPackage firefox-esr-l10n-$LOC1-$LOC2L firefox-esr-l10n-$LOC1
     PREF='/etc/skel/.mozilla/firefox/mwad0hks.default/prefs.js'
     localizePref $PREF 'spellchecker.dictionary' $LOC
     localizePref $PREF 'extensions.qls.visiblemenuitems' "$LOC1-$LOC2U#en-US"
@@ -126,11 +181,7 @@ fi
 # Firefox
 if isInstalled "firefox"; then
     echo "Localizing Firefox..."
-    if doesExist "firefox-l10n-$LOC1-$LOC2L"; then
-        apt-get install --yes --force-yes firefox-l10n-$LOC1-$LOC2L
-    else
-        apt-get install --yes --force-yes firefox-l10n-$LOC1
-    fi
+    addPackage firefox-l10n-$LOC1-$LOC2L firefox-l10n-$LOC1
     PREF='/etc/skel/.mozilla/firefox/mwad0hks.default/prefs.js'
     localizePref $PREF 'spellchecker.dictionary' $LOC
     localizePref $PREF 'extensions.qls.visiblemenuitems' "$LOC1-$LOC2U#en-US"
@@ -142,11 +193,7 @@ fi
 # Thunderbird
 if isInstalled "thunderbird"; then
     echo "Localizing Thunderbird..."
-    if doesExist "thunderbird-l10n-$LOC1-$LOC2L"; then
-        apt-get install --yes --force-yes thunderbird-l10n-$LOC1-$LOC2L
-    else
-        apt-get install --yes --force-yes thunderbird-l10n-$LOC1
-    fi
+    addPackage thunderbird-l10n-$LOC1-$LOC2L thunderbird-l10n-$LOC1
     PREF='/etc/skel/.thunderbird/pjzwmea6.default/prefs.js'
     localizePref $PREF 'spellchecker.dictionary' $LOC1
     localizePref $PREF 'extensions.qls.visiblemenuitems' "$LOC1-$LOC2U#en-US"
@@ -155,10 +202,25 @@ if isInstalled "thunderbird"; then
     localizePref $PREF 'general.useragent.locale' "$LOC1-$LOC2U"
 fi
 
-# Install locale specific packages
-if [ "$LOC" == "zh_TW" ]; then apt-get install --yes --force-yes $zh_TW; fi
-if [ "$LOC" == "zh_SG" ]; then apt-get install --yes --force-yes $zh_SG; fi
-if [ "$LOC" == "zh_HK" ]; then apt-get install --yes --force-yes $zh_HK; fi
-if [ "$LOC" == "zh_CN" ]; then apt-get install --yes --force-yes $zh_CN; fi
-if [ "$LOC" == "ko_KR" ]; then apt-get install --yes --force-yes $ko_KR; fi
-if [ "$LOC" == "ja_JP" ]; then apt-get install --yes --force-yes $ja_JP; fi
+# Locale specific packages
+# Every name is checked: one unknown package would fail the whole transaction
+LOCALE_PACKAGES=''
+case "$LOC" in
+    zh_TW|zh_SG|zh_HK|zh_CN|ko_KR|ja_JP) LOCALE_PACKAGES=${!LOC} ;;
+esac
+# Patterns are matched against the repositories, not against file names
+set -f
+for PKG in $LOCALE_PACKAGES; do
+    if [[ "$PKG" == *[*?]* ]]; then
+        addPattern "$PKG"
+    else
+        addPackage "$PKG"
+    fi
+done
+set +f
+
+# Install all packages in one transaction
+if [ "$PACKAGES" != "" ]; then
+    echo "Installing:$PACKAGES"
+    apt-get install --yes --force-yes $PACKAGES
+fi
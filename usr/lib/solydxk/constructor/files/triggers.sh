@@ -0,0 +1,79 @@
+#!/bin/bash
+
+# Defer expensive triggers during a chroot session and run them once when the session closes
+# Usage: triggers.sh defer|flush
+
+QUEUE='/var/lib/constructor/deferred/queue'
+COMMANDS="/usr/sbin/update-initramfs /usr/bin/mandb /usr/bin/update-desktop-database /usr/bin/update-mime-database $(ls /usr/lib/*/gdk-pixbuf-2.0/gdk-pixbuf-query-loaders 2>/dev/null)"
+
+# Replace the commands with a stub that queues the call
+function defer {
+  mkdir -p $(dirname $QUEUE)
+  for CMD in $COMMANDS; do
+    if [ -e "$CMD" ] && [ ! -e "$CMD.constructor" ]; then
+      dpkg-divert --quiet --local --rename --divert "$CMD.constructor" --add "$CMD"
+      cat > "$CMD" <<EOF
+#!/bin/sh
+# Deferred by solydxk-constructor: the real command runs once when the session closes
+case " \$* " in
+  *" -d "*) exec $CMD.constructor "\$@" ;;
+esac
+echo "$CMD \$*" >> $QUEUE
+exit 0
+EOF
+      chmod 755 "$CMD"
+      echo "Deferred: $CMD"
+    fi
+  done
+}
+
+# Restore the commands and run each queued call once
+function flush {
+  for CMD in $COMMANDS; do
+    if [ -e "$CMD.constructor" ]; then
+      rm -f "$CMD"
+      dpkg-divert --quiet --local --rename --remove "$CMD"
+    fi
+  done
+
+  if [ ! -s $QUEUE ]; then
+    rm -f $QUEUE
+    return 0
+  fi
+
+  # Initramfs: one run per kernel version
+  # Calls without -k update the newest kernel, which /vmlinuz points to
+  INITRAMFS=$(grep '^/usr/sbin/update-initramfs ' $QUEUE)
+  if [ "$INITRAMFS" != "" ]; then
+    VERSIONS=$(echo "$INITRAMFS" | sed -n 's/.*-k \([^ ]*\).*/\1/p')
+    if echo "$INITRAMFS" | grep -qv -- '-k '; then
+      VERSIONS="$VERSIONS $(readlink /vmlinuz | sed 's/.*vmlinuz-//')"
+    fi
+    if echo "$VERSIONS" | grep -qw all; then
+      VERSIONS=$(ls /lib/modules)
+    fi
+    for VERSION in $(echo $VERSIONS | tr ' ' '\n' | sort -u); do
+      if [ -d "/lib/modules/$VERSION" ]; then
+        if [ -e "/boot/initrd.img-$VERSION" ]; then
+          update-initramfs -u -k $VERSION
+        else
+          update-initramfs -c -k $VERSION
+        fi
+      fi
+    done
+  fi
+
+  # Other commands: each distinct call once
+  grep -v '^/usr/sbin/update-initramfs ' $QUEUE | sort -u | while read CMDLINE; do
+    echo "Run deferred: $CMDLINE"
+    $CMDLINE
+  done
+
+  rm -f $QUEUE
+}
+
+case $1 in
+  defer) defer ;;
+  flush) flush ;;
+  *) echo "Usage: $0 defer|flush"; exit 1 ;;
+esac
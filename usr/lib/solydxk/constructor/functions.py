@@ -283,6 +283,15 @@ def getGuestEfiArchitecture(rootPath):
     return ret
 
 
+# Return the unique modules that exist for a GRUB platform (e.g. x86_64-efi), in the given order
+def getGrubModules(modules, platform):
+    ret = []
+    for module in modules.split():
+        if module not in ret and exists("/usr/lib/grub/{}/{}.mod".format(platform, module)):
+            ret.append(module)
+    return ret
+
+
 # Get the system's video cards
 def getVideoCards(pciId=None):
     videoCard = []
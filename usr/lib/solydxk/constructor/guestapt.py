@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+
+import apt
+import apt_pkg
+from os.path import join, exists, abspath
+import functions
+
+# Keys in the global apt_pkg configuration that are changed
+# when a cache is opened on another root directory
+CONFIG_KEYS = ['Dir', 'Dir::State::status', 'Dir::bin::dpkg', 'APT::Architecture', 'APT::Architectures']
+
+
+# Convert the EFI architecture (x86_64, i386) to a Debian architecture
+def getDebianArchitecture(rootPath):
+    if functions.getGuestEfiArchitecture(rootPath) == 'x86_64':
+        return 'amd64'
+    return 'i386'
+
+
+# Return the foreign architectures of the guest (dpkg --add-architecture)
+def getForeignArchitectures(rootPath, nativeArchitecture):
+    archs = []
+    archFile = join(rootPath, "var/lib/dpkg/arch")
+    if exists(archFile):
+        with open(archFile, 'r') as f:
+            for line in f.readlines():
+                arch = line.strip()
+                if arch and arch != nativeArchitecture and arch not in archs:
+                    archs.append(arch)
+    return archs
+
+
+# Class to open an apt cache on the root directory of a working directory
+# without chrooting: the guest's sources, lists and dpkg status are used.
+# Usage:
+# ga = GuestApt(rootPath)
+# cache = ga.open()
+# ...
+# ga.close()
+class GuestApt(object):
+
+    def __init__(self, rootPath, architecture=None):
+        self.rootPath = abspath(rootPath)
+        self.architecture = architecture
+        if self.architecture is None:
+            self.architecture = getDebianArchitecture(self.rootPath)
+        self.cache = None
+        self.savedConfig = {}
+
+    def open(self):
+        if not exists(join(self.rootPath, "var/lib/dpkg/status")):
+            raise Exception("Cannot find dpkg status in: %s" % self.rootPath)
+        # Save the host configuration so that it can be restored when done
+        self.savedConfig = {}
+        for key in CONFIG_KEYS:
+            self.savedConfig[key] = apt_pkg.config.value_list(key) if key == 'APT::Architectures' else apt_pkg.config.find(key)
+        apt_pkg.config.set('APT::Architecture', self.architecture)
+        apt_pkg.config.clear('APT::Architectures')
+        # Foreign packages (name:arch) are only in the cache with their architecture
+        for arch in [self.architecture] + getForeignArchitectures(self.rootPath, self.architecture):
+            apt_pkg.config.set('APT::Architectures::', arch)
+        self.cache = apt.Cache(rootdir=self.rootPath)
+        return self.cache
+
+    def close(self):
+        self.cache = None
+        for key, value in self.savedConfig.items():
+            if key == 'APT::Architectures':
+                apt_pkg.config.clear(key)
+                for arch in value:
+                    apt_pkg.config.set('APT::Architectures::', arch)
+            elif value == '':
+                apt_pkg.config.clear(key)
+            else:
+                apt_pkg.config.set(key, value)
+        if self.savedConfig:
+            apt_pkg.init_system()
+        self.savedConfig = {}
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+
+import os
+import time
+import subprocess
+from shutil import move
+from os.path import join, exists, dirname, abspath
+from manifest import getFileHash
+from profiles import getKernelCompressors
+
+# Magic bytes of the compressors initramfs-tools can use, and their decompress command
+COMPRESSORS = [(b'\x1f\x8b', 'gzip', ['gzip', '-dc']),
+               (b'\xfd7zXZ\x00', 'xz', ['xz', '-dc']),
+               (b'\x28\xb5\x2f\xfd', 'zstd', ['zstd', '-dc']),
+               (b'\x02\x21\x4c\x18', 'lz4', ['lz4', '-dc']),
+               (b'\x89LZO', 'lzop', ['lzop', '-dc']),
+               (b'BZh', 'bzip2', ['bzip2', '-dc']),
+               (b'\x5d\x00\x00', 'lzma', ['xz', '--format=lzma', '-dc'])]
+
+# Kernel options to unpack an initrd with the compressors (gzip is always there)
+KERNEL_OPTIONS = {'bzip2': 'CONFIG_RD_BZIP2', 'lzma': 'CONFIG_RD_LZMA', 'xz': 'CONFIG_RD_XZ',
+                  'lzop': 'CONFIG_RD_LZO', 'lz4': 'CONFIG_RD_LZ4', 'zstd': 'CONFIG_RD_ZSTD'}
+
+# Times the decompression is measured: the fastest run counts
+DECOMPRESS_RUNS = 3
+
+
+# Return the offset of the compressed main archive of an initrd
+# Early cpio archives (e.g. CPU microcode) are not compressed and come first
+def getMainArchiveOffset(data):
+    offset = 0
+    while data[offset:offset + 6] in [b'070701', b'070702']:
+        # Walk the cpio (newc) entries up to the trailer
+        while True:
+            header = data[offset:offset + 110]
+            nameSize = int(header[94:102], 16)
+            fileSize = int(header[54:62], 16)
+            name = data[offset + 110:offset + 110 + nameSize - 1]
+            offset += (110 + nameSize + 3) & ~3
+            offset += (fileSize + 3) & ~3
+            if name == b'TRAILER!!!':
+                break
+        # Archives are padded with zeros
+        while offset < len(data) and data[offset] == 0:
+            offset += 1
+    return offset
+
+
+# Return size, compressor and decompression time (seconds) of an initrd
+def getInitrdInfo(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    info = {'size': len(data), 'compressor': None, 'seconds': None}
+    offset = getMainArchiveOffset(data)
+    for magic, compressor, cmd in COMPRESSORS:
+        if data[offset:offset + len(magic)] == magic:
+            info['compressor'] = compressor
+            try:
+                runs = []
+                for i in range(DECOMPRESS_RUNS):
+                    start = time.time()
+                    subprocess.run(cmd, input=data[offset:], stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, check=False)
+                    runs.append(time.time() - start)
+                info['seconds'] = round(min(runs), 3)
+            except OSError as detail:
+                print(("ERROR: getInitrdInfo: {}: {}".format(cmd[0], detail)))
+            break
+    return info
+
+
+# Build the live initrd: the initrd of root regenerated with another compressor
+# and, optionally, only the modules a live ISO needs to boot
+# The result is reused as long as the initrd of root and the settings do not change
+class LiveInitrd(object):
+
+    def __init__(self, editDistro, distroGeneral, compressor='zstd', modulesFile=None):
+        self.ed = editDistro
+        self.dg = distroGeneral
+        # The root the script runs in (e.g. an overlay on the root of the working directory)
+        self.rootPath = self.ed.rootPath
+        self.compressor = compressor
+        self.modulesFile = modulesFile
+        if self.modulesFile is None:
+            self.modulesFile = join(self.dg.distroPath, "initrd.modules")
+            if not exists(self.modulesFile):
+                self.modulesFile = join(abspath(dirname(__file__)), "files/initrd.modules")
+
+    def getManifest(self, sourceInitrd):
+        modules = getFileHash(self.modulesFile) if exists(self.modulesFile) else ""
+        return "{}\n{}\n{}\n".format(getFileHash(sourceInitrd), self.compressor, modules)
+
+    # Write the live initrd to target and return the before and after report
+    # The live kernel must be able to unpack it: raise when it cannot
+    def build(self, sourceInitrd, target):
+        if self.compressor not in getKernelCompressors(self.rootPath, KERNEL_OPTIONS):
+            raise Exception("The live kernel cannot unpack a %s initrd" % self.compressor)
+
+        manifestFile = self.dg.getStateFile("initrd.manifest")
+        manifest = "{}{}\n".format(self.getManifest(sourceInitrd), getFileHash(target) if exists(target) else "")
+        if exists(manifestFile):
+            with open(manifestFile, 'r') as f:
+                if f.read() == manifest:
+                    print("Live initrd is up to date")
+                    return self.dg.readMetrics("initrd")
+
+        print(("Building live initrd: {}".format(self.compressor)))
+        output = "tmp/initrd.live"
+        modules = "tmp/initrd.modules"
+        with open(self.modulesFile, 'r') as src, open(join(self.rootPath, modules), 'w') as dst:
+            dst.write(src.read())
+        try:
+            self.ed.runScript("liveinitrd.sh", "{} /{} /{}".format(self.compressor, output, modules), interactive=False)
+        finally:
+            os.remove(join(self.rootPath, modules))
+        if not exists(join(self.rootPath, output)):
+            raise Exception("Cannot build the live initrd with %s" % self.compressor)
+
+        # Replace instead of writing into the target: it can be hardlinked by variants
+        if exists(target):
+            os.remove(target)
+        move(join(self.rootPath, output), target)
+
+        report = {'before': getInitrdInfo(sourceInitrd), 'after': getInitrdInfo(target)}
+        for key in ['before', 'after']:
+            info = report[key]
+            print(("Initrd {}: {} bytes, {}, decompressed in {} s".format(key, info['size'], info['compressor'], info['seconds'])))
+        self.dg.writeMetrics("initrd", report)
+        with open(manifestFile, 'w') as f:
+            f.write("{}{}\n".format(self.getManifest(sourceInitrd), getFileHash(target)))
+        return report
@@ -0,0 +1,21 @@
+#! /usr/bin/env python3
+
+import stat
+import hashlib
+
+
+# Return the manifest line of a single entry
+def getManifestEntry(relPath, mode, uid, gid, size, mtimeNs, link=None):
+    entry = "%s\0%o\0%d\0%d\0%d\0%d" % (relPath, mode, uid, gid, size if not stat.S_ISDIR(mode) else 0, mtimeNs)
+    if link is not None:
+        entry += "\0%s" % link
+    return entry.encode('utf-8', 'surrogateescape') + b'\n'
+
+
+# Return the sha256 of a file
+def getFileHash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            sha.update(block)
+    return sha.hexdigest()
@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import fcntl
+import ctypes
+import ctypes.util
+import threading
+from os.path import exists, dirname, realpath
+from execcmd import ExecCmd
+
+# Mount flags (linux/fs.h) and umount2 flags
+MS_RDONLY = 1
+MS_BIND = 4096
+MNT_FORCE = 1
+MNT_DETACH = 2
+
+# Mounts made by the constructor: {target: {"source": ..., "fstype": ..., "pid": ...}}
+# /run is emptied at boot, like the mount table
+OWNERSHIP_FILE = "/run/solydxk-constructor/mounts.json"
+
+# Directories where mounts are always the constructor's (see IsoUnpack)
+CONSTRUCTOR_MOUNT_DIRS = ["/mnt/constructor"]
+
+libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p]
+libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+
+# Serializes changes of the ownership file between threads (processes use a file lock)
+ownershipLock = threading.Lock()
+
+
+# Undo the octal escapes (space, tab, newline, backslash) of a mountinfo field
+def unescapeMountField(field):
+    for escaped, char in [('\\040', ' '), ('\\011', '\t'), ('\\012', '\n'), ('\\134', '\\')]:
+        field = field.replace(escaped, char)
+    return field
+
+
+# Return the mounts of the live mount table in mount order:
+# [{"target": ..., "fstype": ..., "source": ..., "options": ...}]
+def getMounts():
+    mounts = []
+    with open("/proc/self/mountinfo", 'r') as f:
+        for line in f.readlines():
+            fields = line.split()
+            # Optional fields end with a single hyphen
+            sep = fields.index('-', 6)
+            mounts.append({'target': unescapeMountField(fields[4]),
+                           'options': fields[5],
+                           'fstype': fields[sep + 1],
+                           'source': unescapeMountField(fields[sep + 2])})
+    return mounts
+
+
+def isMounted(path):
+    path = realpath(path)
+    return any([mount['target'] == path for mount in getMounts()])
+
+
+# Return the mount points at or below a path, the deepest first
+def getMountsBelow(path):
+    path = realpath(path).rstrip('/')
+    targets = [mount['target'] for mount in getMounts()
+               if mount['target'] == path or mount['target'].startswith(path + '/')]
+    return sorted(set(targets), key=lambda target: target.count('/'), reverse=True)
+
+
+def isProcessAlive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Mount and unmount with the mount and umount2 system calls and keep track of
+# the mounts the constructor made, so that mounts left by a crash can be found
+# Loop mounts need a loop device: these still use the mount command
+class MountManager(object):
+
+    def __init__(self, ownershipFile=OWNERSHIP_FILE):
+        self.ec = ExecCmd()
+        self.ownershipFile = ownershipFile
+
+    # Change the ownership records under a lock: function(records)
+    def changeOwnership(self, function):
+        with ownershipLock:
+            if not exists(dirname(self.ownershipFile)):
+                os.makedirs(dirname(self.ownershipFile))
+            with open("%s.lock" % self.ownershipFile, 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                records = self.getOwnership()
+                function(records)
+                tmpFile = "%s.tmp" % self.ownershipFile
+                with open(tmpFile, 'w') as f:
+                    json.dump(records, f, indent=2, sort_keys=True)
+                os.replace(tmpFile, self.ownershipFile)
+
+    def getOwnership(self):
+        if exists(self.ownershipFile):
+            try:
+                with open(self.ownershipFile, 'r') as f:
+                    return json.load(f)
+            except Exception as detail:
+                print(("ERROR: MountManager: cannot read {}: {}".format(self.ownershipFile, detail)))
+        return {}
+
+    def claim(self, source, target, fstype):
+        def add(records):
+            records[target] = {'source': source, 'fstype': fstype, 'pid': os.getpid()}
+        self.changeOwnership(add)
+
+    def release(self, target):
+        def drop(records):
+            records.pop(target, None)
+        if target in self.getOwnership():
+            self.changeOwnership(drop)
+
+    # Mount source on target and claim the mount
+    # data: file system options (e.g. the overlay directories)
+    def mount(self, source, target, fstype=None, flags=0, data=None):
+        target = realpath(target)
+        ret = libc.mount(source.encode(), target.encode(), fstype.encode() if fstype else None,
+                         flags, data.encode() if data else None)
+        if ret != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "Cannot mount {} on {}: {}".format(source, target, os.strerror(errno)))
+        self.claim(source, target, fstype or "bind")
+
+    def bind(self, source, target):
+        self.mount(source, target, flags=MS_BIND)
+
+    # Loop mount an image file (e.g. an ISO or a squashfs)
+    def mountLoop(self, image, target, fstype=None, readOnly=True):
+        target = realpath(target)
+        options = "loop,ro" if readOnly else "loop"
+        fstypeOption = "-t {} ".format(fstype) if fstype else ""
+        self.ec.run("mount {}-o {} '{}' '{}'".format(fstypeOption, options, image, target))
+        if not isMounted(target):
+            raise Exception("Cannot mount {} on {}".format(image, target))
+        self.claim(image, target, fstype or "loop")
+
+    # Unmount target when it is mounted; a busy mount is detached (umount -l)
+    def umount(self, target):
+        target = realpath(target)
+        if isMounted(target):
+            if libc.umount2(target.encode(), 0) != 0:
+                errno = ctypes.get_errno()
+                print(("Unmount {}: {}: detach".format(target, os.strerror(errno))))
+                if libc.umount2(target.encode(), MNT_DETACH) != 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, "Cannot unmount {}: {}".format(target, os.strerror(errno)))
+        self.release(target)
+
+    # Unmount everything at or below path, the deepest mounts first
+    def umountBelow(self, path):
+        for target in getMountsBelow(path):
+            self.umount(target)
+
+    # Unmount the mounts of constructor processes that no longer run
+    # and the mounts in the constructor's own mount directories
+    def cleanupStale(self):
+        records = self.getOwnership()
+        stale = [target for target, record in records.items() if not isProcessAlive(record.get('pid'))]
+        for mountDir in CONSTRUCTOR_MOUNT_DIRS:
+            if exists(mountDir):
+                for target in getMountsBelow(mountDir):
+                    record = records.get(target)
+                    if record is None or not isProcessAlive(record.get('pid')):
+                        stale.append(target)
+        mounted = [mount['target'] for mount in getMounts()]
+        for target in sorted(set(stale), key=lambda target: target.count('/'), reverse=True):
+            if target in mounted:
+                print(("Unmount stale constructor mount: {}".format(target)))
+                try:
+                    self.umount(target)
+                except OSError as detail:
+                    print(("ERROR: MountManager.cleanupStale: {}".format(detail)))
+                    continue
+            self.release(target)
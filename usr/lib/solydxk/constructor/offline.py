@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+import os
+import hashlib
+import urllib.request
+from shutil import rmtree, copy2
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, exists, basename, abspath, dirname, getsize
+from guestapt import GuestApt
+
+# Shared store for downloaded packages: filenames contain version and
+# architecture, so all working directories can share the same store
+OFFLINE_STORE = "/var/cache/solydxk-constructor/offline"
+
+
+# Return the packages listed in files/offline
+def getOfflinePackageList():
+    packages = []
+    listPath = join(abspath(dirname(__file__)), "files/offline")
+    if exists(listPath):
+        with open(listPath, 'r') as f:
+            for line in f.readlines():
+                line = line.split('#')[0].strip()
+                if line != "":
+                    packages.append(line)
+    return packages
+
+
+# Resolve, download and install the packages that are put
+# in boot/offline for installations without internet connection
+class OfflinePackages(object):
+
+    def __init__(self, distroPath, packages=None, storeDir=OFFLINE_STORE, maxDownloads=4):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.rootPath = join(distroPath, "root")
+        self.offlinePath = join(distroPath, "boot/offline")
+        self.packages = packages
+        if self.packages is None:
+            self.packages = getOfflinePackageList()
+        self.storeDir = storeDir
+        self.maxDownloads = maxDownloads
+
+    # Compute the dependency closure of all packages in a single pass
+    # Returns a list of dictionaries with the download information
+    def resolve(self):
+        debs = []
+        ga = GuestApt(self.rootPath)
+        try:
+            cache = ga.open()
+            with cache.actiongroup():
+                for name in self.packages:
+                    if name in cache:
+                        cache[name].mark_install()
+                    else:
+                        print((">> Cannot find offline package: %s" % name))
+            for pkg in cache.get_changes():
+                if pkg.marked_install or pkg.marked_upgrade:
+                    version = pkg.candidate
+                    debs.append({'name': pkg.name,
+                                 'version': version.version,
+                                 'uri': version.uri,
+                                 'filename': basename(version.filename),
+                                 'size': version.size,
+                                 'sha256': version.sha256})
+        finally:
+            ga.close()
+        return debs
+
+    # Check if a package in the store is complete and unchanged
+    def isInStore(self, deb):
+        path = join(self.storeDir, deb['filename'])
+        if not exists(path) or getsize(path) != deb['size']:
+            return False
+        if deb['sha256']:
+            return self.getSha256(path) == deb['sha256']
+        return True
+
+    def getSha256(self, path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1048576), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def download(self, deb):
+        path = join(self.storeDir, deb['filename'])
+        partial = "%s.partial" % path
+        print((">> Download %s" % deb['uri']))
+        with urllib.request.urlopen(deb['uri'], timeout=60) as response:
+            with open(partial, 'wb') as f:
+                for block in iter(lambda: response.read(1048576), b''):
+                    f.write(block)
+        if deb['sha256'] and self.getSha256(partial) != deb['sha256']:
+            os.remove(partial)
+            raise Exception("Checksum mismatch: %s" % deb['uri'])
+        os.replace(partial, path)
+
+    # Download missing or changed packages in parallel
+    def fetch(self, debs):
+        if not exists(self.storeDir):
+            os.makedirs(self.storeDir)
+        missing = [deb for deb in debs if not self.isInStore(deb)]
+        print((">> Offline packages: %d resolved, %d to download" % (len(debs), len(missing))))
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.maxDownloads) as executor:
+                # list() re-raises the first download error
+                list(executor.map(self.download, missing))
+
+    # Hardlink the packages from the store into boot/offline
+    def link(self, debs):
+        if exists(self.offlinePath):
+            rmtree(self.offlinePath)
+        os.makedirs(self.offlinePath)
+        for deb in debs:
+            source = join(self.storeDir, deb['filename'])
+            target = join(self.offlinePath, deb['filename'])
+            try:
+                os.link(source, target)
+            except OSError:
+                # Store on another file system
+                copy2(source, target)
+
+    def run(self):
+        debs = self.resolve()
+        self.fetch(debs)
+        self.link(debs)
+        print((">> Offline packages linked in: %s" % self.offlinePath))
+        return debs
@@ -0,0 +1,45 @@
+#! /usr/bin/env python3
+
+from os import makedirs
+from shutil import rmtree
+from os.path import join, exists
+from mounts import MountManager
+
+
+# Class to mount a writable overlay on a (root) directory
+# Changes are written to <baseDir>/upper and the merged view is mounted on <baseDir>/root
+# so that EditDistro(baseDir) can be used on the merged view
+class Overlay(object):
+
+    def __init__(self, lowerPath, basePath):
+        self.mounts = MountManager()
+        self.lowerPath = lowerPath
+        self.basePath = basePath
+        self.upperPath = join(basePath, "upper")
+        self.workPath = join(basePath, "work")
+        self.mergedPath = join(basePath, "root")
+
+    # Mount the overlay
+    # With reset, changes of a previous mount are removed first
+    def mount(self, reset=True):
+        self.umount()
+        if reset:
+            for path in [self.upperPath, self.workPath]:
+                if exists(path):
+                    rmtree(path)
+        for path in [self.upperPath, self.workPath, self.mergedPath]:
+            if not exists(path):
+                makedirs(path)
+        self.mounts.mount("overlay", self.mergedPath, "overlay",
+                          data="lowerdir={},upperdir={},workdir={}".format(self.lowerPath, self.upperPath, self.workPath))
+
+    def umount(self):
+        if exists(self.mergedPath):
+            self.mounts.umount(self.mergedPath)
+
+    # Remove all changes
+    def drop(self):
+        self.umount()
+        for path in [self.upperPath, self.workPath]:
+            if exists(path):
+                rmtree(path)
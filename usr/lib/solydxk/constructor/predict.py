@@ -0,0 +1,310 @@
+#! /usr/bin/env python3
+
+import os
+import re
+import stat
+import time
+import lzma
+import zlib
+import random
+import shutil
+from os.path import join, exists, basename, dirname, getsize
+from fileindex import FileIndex
+from exclude import SquashfsExcludes
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+
+# Upper bounds of the file size strata
+SIZE_STRATA = [4096, 65536, MIB, 16 * MIB, None]
+
+# Extensions of files that are compressed already
+COMPRESSED_EXTENSIONS = ['.gz', '.xz', '.bz2', '.lz', '.lzma', '.zst', '.zip', '.jar', '.deb', '.squashfs',
+                         '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ogg', '.oga', '.mp3', '.mp4', '.webm',
+                         '.woff', '.woff2', '.ko.xz', '.pyc']
+
+# Blocks sampled from a large file
+BLOCKS_PER_FILE = 8
+
+# Squashfs metadata per entry (inode and directory entry, compressed)
+ENTRY_OVERHEAD = 32
+
+# ISO 9660 and Rock Ridge/Joliet overhead per boot file and in total
+ISO_ENTRY_OVERHEAD = 2048
+ISO_OVERHEAD = 4 * MIB
+
+
+# Return the size in bytes of a size like 4G, 4GiB, 700M or 4700000000
+def parseSize(size):
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(i?b)?\s*$', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid size: %s" % size)
+    factor = {'': 1, 'k': 1024, 'm': MIB, 'g': GIB, 't': 1024 * GIB}[match.group(2).lower()]
+    return int(float(match.group(1)) * factor)
+
+
+# Return a human readable size
+def formatSize(size):
+    for unit, factor in [('GiB', GIB), ('MiB', MIB), ('KiB', 1024)]:
+        if size >= factor:
+            return "%.1f %s" % (size / factor, unit)
+    return "%d B" % size
+
+
+# Return the compressor, block size and number of processors that a mksquashfs command uses
+def getSquashfsSettings(mksquashfsCmd):
+    compressor = 'gzip'
+    blockSize = 131072
+    processors = os.cpu_count() or 1
+    match = re.search(r'-comp\s+(\w+)', mksquashfsCmd)
+    if match:
+        compressor = match.group(1)
+    match = re.search(r'-b\s+(\d+)([KM]?)', mksquashfsCmd)
+    if match:
+        blockSize = int(match.group(1)) * {'': 1, 'K': 1024, 'M': MIB}[match.group(2)]
+    match = re.search(r'-processors\s+(\d+)', mksquashfsCmd)
+    if match:
+        processors = int(match.group(1))
+    return (compressor, blockSize, processors)
+
+
+# Return a function that compresses a block like mksquashfs does
+# lzo, and lz4 or zstd without their python modules, are approximated with zlib
+def getCompressFunction(compressor, blockSize):
+    if compressor == 'xz':
+        filters = [{'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': max(blockSize, 8192)}]
+        return lambda block: lzma.compress(block, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, filters=filters)
+    if compressor == 'lzma':
+        return lambda block: lzma.compress(block, format=lzma.FORMAT_ALONE)
+    if compressor == 'lz4' and lz4 is not None:
+        return lambda block: lz4.block.compress(block, store_size=False)
+    if compressor == 'zstd' and zstandard is not None:
+        compressorObject = zstandard.ZstdCompressor(level=15)
+        return compressorObject.compress
+    if compressor in ['lzo', 'lz4']:
+        return lambda block: zlib.compress(block, 1)
+    return lambda block: zlib.compress(block, 9)
+
+
+# Predict the squashfs and ISO size and the mksquashfs time of a working directory
+# A stratified sample of the files in root (by size and by already compressed or not)
+# is compressed block by block with the compressor of the mksquashfs command.
+# Files left out of the squashfs root (see exclude.py) are not counted.
+# Duplicate files, which mksquashfs stores once, are not taken into account.
+# tree: indexed tree of the root that is squashed (e.g. the cleanup overlay)
+class SizePredictor(object):
+
+    def __init__(self, distroPath, mksquashfsCmd="", sampleBytes=32 * MIB, index=None, tree="root"):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.distroPath = distroPath
+        self.tree = tree
+        self.rootPath = join(distroPath, tree)
+        self.bootPath = join(distroPath, "boot")
+        self.compressor, self.blockSize, self.processors = getSquashfsSettings(mksquashfsCmd)
+        self.processors = max(self.processors, 1)
+        self.sampleBytes = sampleBytes
+        self.index = index
+        if self.index is None:
+            self.index = FileIndex(distroPath)
+        self.strata = None
+        self.entries = 0
+
+    def getStratumName(self, relPath, size):
+        name = basename(relPath)
+        compressed = any([name.endswith(ext) for ext in COMPRESSED_EXTENSIONS])
+        for bound in SIZE_STRATA:
+            if bound is None or size < bound:
+                return ("<%s" % formatSize(bound) if bound else ">=%s" % formatSize(SIZE_STRATA[-2]),
+                        "compressed" if compressed else "plain")
+
+    # Walk root (through the file index) and divide the regular files that are squashed into strata
+    def loadStrata(self):
+        self.index.refresh(self.tree)
+        excludes = SquashfsExcludes(self.index, self.tree)
+        excludedFiles = set(excludes.getFiles())
+        entries = [(relPath, mode, size) for relPath, mode, size in self.index.getEntries(self.tree)
+                   if relPath not in excludedFiles and not excludes.isExcluded(relPath)]
+        self.entries = len(entries)
+        self.strata = {}
+        for relPath, mode, size in entries:
+            if stat.S_ISREG(mode) and size > 0:
+                self.strata.setdefault(self.getStratumName(relPath, size), []).append((relPath, size))
+
+    # Read the sample of a stratum: whole small files, evenly spread blocks of large files
+    # Budget is divided over the strata by their share of the total size
+    def readSamples(self):
+        rnd = random.Random(0)
+        total = sum([size for files in self.strata.values() for relPath, size in files])
+        samples = {}
+        for key, files in self.strata.items():
+            stratumBytes = sum([size for relPath, size in files])
+            budget = max(self.sampleBytes * stratumBytes // max(total, 1), 4 * self.blockSize)
+            order = list(files)
+            rnd.shuffle(order)
+            data = []
+            read = 0
+            for relPath, size in order:
+                if read >= budget:
+                    break
+                try:
+                    with open(join(self.rootPath, relPath), 'rb') as f:
+                        if size <= self.blockSize * BLOCKS_PER_FILE:
+                            chunk = f.read()
+                            data.append(chunk)
+                            read += len(chunk)
+                        else:
+                            for i in range(BLOCKS_PER_FILE):
+                                f.seek((size - self.blockSize) * i // (BLOCKS_PER_FILE - 1))
+                                chunk = f.read(self.blockSize)
+                                data.append(chunk)
+                                read += len(chunk)
+                except OSError:
+                    continue
+            samples[key] = data
+        return samples
+
+    # Compress the samples: small files are packed together like squashfs fragments
+    # Return per stratum: (sampled bytes, compressed bytes, seconds)
+    def measure(self, samples, compressor, blockSize):
+        compress = getCompressFunction(compressor, blockSize)
+        results = {}
+        for key, data in samples.items():
+            blocks = []
+            fragment = b''
+            for chunk in data:
+                for offset in range(0, len(chunk), blockSize):
+                    block = chunk[offset:offset + blockSize]
+                    if len(block) == blockSize:
+                        blocks.append(block)
+                    else:
+                        fragment += block
+                        if len(fragment) >= blockSize:
+                            blocks.append(fragment[:blockSize])
+                            fragment = fragment[blockSize:]
+            if fragment:
+                blocks.append(fragment)
+            sampled = 0
+            compressed = 0
+            start = time.time()
+            for block in blocks:
+                sampled += len(block)
+                # Blocks that do not compress are stored as they are
+                compressed += min(len(compress(block)), len(block))
+            results[key] = (sampled, compressed, time.time() - start)
+        return results
+
+    def estimate(self, results):
+        squashfsSize = self.entries * ENTRY_OVERHEAD
+        seconds = 0.0
+        strata = []
+        for key, files in sorted(self.strata.items()):
+            stratumBytes = sum([size for relPath, size in files])
+            sampled, compressed, elapsed = results.get(key, (0, 0, 0))
+            ratio = compressed / sampled if sampled else 1.0
+            squashfsSize += int(stratumBytes * ratio)
+            if sampled:
+                seconds += stratumBytes * elapsed / sampled
+            strata.append({'stratum': " ".join(key), 'files': len(files), 'bytes': stratumBytes,
+                           'sampled': sampled, 'ratio': round(ratio, 3)})
+        return (squashfsSize, seconds / self.processors, strata)
+
+    # Size of the boot directory without the squashfs root
+    def getBootSize(self):
+        self.index.refresh("boot")
+        size = 0
+        for relPath, mode, entrySize in self.index.getEntries("boot"):
+            if relPath != "live/filesystem.squashfs":
+                size += ISO_ENTRY_OVERHEAD + (entrySize if stat.S_ISREG(mode) else 0)
+        return size
+
+    # Return the largest directories (two levels deep) by estimated compressed size
+    def getLargestDirectories(self, results, count=10):
+        sizes = {}
+        for key, files in self.strata.items():
+            sampled, compressed, elapsed = results.get(key, (0, 0, 0))
+            ratio = compressed / sampled if sampled else 1.0
+            for relPath, size in files:
+                directory = "/".join(relPath.split('/')[:2]) if '/' in relPath else relPath
+                sizes[directory] = sizes.get(directory, 0) + size * ratio
+        largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:count]
+        return [(directory, int(size)) for directory, size in largest]
+
+    # Return the prediction as a dictionary
+    # targetSize: maximum ISO size in bytes: suggestions are made when the ISO would be larger
+    def predict(self, targetSize=None):
+        start = time.time()
+        self.loadStrata()
+        samples = self.readSamples()
+        results = self.measure(samples, self.compressor, self.blockSize)
+        squashfsSize, seconds, strata = self.estimate(results)
+        isoSize = squashfsSize + self.getBootSize() + ISO_OVERHEAD
+
+        prediction = {'compressor': self.compressor,
+                      'blockSize': self.blockSize,
+                      'processors': self.processors,
+                      'files': sum([len(files) for files in self.strata.values()]),
+                      'bytes': sum([size for files in self.strata.values() for relPath, size in files]),
+                      'squashfsSize': squashfsSize,
+                      'isoSize': isoSize,
+                      'seconds': round(seconds, 1),
+                      'strata': strata,
+                      'warnings': [],
+                      'suggestions': []}
+
+        # The squashfs and the ISO are written next to each other
+        # An existing squashfs root is removed before building
+        free = shutil.disk_usage(self.distroPath).free
+        squashfsPath = join(self.bootPath, "live/filesystem.squashfs")
+        if exists(squashfsPath):
+            free += getsize(squashfsPath)
+        needed = squashfsSize + isoSize
+        prediction['free'] = free
+        if free < needed:
+            prediction['warnings'].append("Not enough disk space: %s needed, %s free" % (formatSize(needed), formatSize(free)))
+
+        if targetSize is not None:
+            prediction['targetSize'] = targetSize
+            if isoSize > targetSize:
+                prediction['warnings'].append("ISO of %s exceeds the target size of %s" % (formatSize(isoSize), formatSize(targetSize)))
+                for compressor, blockSize in [('xz', 262144), ('xz', MIB)]:
+                    if (compressor, blockSize) == (self.compressor, self.blockSize):
+                        continue
+                    altSquashfsSize, altSeconds, altStrata = self.estimate(self.measure(samples, compressor, blockSize))
+                    altIsoSize = isoSize - squashfsSize + altSquashfsSize
+                    prediction['suggestions'].append("-comp %s -b %d: ISO of %s (%s)" %
+                                                     (compressor, blockSize, formatSize(altIsoSize),
+                                                      "fits" if altIsoSize <= targetSize else "too large"))
+                for directory, size in self.getLargestDirectories(results):
+                    prediction['suggestions'].append("Exclude or slim down %s: %s compressed" % (directory, formatSize(size)))
+
+        prediction['predictionSeconds'] = round(time.time() - start, 1)
+        return prediction
+
+
+# Return the prediction as printable lines
+def formatPrediction(prediction):
+    lines = ["Files in root: %d (%s)" % (prediction['files'], formatSize(prediction['bytes'])),
+             "Compressor: %s, block size %d, %d processors" % (prediction['compressor'], prediction['blockSize'], prediction['processors']),
+             "Estimated SquashFS size: %s" % formatSize(prediction['squashfsSize']),
+             "Estimated ISO size: %s" % formatSize(prediction['isoSize']),
+             "Estimated mksquashfs time: %d:%02d" % divmod(int(prediction['seconds']), 60)]
+    for stratum in prediction['strata']:
+        lines.append("  %-20s %7d files %12s ratio %.3f" % (stratum['stratum'], stratum['files'],
+                                                           formatSize(stratum['bytes']), stratum['ratio']))
+    for warning in prediction['warnings']:
+        lines.append("WARNING: %s" % warning)
+    for suggestion in prediction['suggestions']:
+        lines.append("Suggestion: %s" % suggestion)
+    return lines
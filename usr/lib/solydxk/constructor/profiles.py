@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+import os
+from os.path import join, exists, basename
+from execcmd import ExecCmd
+
+# Named build profiles of BuildIso
+# compression: mksquashfs compressors in order of preference: the first one that both mksquashfs
+#              and the live kernel support is used (zstd needs Linux 4.14 and squashfs-tools 4.4)
+# allProcessors: squash on all processors instead of half of them
+# cleanup: run cleanup.sh before squashing root
+# md5sums: update md5sum.txt of the boot directory and write the md5 file of the ISO
+# isohybrid: make the ISO bootable from USB
+# torrent: create the torrent file of the ISO
+# reuseSquashfs: reuse the squashfs root when root did not change, whatever settings built it
+BUILD_PROFILES = {
+    # Everything a published ISO needs
+    'release': {'compression': [('xz', [])],
+                'allProcessors': False,
+                'cleanup': True,
+                'md5sums': True,
+                'isohybrid': True,
+                'torrent': True,
+                'reuseSquashfs': False},
+    # A bootable ISO to test boot menus and artwork in a virtual machine
+    'fast': {'compression': [('zstd', ['-Xcompression-level', '1']), ('lz4', []), ('gzip', [])],
+             'allProcessors': True,
+             'cleanup': False,
+             'md5sums': False,
+             'isohybrid': False,
+             'torrent': False,
+             'reuseSquashfs': True}
+}
+
+DEFAULT_PROFILE = 'release'
+
+# Compressors mksquashfs can support
+SQUASHFS_COMPRESSORS = ['gzip', 'lzma', 'lzo', 'lz4', 'xz', 'zstd']
+
+# Kernel options of the squashfs compressors (gzip is always there)
+KERNEL_OPTIONS = {'lzo': 'CONFIG_SQUASHFS_LZO', 'lz4': 'CONFIG_SQUASHFS_LZ4',
+                  'xz': 'CONFIG_SQUASHFS_XZ', 'zstd': 'CONFIG_SQUASHFS_ZSTD'}
+
+# Compressors assumed when the kernel configuration cannot be found
+KERNEL_DEFAULT_COMPRESSORS = ['gzip', 'xz']
+
+# Compressors of the installed mksquashfs
+squashfsCompressors = None
+
+# Compressors used instead of the preferred one that were reported: (preferred, used)
+compressionWarnings = set()
+
+# Configurations of the live kernels: config file (or root without one) -> options (None when not found)
+kernelConfigs = {}
+
+
+def getBuildProfile(name):
+    if name not in BUILD_PROFILES:
+        raise Exception("Unknown build profile: %s (%s)" % (name, ", ".join(sorted(BUILD_PROFILES))))
+    return BUILD_PROFILES[name]
+
+
+# Return the compressors the installed mksquashfs lists in its usage
+def getSquashfsCompressors():
+    global squashfsCompressors
+    if squashfsCompressors is None:
+        squashfsCompressors = []
+        started = False
+        for line in ExecCmd().run("mksquashfs -help 2>&1", False):
+            if line.startswith("Compressors available"):
+                started = True
+            elif started and line and line.split()[0] in SQUASHFS_COMPRESSORS:
+                squashfsCompressors.append(line.split()[0])
+    return squashfsCompressors
+
+
+# Return the configuration options of the live kernel of a root directory, or None
+# The kernel is the one the vmlinuz link points to, as copied to the ISO
+def getKernelConfig(rootPath):
+    configFile = None
+    vmlinuz = join(rootPath, "vmlinuz")
+    if os.path.islink(vmlinuz):
+        version = basename(os.readlink(vmlinuz)).replace("vmlinuz-", "", 1)
+        configFile = join(rootPath, "boot/config-%s" % version)
+    if configFile is None or not exists(configFile):
+        if rootPath not in kernelConfigs:
+            print(("WARNING: kernel configuration not found in %s: assume %s" % (rootPath, ", ".join(KERNEL_DEFAULT_COMPRESSORS))))
+            kernelConfigs[rootPath] = None
+        return None
+    if configFile not in kernelConfigs:
+        options = {}
+        with open(configFile, 'r', errors='replace') as f:
+            for line in f.readlines():
+                option, sep, value = line.strip().partition('=')
+                if sep:
+                    options[option] = value
+        kernelConfigs[configFile] = options
+    return kernelConfigs[configFile]
+
+
+# Return the compressors the live kernel of a root directory supports
+# kernelOptions: compressor -> kernel option (default: the squashfs compressors it can mount)
+def getKernelCompressors(rootPath, kernelOptions=None):
+    if kernelOptions is None:
+        kernelOptions = KERNEL_OPTIONS
+    options = getKernelConfig(rootPath)
+    if options is None:
+        return KERNEL_DEFAULT_COMPRESSORS
+    return ['gzip'] + [compressor for compressor, option in kernelOptions.items()
+                       if options.get(option) in ['y', 'm']]
+
+
+# Return the mksquashfs compression options of a profile
+# rootPath: root directory of which the live kernel must mount the squashfs
+# A compressor further down the profile's list is used with a warning, none at all is an error
+def getCompressionOptions(profile, rootPath=None):
+    # Without the list of mksquashfs, mksquashfs itself rejects what it does not support
+    squashfs = getSquashfsCompressors()
+    kernel = getKernelCompressors(rootPath) if rootPath is not None else None
+    preferred = profile['compression'][0][0]
+    for compressor, options in profile['compression']:
+        if (squashfs and compressor not in squashfs) or (kernel is not None and compressor not in kernel):
+            continue
+        if compressor != preferred and (preferred, compressor) not in compressionWarnings:
+            print(("WARNING: %s is not supported by mksquashfs or the live kernel: use %s" % (preferred, compressor)))
+            compressionWarnings.add((preferred, compressor))
+        return " ".join(["-comp", compressor] + options)
+    raise Exception("No compressor of the build profile is supported by mksquashfs (%s) and the live kernel (%s): %s" %
+                    (", ".join(squashfs) or "unknown", ", ".join(kernel) if kernel is not None else "not checked",
+                     ", ".join([compressor for compressor, options in profile['compression']])))
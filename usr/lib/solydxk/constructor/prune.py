@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+
+import re
+from os.path import join, basename, dirname
+from dpkgstatus import DpkgStatus
+from guestapt import GuestApt
+
+# Packages that must NOT be treated as orphans (matched as part of the name)
+NOT_ORPHAN = ['baloo']
+
+# Sections of which unused packages are orphans (like deborphan)
+ORPHAN_SECTIONS = ['libs', 'oldlibs']
+
+# Relations that keep a package installed (deborphan's default "nice" mode)
+KEEP_RELATIONS = ['Pre-Depends', 'Depends', 'Recommends', 'Suggests']
+
+# Refuse to prune when more than this share of the installed packages is unavailable:
+# the package lists of the guest are incomplete or outdated
+MAX_UNAVAILABLE_SHARE = 0.2
+
+
+# Return the package names of a dependency field (all alternatives)
+def getRelationNames(field):
+    names = []
+    if field:
+        for group in field.split(','):
+            for alternative in group.split('|'):
+                alternative = alternative.strip()
+                if alternative:
+                    names.append(re.split(r'[\s(:\[]', alternative, 1)[0])
+    return names
+
+
+# Compute all packages to purge from a working directory in one go:
+# unavailable packages that are not on hold, the transitive closure of
+# orphaned libraries and packages with only configuration files left
+class PrunePackages(object):
+
+    def __init__(self, distroPath, notOrphan=None):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.rootPath = join(distroPath, "root")
+        self.notOrphan = notOrphan
+        if self.notOrphan is None:
+            self.notOrphan = NOT_ORPHAN
+
+    # Installed packages of which no version is available in any archive
+    # Without any downloadable version the guest has no package lists: nothing can be told
+    def getUnavailable(self, installed):
+        unavailable = set()
+        downloadable = 0
+        ga = GuestApt(self.rootPath)
+        try:
+            cache = ga.open()
+            for name in installed:
+                if name not in cache:
+                    unavailable.add(name)
+                elif not any(version.downloadable for version in cache[name].versions):
+                    unavailable.add(name)
+                else:
+                    downloadable += 1
+        finally:
+            ga.close()
+        if installed and downloadable == 0:
+            raise Exception("No installed package is downloadable: update the package lists of %s" % self.rootPath)
+        return unavailable
+
+    def isOrphanCandidate(self, name, fields):
+        section = fields.get('Section', '').split('/')[-1]
+        if section not in ORPHAN_SECTIONS:
+            return False
+        if fields.get('Essential') == 'yes' or fields.get('Priority') in ['required', 'important']:
+            return False
+        for keep in self.notOrphan:
+            if keep in name:
+                return False
+        return True
+
+    # Remove orphans from the remaining packages until none are left
+    def getOrphans(self, remaining, held=set()):
+        # Map names and provided names to installed packages
+        providers = {}
+        for name, fields in remaining.items():
+            providers.setdefault(name.split(':')[0], set()).add(name)
+            for provided in getRelationNames(fields.get('Provides')):
+                providers.setdefault(provided, set()).add(name)
+
+        # Packages each package keeps installed, and the number of packages keeping it
+        keeps = {}
+        keptBy = dict([(name, 0) for name in remaining])
+        for name, fields in remaining.items():
+            targets = set()
+            for relation in KEEP_RELATIONS:
+                for target in getRelationNames(fields.get(relation)):
+                    targets.update(providers.get(target, set()))
+            targets.discard(name)
+            keeps[name] = targets
+            for target in targets:
+                keptBy[target] += 1
+
+        candidates = set([name for name, fields in remaining.items() if name not in held and self.isOrphanCandidate(name, fields)])
+        work = [name for name in candidates if keptBy[name] == 0]
+        orphans = set()
+        while work:
+            name = work.pop()
+            if name in orphans:
+                continue
+            orphans.add(name)
+            for target in keeps[name]:
+                keptBy[target] -= 1
+                if keptBy[target] == 0 and target in candidates:
+                    work.append(target)
+        return orphans
+
+    def getRemovalSet(self):
+        packages = DpkgStatus(self.rootPath).getPackages()
+        installed = dict([(name, fields) for name, fields in packages.items()
+                          if fields['State'] not in ['not-installed', 'config-files']])
+        held = set([name for name, fields in installed.items() if fields['Want'] == 'hold'])
+        configs = set([name for name, fields in packages.items() if fields['State'] == 'config-files'])
+
+        unavailable = self.getUnavailable(installed) - held
+        if len(unavailable) > MAX_UNAVAILABLE_SHARE * len(installed):
+            raise Exception("%d of %d installed packages are unavailable: update the package lists of %s" %
+                            (len(unavailable), len(installed), self.rootPath))
+        remaining = dict([(name, fields) for name, fields in installed.items() if name not in unavailable])
+        orphans = self.getOrphans(remaining, held)
+
+        print((">> Prune: %d unavailable, %d orphaned, %d configuration only" % (len(unavailable), len(orphans), len(configs))))
+        return unavailable | orphans | configs
+
+    # Write the packages to purge, one per line, for cleanup.sh
+    def writeList(self, path):
+        removal = sorted(self.getRemovalSet())
+        with open(path, 'w') as f:
+            f.write(''.join(["%s\n" % name for name in removal]))
+        return removal
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+import os
+import time
+import select
+import tempfile
+import subprocess
+from shutil import copy, rmtree
+from os.path import join, exists
+
+# Emulate a USB stick: limited throughput and random reads
+USB_THROTTLE = {'bps-total': 30 * 1024 * 1024, 'iops-total': 200}
+
+
+# OVMF firmware: (code, variables) of the ovmf package, or a single image
+OVMF_FILES = [('/usr/share/OVMF/OVMF_CODE.fd', '/usr/share/OVMF/OVMF_VARS.fd'),
+              ('/usr/share/OVMF/OVMF_CODE_4M.fd', '/usr/share/OVMF/OVMF_VARS_4M.fd'),
+              ('/usr/share/ovmf/OVMF.fd', None),
+              ('/usr/share/qemu/OVMF.fd', None)]
+
+
+# Return True when KVM can be used
+def hasKvm():
+    return os.access('/dev/kvm', os.R_OK | os.W_OK)
+
+
+# Return the (code, variables) files of the installed OVMF firmware, or None
+def getOvmfFiles():
+    for code, variables in OVMF_FILES:
+        if exists(code) and (variables is None or exists(variables)):
+            return (code, variables)
+    return None
+
+
+# Boot an ISO headless in QEMU with the serial console on stdout
+# firmware: bios (SeaBIOS) or efi (OVMF)
+# kernel, initrd, append: boot the kernel directly (the ISO is still attached as CD-ROM)
+# throttle: QEMU throttling options of the CD-ROM drive (e.g. USB_THROTTLE)
+class Qemu(object):
+
+    def __init__(self, isoFile, serialLog, memory=2048, cpus=2, kernel=None, initrd=None, append=None, throttle=None, firmware='bios'):
+        self.isoFile = isoFile
+        self.serialLog = serialLog
+        self.memory = memory
+        self.cpus = cpus
+        self.kernel = kernel
+        self.initrd = initrd
+        self.append = append
+        self.throttle = throttle
+        self.firmware = firmware
+        self.kvm = hasKvm()
+        self.tmpDir = None
+
+    def getCommand(self):
+        cmd = ['qemu-system-x86_64', '-m', str(self.memory), '-smp', str(self.cpus),
+               '-display', 'none', '-monitor', 'none', '-serial', 'stdio', '-no-reboot']
+        if self.kvm:
+            cmd += ['-enable-kvm', '-cpu', 'host']
+        else:
+            cmd += ['-accel', 'tcg']
+        drive = "file={},media=cdrom,readonly=on,if=ide,cache=none".format(self.isoFile)
+        if self.throttle:
+            drive += "".join([",throttling.{}={}".format(key, value) for key, value in sorted(self.throttle.items())])
+        cmd += ['-drive', drive]
+        if self.firmware == 'efi':
+            ovmf = getOvmfFiles()
+            if ovmf is None:
+                raise Exception("Cannot find the OVMF firmware: install ovmf")
+            code, variables = ovmf
+            if variables is None:
+                cmd += ['-bios', code]
+            else:
+                # The firmware writes its variables: use a copy
+                varsCopy = join(self.tmpDir, "OVMF_VARS.fd")
+                copy(variables, varsCopy)
+                cmd += ['-drive', "if=pflash,format=raw,readonly=on,file={}".format(code),
+                        '-drive', "if=pflash,format=raw,file={}".format(varsCopy)]
+        if self.kernel is not None:
+            cmd += ['-kernel', self.kernel]
+            if self.initrd is not None:
+                cmd += ['-initrd', self.initrd]
+            if self.append is not None:
+                cmd += ['-append', self.append]
+        else:
+            cmd += ['-boot', 'd']
+        return cmd
+
+    # Boot and return the serial console lines as (seconds since start, line)
+    # Stops when a line starts with doneMarker, when QEMU exits or after timeout seconds
+    def run(self, doneMarker, timeout=900):
+        if not exists(self.isoFile):
+            raise Exception("Cannot find ISO: %s" % self.isoFile)
+        self.tmpDir = tempfile.mkdtemp(prefix="constructor-qemu-")
+        proc = None
+        lines = []
+        buffer = b''
+        try:
+            cmd = self.getCommand()
+            print(("Start QEMU ({}): {}".format("KVM" if self.kvm else "TCG", " ".join(cmd))))
+            start = time.time()
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            with open(self.serialLog, 'w') as log:
+                while time.time() - start < timeout:
+                    ready = select.select([proc.stdout], [], [], 1)[0]
+                    if not ready:
+                        if proc.poll() is not None:
+                            break
+                        continue
+                    data = os.read(proc.stdout.fileno(), 65536)
+                    if not data:
+                        break
+                    buffer += data
+                    *complete, buffer = buffer.split(b'\n')
+                    done = False
+                    for raw in complete:
+                        line = raw.decode('utf-8', 'replace').rstrip('\r')
+                        lines.append((time.time() - start, line))
+                        log.write(line + '\n')
+                        if line.startswith(doneMarker):
+                            done = True
+                    if done:
+                        break
+                else:
+                    print(("ERROR: QEMU: timeout after %d seconds" % timeout))
+        finally:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            rmtree(self.tmpDir)
+        return lines
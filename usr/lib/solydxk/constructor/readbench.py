@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+import os
+import glob
+import time
+import stat
+import random
+import struct
+import tempfile
+from os.path import join, relpath
+from mounts import MountManager
+
+# Squashfs compression ids
+SQUASHFS_COMPRESSORS = {1: 'gzip', 2: 'lzma', 3: 'lzo', 4: 'xz', 5: 'lz4', 6: 'zstd'}
+
+# Files a live session reads early: libraries, binaries, caches (globs relative to root)
+STANDARD_FILES = ['usr/bin/bash', 'usr/lib/*/libc.so.6', 'lib/*/libc-*.so', 'usr/lib/*/libglib-2.0.so.0.*',
+                  'usr/lib/*/libgtk-3.so.0.*', 'usr/lib/*/libQt5Core.so.5.*', 'usr/lib/xorg/Xorg',
+                  'usr/bin/python3.*', 'usr/lib/locale/locale-archive', 'usr/share/icons/*/icon-theme.cache',
+                  'usr/lib/firefox*/libxul.so', 'usr/lib/thunderbird/libxul.so', 'etc/ssl/certs/ca-certificates.crt',
+                  'usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 'usr/lib/*/dri/swrast_dri.so']
+
+# Sequential read: the largest files up to this many bytes
+SEQUENTIAL_BYTES = 512 * 1024 * 1024
+
+# Random reads: number of 4K reads in files of at least 1 MiB
+RANDOM_READS = 1000
+RANDOM_SIZE = 4096
+
+
+# Return the compressor and block size from the superblock of a squashfs image
+def getSquashfsInfo(squashfsPath):
+    with open(squashfsPath, 'rb') as f:
+        superblock = f.read(96)
+    if superblock[:4] != b'hsqs':
+        raise Exception("Not a squashfs image: %s" % squashfsPath)
+    inodes, mkfsTime, blockSize, fragments, compressor = struct.unpack('<IIIIH', superblock[4:22])
+    return {'compressor': SQUASHFS_COMPRESSORS.get(compressor, str(compressor)), 'blockSize': blockSize,
+            'inodes': inodes, 'size': os.path.getsize(squashfsPath)}
+
+
+# Return the percentile of a sorted list
+def getPercentile(values, percentile):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+# Measure how fast a squashfs image reads back: cold sequential throughput,
+# random 4K read latency and the cost to read a standard set of files.
+# The image is loop mounted read-only and the page cache is dropped before each
+# measurement, so this needs root.
+class ReadBench(object):
+
+    def __init__(self, squashfsPath, seed=0):
+        self.mounts = MountManager()
+        self.squashfsPath = squashfsPath
+        self.random = random.Random(seed)
+        self.mountDir = None
+
+    def mount(self):
+        self.mountDir = tempfile.mkdtemp(prefix="constructor-readbench-")
+        try:
+            self.mounts.mountLoop(self.squashfsPath, self.mountDir, "squashfs")
+        except Exception:
+            os.rmdir(self.mountDir)
+            self.mountDir = None
+            raise
+
+    def umount(self):
+        if self.mountDir is not None:
+            self.mounts.umount(self.mountDir)
+            os.rmdir(self.mountDir)
+            self.mountDir = None
+
+    def dropCaches(self):
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", 'w') as f:
+            f.write("3\n")
+
+    # Return (relative path, size) of the regular files in the image
+    def getFiles(self):
+        files = []
+        for dirPath, dirNames, fileNames in os.walk(self.mountDir):
+            for name in fileNames:
+                path = join(dirPath, name)
+                st = os.lstat(path)
+                if stat.S_ISREG(st.st_mode):
+                    files.append((relpath(path, self.mountDir), st.st_size))
+        return files
+
+    # Read whole files and return (bytes, seconds)
+    def readFiles(self, paths):
+        total = 0
+        start = time.time()
+        for path in paths:
+            with open(join(self.mountDir, path), 'rb', buffering=0) as f:
+                while True:
+                    data = f.read(1048576)
+                    if not data:
+                        break
+                    total += len(data)
+        return (total, time.time() - start)
+
+    def measureSequential(self, files):
+        paths = []
+        total = 0
+        for path, size in sorted(files, key=lambda item: item[1], reverse=True):
+            if total >= SEQUENTIAL_BYTES:
+                break
+            paths.append(path)
+            total += size
+        self.dropCaches()
+        read, seconds = self.readFiles(paths)
+        return {'files': len(paths), 'bytes': read, 'seconds': round(seconds, 3),
+                'mbPerSecond': round(read / 1048576 / seconds, 1) if seconds else None}
+
+    def measureRandom(self, files):
+        large = [(path, size) for path, size in files if size >= 1048576]
+        if not large:
+            return None
+        self.dropCaches()
+        latencies = []
+        for i in range(RANDOM_READS):
+            path, size = self.random.choice(large)
+            offset = self.random.randrange(0, size // RANDOM_SIZE) * RANDOM_SIZE
+            fd = os.open(join(self.mountDir, path), os.O_RDONLY)
+            try:
+                start = time.time()
+                os.pread(fd, RANDOM_SIZE, offset)
+                latencies.append((time.time() - start) * 1000)
+            finally:
+                os.close(fd)
+        latencies.sort()
+        return {'reads': len(latencies), 'p50ms': round(getPercentile(latencies, 50), 3),
+                'p95ms': round(getPercentile(latencies, 95), 3), 'p99ms': round(getPercentile(latencies, 99), 3),
+                'meanms': round(sum(latencies) / len(latencies), 3)}
+
+    def measureStandardFiles(self):
+        results = []
+        for pattern in STANDARD_FILES:
+            for path in sorted(glob.glob(join(self.mountDir, pattern))):
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                self.dropCaches()
+                read, seconds = self.readFiles([relpath(path, self.mountDir)])
+                results.append({'file': relpath(path, self.mountDir), 'bytes': read, 'ms': round(seconds * 1000, 2),
+                                'mbPerSecond': round(read / 1048576 / seconds, 1) if seconds else None})
+        return results
+
+    def run(self):
+        results = getSquashfsInfo(self.squashfsPath)
+        self.mount()
+        try:
+            files = self.getFiles()
+            results['sequential'] = self.measureSequential(files)
+            results['random'] = self.measureRandom(files)
+            results['standardFiles'] = self.measureStandardFiles()
+        finally:
+            self.umount()
+        return results
+
+
+# Return the results as printable lines, compared with the previous results
+def formatReadBench(results, previous=None):
+    lines = ["SquashFS: %s, block size %d, %d bytes" % (results['compressor'], results['blockSize'], results['size'])]
+    sequential = results['sequential']
+    line = "Cold sequential read: %s MiB/s (%d files)" % (sequential['mbPerSecond'], sequential['files'])
+    if previous and previous.get('sequential', {}).get('mbPerSecond'):
+        line += " (previous %s MiB/s)" % previous['sequential']['mbPerSecond']
+    lines.append(line)
+    if results['random']:
+        rnd = results['random']
+        line = "Random 4K read latency: p50 %.3f ms, p95 %.3f ms, p99 %.3f ms" % (rnd['p50ms'], rnd['p95ms'], rnd['p99ms'])
+        if previous and previous.get('random'):
+            line += " (previous p95 %.3f ms)" % previous['random']['p95ms']
+        lines.append(line)
+    for result in results['standardFiles']:
+        lines.append("  %-50s %10d bytes %8.2f ms" % (result['file'], result['bytes'], result['ms']))
+    return lines
@@ -0,0 +1,177 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import fcntl
+import threading
+from os.path import join, exists, basename, dirname
+from solydxk import DistroGeneral
+from buildcache import BuildCache
+import functions
+
+# Version of the registry file format
+REGISTRY_VERSION = 1
+
+
+# Return the mtimes that tell if the cached metadata of a working directory is stale:
+# the directory itself (ISOs added or removed), the info file (edition, description),
+# the last build record and the root size of the last build
+def getProbeStamp(distroPath):
+    stamp = []
+    for path in [distroPath, join(distroPath, "root/etc/solydxk/info"),
+                 join(distroPath, ".constructor/build.json"), join(distroPath, "boot/live/filesystem.size")]:
+        try:
+            stamp.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+# Registry of the working directories with cached metadata:
+# {"version": 1, "distros": {<path>: {"edition": ..., "description": ..., "architecture": ...,
+#                                     "size": ..., "lastBuild": ..., "fingerprint": ...,
+#                                     "artifacts": [...], "stamp": [...]}}}
+# Directories are only probed again when their stamp changed.
+# The old distros.list is migrated on first use.
+class DistroRegistry(object):
+
+    def __init__(self, registryFile, legacyFile=None):
+        self.registryFile = registryFile
+        self.legacyFile = legacyFile
+        self.distros = {}
+        # The GUI changes the registry from the GTK thread and from the thread that probes
+        self.lock = threading.Lock()
+        self.load()
+
+    # The dictionary is replaced at once: the GTK thread can read it while a thread probes
+    def load(self):
+        distros = {}
+        migrate = False
+        if exists(self.registryFile):
+            try:
+                with open(self.registryFile, 'r') as f:
+                    distros = json.load(f).get('distros', {})
+            except Exception as detail:
+                print(("ERROR: DistroRegistry: cannot read {}: {}".format(self.registryFile, detail)))
+        elif self.legacyFile is not None and exists(self.legacyFile):
+            with open(self.legacyFile, 'r') as f:
+                for line in f.readlines():
+                    line = line.strip().rstrip('/')
+                    if line:
+                        distros[line] = {}
+            migrate = True
+        self.distros = distros
+        if migrate:
+            self.save()
+
+    # Write the registry to a temporary file and rename it
+    def save(self):
+        tmpFile = "%s.tmp" % self.registryFile
+        with open(tmpFile, 'w') as f:
+            json.dump({'version': REGISTRY_VERSION, 'distros': self.distros}, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpFile, self.registryFile)
+
+    # Serialize changes of the GUI and the CLI: reload, change and save under a lock
+    def change(self, function, *args):
+        with self.lock, open("%s.lock" % self.registryFile, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()
+            ret = function(*args)
+            self.save()
+        return ret
+
+    # Return the metadata of a working directory
+    def probe(self, distroPath):
+        dg = DistroGeneral(distroPath)
+        entry = {'edition': dg.edition,
+                 'description': dg.description,
+                 'architecture': functions.getGuestEfiArchitecture(dg.rootPath),
+                 'size': None,
+                 'lastBuild': None,
+                 'fingerprint': None,
+                 'artifacts': [],
+                 'stamp': getProbeStamp(distroPath)}
+        sizeFile = join(distroPath, "boot/live/filesystem.size")
+        if exists(sizeFile):
+            with open(sizeFile, 'r') as f:
+                size = f.read().strip()
+            if size.isdigit():
+                entry['size'] = int(size)
+        buildFile = join(dg.statePath, "build.json")
+        if exists(buildFile):
+            record = BuildCache(buildFile).record
+            entry['lastBuild'] = record.get('time')
+            entry['fingerprint'] = record.get('fingerprint')
+            entry['artifacts'] = record.get('isoFiles', [])
+        return entry
+
+    # Return True when the cached metadata of a working directory is stale
+    def isStale(self, distroPath):
+        entry = self.distros.get(distroPath)
+        return not entry or entry.get('stamp') != getProbeStamp(distroPath)
+
+    def normalizePath(self, distroPath):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        return distroPath
+
+    def _add(self, distroPath):
+        self.distros[distroPath] = self.probe(distroPath)
+        return self.distros[distroPath]
+
+    def _remove(self, distroPath):
+        self.distros.pop(distroPath, None)
+
+    def _refresh(self, paths):
+        for path in paths:
+            if path in self.distros and exists(path) and self.isStale(path):
+                self.distros[path] = self.probe(path)
+
+    # Add or re-probe a working directory and return its metadata
+    def add(self, distroPath):
+        return self.change(self._add, self.normalizePath(distroPath))
+
+    def remove(self, distroPath):
+        self.change(self._remove, self.normalizePath(distroPath))
+
+    # Re-probe a working directory after it changed (e.g. after a build)
+    def update(self, distroPath):
+        distroPath = self.normalizePath(distroPath)
+        if distroPath in self.distros:
+            self.add(distroPath)
+
+    # Probe a working directory again when it is stale and return its metadata
+    def refresh(self, distroPath):
+        if self.isStale(distroPath):
+            self.change(self._refresh, [distroPath])
+        return self.distros.get(distroPath)
+
+    # Return [(path, metadata)] of all registered working directories sorted on description
+    # The cached metadata is returned without touching the file system
+    def getCachedDistros(self):
+        distros = list(self.distros.items())
+        return sorted(distros, key=lambda item: (item[1].get('description') or basename(item[0]), item[0]))
+
+    # Return [(path, metadata)] of the existing working directories sorted on description
+    # Only stale directories are probed
+    def getDistros(self, refresh=True):
+        if refresh:
+            stale = [path for path in self.distros if exists(path) and self.isStale(path)]
+            if stale:
+                self.change(self._refresh, stale)
+        return [(path, entry) for path, entry in self.getCachedDistros() if exists(path)]
+
+
+# Return the registered working directories as printable lines
+def formatDistros(distros):
+    lines = []
+    for path, entry in distros:
+        size = "-"
+        if entry.get('size'):
+            size = "%.1f GiB" % (entry['size'] / 1073741824)
+        lines.append("%-30s %-8s %-10s %-20s %s" % (entry.get('description', ''), entry.get('architecture') or '-', size,
+                                                 (entry.get('lastBuild') or '-')[:19], path))
+    return lines
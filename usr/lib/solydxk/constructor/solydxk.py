@@ -1,12 +1,38 @@
 #! /usr/bin/env python3
 
 import re
+import json
+import time
 import threading
-from os import remove, rmdir, makedirs, system, listdir
+from os import remove, rmdir, makedirs, listdir, replace, utime
 from shutil import copy, move
 from datetime import datetime
-from execcmd import ExecCmd
-from os.path import join, exists, basename, abspath, dirname, lexists, isdir
+from execcmd import ExecCmd, CommandCancelled
+from dpkgstatus import DpkgStatus
+from prune import PrunePackages
+from variants import Variant, loadVariants, LAYER_EXCLUDES
+from manifest import getFileHash
+from fileindex import FileIndex
+from predict import SizePredictor, formatPrediction, formatSize
+from initrd import LiveInitrd
+from readbench import ReadBench, formatReadBench
+from buildcache import BuildCache, getIsoArtifacts, getIsoOutputs
+from checkpoint import BuildCheckpoints, getInputHash, getFileStamp
+from profiles import getBuildProfile, getCompressionOptions, DEFAULT_PROFILE
+from exclude import SquashfsExcludes
+from overlay import Overlay
+from mounts import MountManager
+from os.path import join, exists, basename, abspath, dirname, lexists, isdir, getsize
+
+# Syslinux modules copied into boot/isolinux
+ISOLINUX_MODULES = ["chain.c32", "hdt.c32", "libmenu.c32", "libgpl.c32", "reboot.c32", "vesamenu.c32",
+                    "poweroff.c32", "ldlinux.c32", "libcom32.c32", "libutil.c32"]
+
+# Files in the boot directory that are written by the build itself
+BOOT_DERIVED = ["md5sum.txt", "MD5SUMS", "isolinux/boot.cat", "isolinux/isolinux.bin", "isolinux/memtest86",
+                "live/filesystem.squashfs", "live/filesystem.packages", "live/filesystem.manifest",
+                "live/filesystem.module", "live/filesystem.size", "live/vmlinuz", "live/initrd.img"] + \
+               ["isolinux/%s" % module for module in ISOLINUX_MODULES]
 
 
 class IsoUnpack(threading.Thread):
@@ -14,6 +40,7 @@ class IsoUnpack(threading.Thread):
     def __init__(self, mountDir, unpackIso, unpackDir, queue):
         threading.Thread.__init__(self)
         self.ec = ExecCmd()
+        self.mounts = MountManager()
         self.mountDir = mountDir
         self.unpackIso = unpackIso
         self.unpackDir = unpackDir
@@ -42,12 +69,12 @@ class IsoUnpack(threading.Thread):
                 makedirs(liveDir)
 
             # Mount the ISO
-            system("mount -o loop '%s' '%s'" % (self.unpackIso, self.mountDir))
+            self.mounts.mountLoop(self.unpackIso, self.mountDir)
 
             # Check isolinux directory
             mountIsolinux = join(self.mountDir, "isolinux")
             if not exists(mountIsolinux):
-                self.ec.run("umount --force '%s'" % self.mountDir)
+                self.mounts.umount(self.mountDir)
                 self.returnMessage = "ERROR: Cannot find isolinux directory in ISO"
 
             fixCfgCmd = None
@@ -64,7 +91,7 @@ class IsoUnpack(threading.Thread):
                         dirs.append(join(self.mountDir, subdir))
 
                 if mountSquashfs is None:
-                    self.ec.run("umount --force '%s'" % self.mountDir)
+                    self.mounts.umount(self.mountDir)
                     self.returnMessage = "ERROR: Cannot find squashfs directory in ISO"
 
             if self.returnMessage is None:
@@ -73,7 +100,7 @@ class IsoUnpack(threading.Thread):
                     self.ec.run("rsync -at --del '%s' '%s'" % (d, join(self.unpackDir, "boot/")))
                 self.ec.run("rsync -at --del '%s/' '%s'" % (mountIsolinux, isolinuxDir))
                 self.ec.run("rsync -at --del '%s/' '%s'" % (mountSquashfs, liveDir))
-                self.ec.run("umount --force '%s'" % self.mountDir)
+                self.mounts.umount(self.mountDir)
 
                 if fixCfgCmd is not None:
                     self.ec.run(fixCfgCmd)
@@ -81,9 +108,9 @@ class IsoUnpack(threading.Thread):
                 # copy squashfs root
                 squashfs = join(liveDir, "filesystem.squashfs")
                 if exists(squashfs):
-                    self.ec.run("mount -t squashfs -o loop '%s' '%s'" % (squashfs, self.mountDir))
+                    self.mounts.mountLoop(squashfs, self.mountDir, "squashfs")
                     self.ec.run("rsync -at --del '%s/' '%s/'" % (self.mountDir, rootDir))
-                    self.ec.run("umount --force '%s'" % self.mountDir)
+                    self.mounts.umount(self.mountDir)
 
                 # Cleanup
                 rmdir(self.mountDir)
@@ -96,8 +123,9 @@ class IsoUnpack(threading.Thread):
             self.queue.put(self.returnMessage)
 
         except Exception as detail:
-            self.ec.run("umount --force '%s'" % self.mountDir)
-            rmdir(self.mountDir)
+            self.mounts.umount(self.mountDir)
+            if exists(self.mountDir):
+                rmdir(self.mountDir)
             self.returnMessage = "ERROR: IsoUnpack: %(detail)s" % {"detail": detail}
             self.queue.put(self.returnMessage)
 
@@ -119,13 +147,37 @@ class IsoUnpack(threading.Thread):
 
 class BuildIso(threading.Thread):
 
-    def __init__(self, distroPath, queue):
+    def __init__(self, distroPath, queue, options=None):
         threading.Thread.__init__(self)
-        self.ec = ExecCmd()
+        # Set by cancel(): the running command is killed and the build stops
+        self.cancelEvent = threading.Event()
+        self.ec = ExecCmd(cancelEvent=self.cancelEvent)
         self.dg = DistroGeneral(distroPath)
-        self.ed = EditDistro(distroPath)
+        self.ed = EditDistro(distroPath, self.cancelEvent)
         self.queue = queue
 
+        # Build options
+        # forceCleanup: run all cleanup steps, even when their inputs did not change
+        # variants: None builds the ISO and all variants in variants.json
+        #           a list of variant names only builds these variants from the current
+        #           root without cleanup and reuses the squashfs when root did not change
+        #           variant specs (dictionaries) in the list are built as they are
+        # targetSize: warn and suggest settings when the ISO would be larger (bytes)
+        # initrd: None copies the initrd of root, a compressor (e.g. zstd or lz4) regenerates
+        #         it for the live ISO with that compressor and the modules in initrd.modules
+        # readBench: measure how fast the squashfs root reads back after the build
+        # overlayCleanup: run cleanup on a throwaway overlay on root and squash the merged view:
+        #                 root keeps its caches and state, but the cleanup steps are never skipped:
+        #                 their results (and the stamps of cleanup.sh) are dropped with the overlay
+        # profile: named build profile in profiles.py (e.g. fast for a quick test ISO)
+        # efiBoot: add the EFI image of build_efi_files as alternative El Torito boot entry
+        #          (e.g. to boot a test ISO with OVMF); published ISOs keep their layout
+        self.options = {'forceCleanup': False, 'variants': None, 'targetSize': None, 'initrd': None, 'readBench': False,
+                        'overlayCleanup': False, 'profile': DEFAULT_PROFILE, 'efiBoot': False}
+        if options is not None:
+            self.options.update(options)
+        self.profile = getBuildProfile(self.options['profile'])
+
         self.returnMessage = None
 
         # Paths
@@ -134,10 +186,22 @@ class BuildIso(threading.Thread):
             distroPath = dirname(distroPath)
         self.distroPath = distroPath
         self.rootPath = join(distroPath, "root")
+        # Indexed tree of the root that is squashed (the overlay with overlayCleanup)
+        self.rootTree = "root"
+        self.overlay = None
         self.bootPath = join(distroPath, "boot")
         self.livePath = join(self.bootPath, "live")
         self.scriptDir = abspath(dirname(__file__))
 
+        # Fingerprint of the last build, and the state of root when squashed
+        self.buildCache = BuildCache(self.dg.getStateFile("build.json"))
+        self.index = FileIndex(distroPath, self.dg.getStateFile("index.db"))
+        # Finished stages of the build: a failed or cancelled build continues from there
+        self.checkpoints = BuildCheckpoints(self.dg.getStateFile("checkpoints.json"))
+        self.rootHash = None
+        self.baseRootHash = None
+        self.sourceDateEpoch = None
+
         # Check for old dir
         oldDir = join(self.bootPath, "solydxk")
         if exists(oldDir):
@@ -157,6 +221,7 @@ class BuildIso(threading.Thread):
         # Trackers, and webseeds
         self.trackers = ""
         self.webseeds = ""
+        self.webseedUrls = []
         trackersPath = join(self.scriptDir, "files/trackers")
         webseedsPath = join(self.scriptDir, "files/webseeds")
         if exists(trackersPath):
@@ -169,11 +234,9 @@ class BuildIso(threading.Thread):
         if exists(webseedsPath):
             with open(webseedsPath, "r") as f:
                 lines = f.readlines()
-                wsList = []
                 for line in lines:
-                    #wsList.append("%s/%s" % (line.strip(), webseedIsoName))
-                    wsList.append("%s/%s" % (line.strip(), self.isoBaseName))
-                self.webseeds = ",".join(wsList)
+                    self.webseedUrls.append(line.strip())
+        self.webseeds = self.getWebseeds(self.isoBaseName)
 
     def run(self):
         try:
@@ -183,226 +246,584 @@ class BuildIso(threading.Thread):
             if not exists(self.bootPath):
                 self.returnMessage = "ERROR: Cannot find boot directory: %s" % self.bootPath
 
+            variants = loadVariants(self.distroPath)
+            variantsOnly = self.options['variants'] is not None
+            if variantsOnly:
+                specs = dict([(spec['name'], spec) for spec in variants])
+                variants = []
+                for variant in self.options['variants']:
+                    if isinstance(variant, dict):
+                        variants.append(variant)
+                    elif variant in specs:
+                        variants.append(specs[variant])
+                    else:
+                        self.returnMessage = "ERROR: Unknown variant: %s" % variant
+
+            # Reuse the last build when nothing changed since
+            if self.returnMessage is None and not variantsOnly and not self.options['forceCleanup']:
+                print("Checking build fingerprint...")
+                isoFiles = [self.isoFileName] + [join(self.distroPath, Variant(self.distroPath, spec).getIsoBaseName(self.isoBaseName)) for spec in variants]
+                self.index.refresh("root")
+                self.baseRootHash = self.index.getManifest("root")[0]
+                fingerprint = self.getBuildFingerprint(self.baseRootHash, variants)
+                lastBuild = self.buildCache.record.get('fingerprint')
+                if lastBuild is not None:
+                    changed, deleted = self.index.getChanges(lastBuild)
+                    print(("Changed since the last build: {} changed, {} deleted".format(len(changed), len(deleted))))
+                if self.buildCache.lookup(fingerprint, isoFiles, self.profile):
+                    print("======================================================")
+                    self.returnMessage = "DONE - ISO is up to date: %s" % ", ".join(isoFiles)
+                    print((self.returnMessage))
+                    print("======================================================")
+
+            durations = {}
             if self.returnMessage is None:
                 print("======================================================")
                 print("INFO: Cleanup and prepare ISO build...")
                 print("======================================================")
-
-                # Clean-up
-                script = "cleanup.sh"
-                scriptSource = join(self.scriptDir, "files/{}".format(script))
-                scriptTarget = join(self.rootPath, script)
-                if exists(scriptSource):
-                    self.copy_file(scriptSource, scriptTarget)
-                    self.ec.run("chmod a+x %s" % scriptTarget)
-                    plymouthTheme = self.dg.getPlymouthTheme()
-                    #self.ec.run("chroot '%(rootPath)s' /bin/bash %(cleanup)s %(plymouthTheme)s" % {"rootPath": self.rootPath, "cleanup": cleanup, "plymouthTheme": plymouthTheme})
-                    cmd = "/bin/bash %(cleanup)s %(plymouthTheme)s" % {"cleanup": script, "plymouthTheme": plymouthTheme}
-                    self.ed.openTerminal(cmd)
-                    remove(scriptTarget)
-
-                rootHome = join(self.rootPath, "root")
-                nanoHist = join(rootHome, ".nano_history")
-                if exists(nanoHist):
-                    remove(nanoHist)
-                bashHist = join(rootHome, ".bash_history")
-                if exists(bashHist):
-                    remove(bashHist)
-
-                # Config naming
-                regExp = "solyd.*(\d{6}|-bit)"
-                d = datetime.now()
-                dateString = d.strftime("%Y%m")
-                nameString = "{} {}".format(self.isoName, dateString)
-
-                # write iso name to boot/isolinux/isolinux.cfg
-                cfgFile = join(self.bootPath, "isolinux/isolinux.cfg")
-                if exists(cfgFile):
-                    content = ""
-                    with open(cfgFile, 'r') as f:
-                        content = f.read()
-                    if content != "":
-                        content = re.sub(regExp, nameString, content, flags=re.IGNORECASE)
-                        # Make sure that the paths are correct (correcting very old stuff)
-                        content = re.sub('.lz', '.img', content)
-                        content = re.sub('/solydxk/', '/live/', content)
-                        with open(cfgFile, 'w') as f:
-                            f.write(content)
-
-                # Write info for grub (EFI)
-                grubFile = join(self.bootPath, "boot/grub/grub.cfg")
-                if exists(grubFile):
-                    content = ""
-                    with open(grubFile, 'r') as f:
-                        content = f.read()
-                    if content != "":
-                        content = re.sub(regExp, nameString, content, flags=re.IGNORECASE)
-                        with open(grubFile, 'w') as f:
-                            f.write(content)
-
-                loopbackFile = join(self.bootPath, "boot/grub/loopback.cfg")
-                if exists(loopbackFile):
-                    content = ""
-                    with open(loopbackFile, 'r') as f:
-                        content = f.read()
-                    if content != "":
-                        content = re.sub(regExp, nameString, content, flags=re.IGNORECASE)
-                        with open(loopbackFile, 'w') as f:
-                            f.write(content)
-
-                # Clean boot/live directory
-                #popen("rm -rf %s/live/*" % self.bootPath)
-
-                # Vmlinuz
-                vmlinuzSymLink = join(self.distroPath, "root/vmlinuz")
-                if lexists(vmlinuzSymLink):
-                    vmlinuzFile = self.ec.run("ls -al %s | cut -d'>' -f2" % vmlinuzSymLink)[0].strip()
-                else:
-                    self.returnMessage = "ERROR: %s not found" % vmlinuzSymLink
-
-            if self.returnMessage is None:
-                vmlinuzPath = join(self.distroPath, "root/%s" % vmlinuzFile)
-                if exists(vmlinuzPath):
-                    print("Copy vmlinuz")
-                    self.copy_file(vmlinuzPath, join(self.livePath, "vmlinuz"))
-                else:
-                    self.returnMessage = "ERROR: %s not found" % vmlinuzPath
-
-            if self.returnMessage is None:
-                # Initrd
-                initrdSymLink = join(self.distroPath, "root/initrd.img")
-                if lexists(initrdSymLink):
-                    initrdFile = self.ec.run("ls -al %s | cut -d'>' -f2" % initrdSymLink)[0].strip()
-                else:
-                    self.returnMessage = "ERROR: %s not found" % initrdSymLink
-
-            if self.returnMessage is None:
-                initrdPath = join(self.distroPath, "root/%s" % initrdFile)
-                if exists(initrdPath):
-                    print("Copy initrd")
-                    self.copy_file(initrdPath, join(self.livePath, "initrd.img"))
-                else:
-                    self.returnMessage = "ERROR: %s not found" % initrdPath
+                start = time.time()
+                if not variantsOnly and not self.profile['cleanup']:
+                    print(("Skip cleanup (build profile: %s)" % self.options['profile']))
+                elif not variantsOnly:
+                    if self.options['overlayCleanup']:
+                        self.mountCleanupOverlay()
+                        self.cleanup()
+                    else:
+                        self.runCleanup()
+                self.flushDeferredTriggers()
+                self.writeBootNames(self.bootPath)
+                self.copyKernel()
+                self.checkCancelled()
+                durations['cleanup'] = round(time.time() - start, 1)
 
             if self.returnMessage is None:
-                # Generate UUID
-                #diskDir = join(self.bootPath, ".disk")
-                #if not exists(diskDir):
-                    #makedirs(diskDir)
-                #self.ec.run("rm -rf %s/*uuid*" % diskDir)
-                #self.ec.run("uuidgen -r > %s/live-uuid-generic" % diskDir)
-                #copy_file(join(diskDir, "live-uuid-generic"), join(diskDir, "live-uuid-generic"))
-
-                #Update filesystem.size
-                #self.ec.run("du -b %(directory)s/root/ 2> /dev/null | tail -1 | awk {'print $1;'} > %(directory)s/live/filesystem.size" % {"directory": self.bootPath})
-
                 print("======================================================")
                 print("INFO: Start building ISO...")
                 print("======================================================")
-
-                # build squash root
-                print("Creating SquashFS root...")
-                print("Updating File lists...")
-                dpkgQuery = ' dpkg -l | awk \'/^ii/ {print $2, $3}\' | sed -e \'s/ /\t/g\' '
-                self.ec.run('chroot \"' + self.rootPath + '\"' + dpkgQuery + ' > \"' + join(self.livePath, "filesystem.packages") + '\"' )
-                #dpkgQuery = ' dpkg-query -W --showformat=\'${Package} ${Version}\n\' '
-                #self.ec.run('chroot \"' + self.rootPath + '\"' + dpkgQuery + ' > \"' + join(self.bootPath, "live/filesystem.manifest") + '\"' )
-                #copy_file(join(self.bootPath, "live/filesystem.manifest"), join(self.bootPath, "live/filesystem.manifest-desktop"))
-                # check for existing squashfs root
-                if exists(join(self.livePath, "filesystem.squashfs")):
-                    print("Removing existing SquashFS root...")
-                    remove(join(self.livePath, "filesystem.squashfs"))
-                print("Building SquashFS root...")
-                # check for alternate mksquashfs
-                # check for custom mksquashfs (for multi-threading, new features, etc.)
-                mksquashfs = self.ec.run(cmd="echo $MKSQUASHFS", returnAsList=False).strip()
-                rootPath = join(self.distroPath, "root/")
-                squashfsPath = join(self.livePath, "filesystem.squashfs")
-                if mksquashfs == '' or mksquashfs == 'mksquashfs':
-                    try:
-                        nrprocessors = int(int(self.ec.run("nproc", False, False))/2)
-                        if nrprocessors < 1:
-                            nrprocessors = 1
-                    except:
-                        nrprocessors = 1
-                    cmd = "mksquashfs \"{}\" \"{}\" -comp xz -processors {}".format(rootPath, squashfsPath, nrprocessors)
-                else:
-                    cmd = "{} \"{}\" \"{}\"".format(mksquashfs, rootPath, squashfsPath)
-                #print(cmd)
-                self.ec.run(cmd)
-
-                # build iso
-                print("Creating ISO...")
-                # update manifest files
-                #self.ec.run("/usr/lib/solydxk/constructor/updateManifest.sh %s" % self.distroPath)
-                # update md5
-                print("Updating md5 sums...")
-                if exists(join(self.bootPath, "md5sum.txt")):
-                    remove(join(self.bootPath, "md5sum.txt"))
-                if exists(join(self.bootPath, "MD5SUMS")):
-                    remove(join(self.bootPath, "MD5SUMS"))
-                self.ec.run('cd \"' + self.bootPath + '\"; ' + 'find . -type f -print0 | xargs -0 md5sum > md5sum.txt')
-                #Remove md5sum.txt, MD5SUMS, boot.cat and isolinux.bin from md5sum.txt
-                self.ec.run("sed -i '/md5sum.txt/d' %s/md5sum.txt" % self.bootPath)
-                self.ec.run("sed -i '/MD5SUMS/d' %s/md5sum.txt" % self.bootPath)
-                self.ec.run("sed -i '/boot.cat/d' %s/md5sum.txt" % self.bootPath)
-                self.ec.run("sed -i '/isolinux.bin/d'  %s/md5sum.txt" % self.bootPath)
-                #Copy md5sum.txt to MD5SUMS (for Debian compatibility)
-                self.copy_file(join(self.bootPath, "md5sum.txt"), join(self.bootPath, "MD5SUMS"))
-
-                # Update isolinux files
-                syslinuxPath = join(self.rootPath, "usr/lib/syslinux")
-                modulesPath = join(syslinuxPath, "modules/bios")
-                isolinuxPath = join(self.bootPath, "isolinux")
-                self.ec.run("chmod -R +w {}".format(isolinuxPath))
-                cat = join(isolinuxPath, "boot.cat")
-                if exists(cat):
-                    remove(cat)
-                self.copy_file(join(modulesPath, "chain.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "hdt.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "libmenu.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "libgpl.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "reboot.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "vesamenu.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "poweroff.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "ldlinux.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "libcom32.c32"), isolinuxPath)
-                self.copy_file(join(modulesPath, "libutil.c32"), isolinuxPath)
-                self.copy_file(join(self.rootPath, "boot/memtest86+.bin"), join(isolinuxPath, "memtest86"))
-                self.copy_file("/usr/lib/ISOLINUX/isolinux.bin", isolinuxPath)
-
-                # remove existing iso
-                if exists(self.isoFileName):
-                    print("Removing existing ISO...")
-                    remove(self.isoFileName)
-
-                # build iso according to architecture
-                print("Building ISO...")
-                self.ec.run('genisoimage -input-charset utf-8 -o \"' + self.isoFileName + '\" -b \"isolinux/isolinux.bin\" -c \"isolinux/boot.cat\" -no-emul-boot -boot-load-size 4 -boot-info-table -V \"' + self.isoName + '\" -cache-inodes -r -J -l \"' + self.bootPath + '\"')
-
-                print("Making Hybrid ISO...")
-                self.ec.run("isohybrid %s" % self.isoFileName)
-
-                print("Create ISO md5 file...")
-                self.ec.run("echo \"$(md5sum \"%s\" | cut -d' ' -f 1)  %s\" > \"%s.md5\"" % (self.isoFileName, self.isoBaseName, self.isoFileName))
-
-                print("Create Torrent file...")
-                torrentFile = "%s.torrent" % self.isoFileName
-                if exists(torrentFile):
-                    remove(torrentFile)
-                self.ec.run("mktorrent -a \"%s\" -c \"%s\" -w \"%s\" -o \"%s\" \"%s\"" % (self.trackers, self.isoName, self.webseeds, torrentFile, self.isoFileName))
+                start = time.time()
+                self.buildSquashfs()
+                durations['squashfs'] = round(time.time() - start, 1)
+                isoFiles = []
+                if not variantsOnly:
+                    start = time.time()
+                    self.buildIsoFile(self.bootPath, self.isoFileName)
+                    isoFiles.append(self.isoFileName)
+                    durations['iso'] = round(time.time() - start, 1)
+
+                # Variants (e.g. localized ISOs) that share the squashfs root
+                for spec in variants:
+                    self.checkCancelled()
+                    start = time.time()
+                    isoFiles.append(self.buildVariant(spec))
+                    durations['variant-%s' % spec['name']] = round(time.time() - start, 1)
+
+                if self.overlay is not None:
+                    self.dropCleanupOverlay()
+
+                if self.options['readBench']:
+                    self.readBench()
+
+                # Remember what this build was made of
+                # Cleanup on an overlay leaves root as it was: its hash is the input
+                if not variantsOnly:
+                    rootHash = self.baseRootHash if self.options['overlayCleanup'] else self.rootHash
+                    fingerprint = self.getBuildFingerprint(rootHash, variants)
+                    self.buildCache.save(fingerprint, isoFiles, durations)
+                    self.index.markBuild(fingerprint)
 
                 print("======================================================")
-                self.returnMessage = "DONE - ISO Located at: %s" % self.isoFileName
+                self.returnMessage = "DONE - ISO Located at: %s" % ", ".join(isoFiles)
                 print((self.returnMessage))
                 print("======================================================")
 
             self.queue.put(self.returnMessage)
 
+        except CommandCancelled:
+            self.returnMessage = "CANCELLED - Build stopped: building again continues with the unfinished stages"
+            print((self.returnMessage))
+            self.queue.put(self.returnMessage)
+
         except Exception as detail:
             self.returnMessage = "ERROR: BuildIso: %(detail)s" % {"detail": detail}
             self.queue.put(self.returnMessage)
 
+        finally:
+            if self.overlay is not None:
+                self.dropCleanupOverlay()
+
+    # Cancel the build: the running command and its child processes are killed
+    # Package transactions in root (cleanup, triggers, localization) finish first
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def checkCancelled(self):
+        if self.cancelEvent.is_set():
+            raise CommandCancelled("Build cancelled")
+
+    # Mount a throwaway overlay on root: cleanup changes the merged view, which is squashed
+    # <working directory>/.constructor/overlay/{upper,work,root}
+    def mountCleanupOverlay(self):
+        if self.baseRootHash is None:
+            self.index.refresh("root")
+            self.baseRootHash = self.index.getManifest("root")[0]
+        print("Mounting cleanup overlay...")
+        self.overlay = Overlay(self.rootPath, self.dg.getStateFile("overlay"))
+        self.overlay.mount(reset=True)
+        self.ed = EditDistro(self.overlay.basePath, self.cancelEvent)
+        self.rootPath = self.overlay.mergedPath
+        self.rootTree = self.index.getTreeName(self.rootPath)
+
+    # Drop the overlay and all changes of the cleanup
+    def dropCleanupOverlay(self):
+        print("Dropping cleanup overlay...")
+        self.overlay.drop()
+        self.ed = EditDistro(self.distroPath, self.cancelEvent)
+        self.rootPath = join(self.distroPath, "root")
+        self.rootTree = "root"
+        self.overlay = None
+
+    # Settings that change the build output
+    def getBuildSettings(self, variants):
+        settings = {'mksquashfs': self.getRootMksquashfsCommand(join(self.distroPath, "root")),
+                    'overlayCleanup': self.options['overlayCleanup'],
+                    'profile': self.options['profile'],
+                    'efiBoot': self.options['efiBoot'],
+                    'initrd': self.options['initrd'],
+                    'isoName': self.isoName,
+                    'trackers': self.trackers,
+                    'webseeds': self.webseedUrls,
+                    'variants': variants,
+                    'excludes': SquashfsExcludes(self.index).getSettings(),
+                    'files': {}}
+        # Files of the working directory that variants refer to
+        for spec in variants:
+            if spec.get('isolinux'):
+                path = join(self.distroPath, spec['isolinux'])
+                settings['files'][spec['isolinux']] = getFileHash(path) if exists(path) else None
+        sortFile = self.getSortFile()
+        if sortFile is not None:
+            settings['files']['squashfs.sort'] = getFileHash(sortFile)
+        return settings
+
+    # Fingerprint of the build inputs: root, boot without the files the build writes,
+    # build settings, tool versions and the ISO name
+    def getBuildFingerprint(self, rootHash, variants):
+        self.index.refresh("boot")
+        bootHash = self.index.getManifest("boot", BOOT_DERIVED)[0]
+        return self.buildCache.getFingerprint(rootHash, bootHash, self.getBuildSettings(variants), self.isoBaseName)
+
+    # Run the cleanup, unless root did not change since the last cleanup finished
+    def runCleanup(self):
+        settings = {'plymouthTheme': self.dg.getPlymouthTheme(),
+                    'script': getFileHash(join(self.scriptDir, "files/cleanup.sh"))}
+        if not self.options['forceCleanup']:
+            self.index.refresh("root")
+            inputHash = getInputHash({'root': self.index.getManifest("root")[0], 'settings': settings})
+            if self.checkpoints.isDone("cleanup", inputHash):
+                print("Cleanup is done: root did not change since the last cleanup")
+                return
+        self.checkpoints.reset("cleanup")
+        self.cleanup()
+        self.checkCancelled()
+        # The input of the next cleanup is the root this cleanup left
+        self.index.refresh("root")
+        inputHash = getInputHash({'root': self.index.getManifest("root")[0], 'settings': settings})
+        self.checkpoints.done("cleanup", inputHash)
+
+    # Run triggers left by an unfinished session: root is never squashed with the deferring stubs
+    def flushDeferredTriggers(self):
+        if self.ed.hasDeferredTriggers():
+            print("Running triggers of an unfinished session...")
+            self.ed.endSession()
+            self.checkCancelled()
+
+    def cleanup(self):
+        self.flushDeferredTriggers()
+
+        # Clean-up: compute the packages to purge
+        pruneList = join(self.rootPath, "prune.list")
+        try:
+            PrunePackages(self.rootPath).writeList(pruneList)
+        except Exception as detail:
+            print(("ERROR: BuildIso.prune: {}".format(detail)))
+            # Never purge from an old list
+            if exists(pruneList):
+                remove(pruneList)
+
+        # Defer triggers so that the initrd is rebuilt only once
+        # The package transactions of the session are not interrupted: a cancel stops the build after it
+        self.ed.startSession()
+        plymouthTheme = self.dg.getPlymouthTheme()
+        force = "--force " if self.options['forceCleanup'] else ""
+        self.ed.runScript("cleanup.sh", "{}{}".format(force, plymouthTheme), cancellable=False)
+        self.ed.endSession()
+        if exists(pruneList):
+            remove(pruneList)
+        self.checkCancelled()
+
+        # Show which cleanup steps ran
+        report = join(self.rootPath, "var/cache/constructor/cleanup.report")
+        if exists(report):
+            with open(report, 'r') as f:
+                print((f.read()))
+
+    # Write the ISO name and date in the boot configuration files
+    def writeBootNames(self, bootPath):
+        # Config naming
+        regExp = "solyd.*(\d{6}|-bit)"
+        d = datetime.now()
+        dateString = d.strftime("%Y%m")
+        nameString = "{} {}".format(self.isoName, dateString)
+
+        # write iso name to boot/isolinux/isolinux.cfg
+        cfgFile = join(bootPath, "isolinux/isolinux.cfg")
+        if exists(cfgFile):
+            content = ""
+            with open(cfgFile, 'r') as f:
+                content = f.read()
+            if content != "":
+                content = re.sub(regExp, nameString, content, flags=re.IGNORECASE)
+                # Make sure that the paths are correct (correcting very old stuff)
+                content = re.sub('.lz', '.img', content)
+                content = re.sub('/solydxk/', '/live/', content)
+                self.write_file(cfgFile, content)
+
+        # Write info for grub (EFI)
+        for grubFile in [join(bootPath, "boot/grub/grub.cfg"), join(bootPath, "boot/grub/loopback.cfg")]:
+            if exists(grubFile):
+                content = ""
+                with open(grubFile, 'r') as f:
+                    content = f.read()
+                if content != "":
+                    content = re.sub(regExp, nameString, content, flags=re.IGNORECASE)
+                    self.write_file(grubFile, content)
+
+    # Copy the kernel and initrd the root symlinks point to
+    def copyKernel(self):
+        for link, target in [("vmlinuz", "vmlinuz"), ("initrd.img", "initrd.img")]:
+            symLink = join(self.rootPath, link)
+            if not lexists(symLink):
+                self.returnMessage = "ERROR: %s not found" % symLink
+                return
+            linkFile = self.ec.run("ls -al %s | cut -d'>' -f2" % symLink)[0].strip()
+            linkPath = join(self.rootPath, linkFile)
+            if not exists(linkPath):
+                self.returnMessage = "ERROR: %s not found" % linkPath
+                return
+            if link == "initrd.img" and self.options['initrd']:
+                try:
+                    LiveInitrd(self.ed, self.dg, self.options['initrd']).build(linkPath, join(self.livePath, target))
+                    continue
+                except Exception as detail:
+                    print(("ERROR: BuildIso.copyKernel: {}: copy the initrd of root".format(detail)))
+            print(("Copy %s" % link))
+            self.copy_file(linkPath, join(self.livePath, target))
+
+    # Return the mksquashfs command to squash source into target
+    def getMksquashfsCommand(self, source, target, excludes=[], sortFile=None, excludeFile=None, pseudoFile=None):
+        # check for custom mksquashfs (for multi-threading, new features, etc.)
+        mksquashfs = self.ec.run(cmd="echo $MKSQUASHFS", returnAsList=False).strip()
+        if mksquashfs == '' or mksquashfs == 'mksquashfs':
+            try:
+                nrprocessors = int(self.ec.run("nproc", False, False))
+                if not self.profile['allProcessors']:
+                    nrprocessors = int(nrprocessors/2)
+                if nrprocessors < 1:
+                    nrprocessors = 1
+            except:
+                nrprocessors = 1
+            cmd = "mksquashfs \"{}\" \"{}\" {} -processors {}".format(source, target, getCompressionOptions(self.profile, join(self.distroPath, "root")), nrprocessors)
+        else:
+            cmd = "{} \"{}\" \"{}\"".format(mksquashfs, source, target)
+        if excludes:
+            # Excludes may be wildcards (e.g. boot/initrd.img-*)
+            cmd += " -wildcards -e {}".format(" ".join(["\"{}\"".format(e) for e in excludes]))
+        if excludeFile is not None:
+            cmd += " -wildcards -ef \"{}\"".format(excludeFile)
+        if pseudoFile is not None:
+            cmd += " -pf \"{}\"".format(pseudoFile)
+        if sortFile is not None:
+            cmd += " -sort \"{}\"".format(sortFile)
+        return cmd
+
+    # Return the mksquashfs command of the squashfs root
+    def getRootMksquashfsCommand(self, rootPath=None):
+        if rootPath is None:
+            rootPath = self.rootPath
+        return self.getMksquashfsCommand("%s/" % rootPath, join(self.livePath, "filesystem.squashfs"),
+                                         sortFile=self.getSortFile(), excludeFile=join(self.dg.statePath, "squashfs.exclude"),
+                                         pseudoFile=join(self.dg.statePath, "squashfs.pseudo"))
+
+    # Return the file order from the last boot profile (see bootprofile.py), or None
+    def getSortFile(self):
+        sortFile = join(self.dg.statePath, "squashfs.sort")
+        return sortFile if exists(sortFile) else None
+
+    def buildSquashfs(self):
+        # build squash root
+        print("Creating SquashFS root...")
+        print("Updating File lists...")
+        ds = DpkgStatus(self.rootPath)
+        ds.writePackages(join(self.livePath, "filesystem.packages"))
+        ds.writeManifest(join(self.livePath, "filesystem.manifest"))
+        # check for existing squashfs root
+        # it is reused when its input manifest and settings did not change
+        squashfsPath = join(self.livePath, "filesystem.squashfs")
+        squashfsCmd = self.getRootMksquashfsCommand()
+        print("Checking SquashFS input manifest...")
+        self.index.refresh(self.rootTree)
+        self.rootHash, self.sourceDateEpoch = self.index.getManifest(self.rootTree)
+        # Caches, logs and temporary files are left out instead of deleted from root
+        excludes = SquashfsExcludes(self.index, self.rootTree)
+        excludeFile = self.dg.getStateFile("squashfs.exclude")
+        pseudoFile = self.dg.getStateFile("squashfs.pseudo")
+        excludes.write(excludeFile, pseudoFile)
+        # Size of the squashed files (like du -b) for the installer
+        self.write_file(join(self.livePath, "filesystem.size"), "%d\n" % excludes.getSize())
+        manifest = "{}\n{}\n{}\n{}\n".format(self.rootHash, squashfsCmd, getFileHash(excludeFile), getFileHash(pseudoFile))
+        if self.getSortFile() is not None:
+            manifest += "{}\n".format(getFileHash(self.getSortFile()))
+        inputHash = getInputHash(manifest)
+        if self.checkpoints.isDone("squashfs", inputHash):
+            print("SquashFS root is up to date: reuse existing SquashFS root")
+            return
+        # Squashed files of root, whatever the compression and file order
+        rootInput = getInputHash([self.rootHash, getFileHash(excludeFile), getFileHash(pseudoFile)])
+        if self.profile['reuseSquashfs'] and self.checkpoints.isDone("squashfs-root", rootInput):
+            print(("Root did not change: reuse existing SquashFS root (build profile: %s)" % self.options['profile']))
+            return
+        self.checkpoints.reset("squashfs")
+        self.checkpoints.reset("squashfs-root")
+        if exists(squashfsPath):
+            print("Removing existing SquashFS root...")
+            remove(squashfsPath)
+        prediction = self.predict(squashfsCmd)
+        print("Building SquashFS root...")
+        start = time.time()
+        self.ec.run(self.getSourceDateCommand(squashfsCmd))
+        if prediction is not None and exists(squashfsPath):
+            prediction['actualSquashfsSize'] = getsize(squashfsPath)
+            prediction['actualSeconds'] = round(time.time() - start, 1)
+            print(("SquashFS size: {} (estimated {})".format(formatSize(prediction['actualSquashfsSize']), formatSize(prediction['squashfsSize']))))
+            self.dg.writeMetrics("prediction", prediction)
+        self.checkpoints.done("squashfs", inputHash, [squashfsPath])
+        self.checkpoints.done("squashfs-root", rootInput, [squashfsPath])
+
+    # Estimate the squashfs and ISO size and the build time before squashing root
+    def predict(self, squashfsCmd):
+        print("Estimating SquashFS size...")
+        try:
+            prediction = SizePredictor(self.distroPath, squashfsCmd, index=self.index, tree=self.rootTree).predict(self.options['targetSize'])
+        except Exception as detail:
+            print(("ERROR: BuildIso.predict: {}".format(detail)))
+            return None
+        for line in formatPrediction(prediction):
+            print(line)
+        self.dg.writeMetrics("prediction", prediction)
+        return prediction
+
+    # Measure the read performance of the squashfs root and keep it with the build metrics
+    def readBench(self):
+        print("Measuring SquashFS read performance...")
+        try:
+            results = ReadBench(join(self.livePath, "filesystem.squashfs")).run()
+        except Exception as detail:
+            print(("ERROR: BuildIso.readBench: {}".format(detail)))
+            return
+        for line in formatReadBench(results, self.dg.readMetrics("readbench")):
+            print(line)
+        self.dg.writeMetrics("readbench", results)
+
+    # Build the ISO of a boot directory with its md5 file and torrent
+    # Each of these is a stage with its own checkpoint
+    def buildIsoFile(self, bootPath, isoFileName, volume=None):
+        isoBaseName = basename(isoFileName)
+        if volume is None:
+            volume = self.isoName
+
+        bootTree = self.index.getTreeName(bootPath)
+        self.index.refresh(bootTree)
+        isoStage = "iso:%s" % isoBaseName
+        isoInput = getInputHash({'root': self.rootHash,
+                                 'boot': self.index.getManifest(bootTree, BOOT_DERIVED)[0],
+                                 'volume': volume,
+                                 'md5sums': self.profile['md5sums'],
+                                 'isohybrid': self.profile['isohybrid']})
+        if self.checkpoints.isDone(isoStage, isoInput):
+            print(("ISO is up to date: %s" % isoFileName))
+        else:
+            self.checkpoints.reset(isoStage)
+            # The md5 and torrent files of the previous ISO are stale
+            for path in getIsoArtifacts(isoFileName)[1:]:
+                if exists(path):
+                    remove(path)
+            self.buildIsoImage(bootPath, isoFileName, volume)
+            if not exists(isoFileName):
+                raise Exception("genisoimage did not create %s" % isoFileName)
+            self.checkpoints.done(isoStage, isoInput, [isoFileName])
+
+        self.checkCancelled()
+        if not self.profile['md5sums']:
+            return
+        md5Stage = "md5:%s" % isoBaseName
+        md5Input = getInputHash({'iso': getFileStamp(isoFileName)})
+        if not self.checkpoints.isDone(md5Stage, md5Input):
+            self.checkpoints.reset(md5Stage)
+            print("Create ISO md5 file...")
+            self.ec.run("echo \"$(md5sum \"%s\" | cut -d' ' -f 1)  %s\" > \"%s.md5\"" % (isoFileName, isoBaseName, isoFileName))
+            self.checkpoints.done(md5Stage, md5Input, ["%s.md5" % isoFileName])
+
+        self.checkCancelled()
+        if not self.profile['torrent']:
+            return
+        torrentStage = "torrent:%s" % isoBaseName
+        torrentInput = getInputHash({'iso': getFileStamp(isoFileName),
+                                     'name': self.isoName,
+                                     'trackers': self.trackers,
+                                     'webseeds': self.getWebseeds(isoBaseName)})
+        if not self.checkpoints.isDone(torrentStage, torrentInput):
+            self.checkpoints.reset(torrentStage)
+            print("Create Torrent file...")
+            torrentFile = "%s.torrent" % isoFileName
+            if exists(torrentFile):
+                remove(torrentFile)
+            self.ec.run("mktorrent -d -a \"%s\" -c \"%s\" -w \"%s\" -o \"%s\" \"%s\"" % (self.trackers, self.isoName, self.getWebseeds(isoBaseName), torrentFile, isoFileName))
+            self.checkpoints.done(torrentStage, torrentInput, [torrentFile])
+
+    # Return the files the build profile produces for an ISO
+    def getIsoOutputs(self, isoFileName):
+        return getIsoOutputs(isoFileName, self.profile)
+
+    # Update the md5 sums and isolinux and build the hybrid ISO
+    def buildIsoImage(self, bootPath, isoFileName, volume):
+        # build iso
+        print("Creating ISO...")
+        if self.profile['md5sums']:
+            # update md5
+            print("Updating md5 sums...")
+            if exists(join(bootPath, "md5sum.txt")):
+                remove(join(bootPath, "md5sum.txt"))
+            if exists(join(bootPath, "MD5SUMS")):
+                remove(join(bootPath, "MD5SUMS"))
+            # Only files that changed since the last build are read
+            # md5sum.txt, MD5SUMS, boot.cat and isolinux.bin are left out
+            bootTree = self.index.getTreeName(bootPath)
+            self.index.refresh(bootTree)
+            self.index.writeMd5sums(bootTree, join(bootPath, "md5sum.txt"), ["md5sum.txt", "MD5SUMS", "boot.cat", "isolinux.bin"])
+            #Copy md5sum.txt to MD5SUMS (for Debian compatibility)
+            self.copy_file(join(bootPath, "md5sum.txt"), join(bootPath, "MD5SUMS"))
+
+        # Update isolinux files
+        syslinuxPath = join(self.rootPath, "usr/lib/syslinux")
+        modulesPath = join(syslinuxPath, "modules/bios")
+        isolinuxPath = join(bootPath, "isolinux")
+        self.ec.run("chmod -R +w {}".format(isolinuxPath))
+        cat = join(isolinuxPath, "boot.cat")
+        if exists(cat):
+            remove(cat)
+        for module in ISOLINUX_MODULES:
+            self.copy_file(join(modulesPath, module), isolinuxPath)
+        self.copy_file(join(self.rootPath, "boot/memtest86+.bin"), join(isolinuxPath, "memtest86"))
+        # genisoimage writes the boot info table into isolinux.bin: never share it through a hardlink
+        isolinuxBin = join(isolinuxPath, "isolinux.bin")
+        if exists(isolinuxBin):
+            remove(isolinuxBin)
+        self.copy_file("/usr/lib/ISOLINUX/isolinux.bin", isolinuxPath)
+
+        # Files written by the build get the timestamp of the newest file in root
+        if self.sourceDateEpoch is not None:
+            for derived in BOOT_DERIVED:
+                path = join(bootPath, derived)
+                if exists(path):
+                    utime(path, (self.sourceDateEpoch, self.sourceDateEpoch))
+
+        # remove existing iso
+        if exists(isoFileName):
+            print("Removing existing ISO...")
+            remove(isoFileName)
+
+        # build iso according to architecture
+        print("Building ISO...")
+        # EFI: the image of build_efi_files is the alternative El Torito boot entry
+        efiImage = ""
+        if self.options['efiBoot'] and exists(join(bootPath, "boot/grub/efi.img")):
+            efiImage = '-eltorito-alt-boot -e \"boot/grub/efi.img\" -no-emul-boot '
+        self.ec.run(self.getSourceDateCommand('genisoimage -input-charset utf-8 -o \"' + isoFileName + '\" -b \"isolinux/isolinux.bin\" -c \"isolinux/boot.cat\" -no-emul-boot -boot-load-size 4 -boot-info-table ' + efiImage + '-V \"' + volume + '\" -cache-inodes -r -J -l \"' + bootPath + '\"'))
+
+        if self.profile['isohybrid']:
+            print("Making Hybrid ISO...")
+            self.ec.run("isohybrid %s%s" % ("--uefi " if efiImage else "", isoFileName))
+
+    # Build the ISO of a variant: the boot directory is hardlinked from the base build
+    # and localized variants get an extra squashfs layer with their differences only
+    def buildVariant(self, spec):
+        # Variants are localized on the root that is squashed
+        variant = Variant(self.distroPath, spec, self.rootPath)
+        isoFileName = join(self.distroPath, variant.getIsoBaseName(self.isoBaseName))
+        print("======================================================")
+        print(("INFO: Build variant: %s" % variant.name))
+        print("======================================================")
+        stage = "variant:%s" % variant.name
+        inputHash = self.getVariantInputHash(variant, spec)
+        if self.checkpoints.isDone(stage, inputHash):
+            print(("Variant is up to date: %s" % isoFileName))
+            return isoFileName
+        self.checkpoints.reset(stage)
+        variant.linkBoot(self.bootPath)
+        variant.applyBootChanges()
+        self.writeBootNames(variant.bootPath)
+        layers = []
+        if variant.locale:
+            variant.mountOverlay()
+            try:
+                EditDistro(variant.path, self.cancelEvent).localize(variant.locale, variant.timezone, interactive=False)
+            finally:
+                variant.umountOverlay()
+            self.checkCancelled()
+            layer = variant.getLayerPath()
+            print(("Building SquashFS layer: %s" % layer))
+            self.ec.run(self.getSourceDateCommand(self.getMksquashfsCommand(variant.upperPath, layer, LAYER_EXCLUDES)))
+            layers.append(basename(layer))
+        if variant.layer:
+            layer = variant.getExtraLayerPath()
+            print(("Building SquashFS layer: %s" % layer))
+            self.ec.run(self.getSourceDateCommand(self.getMksquashfsCommand(variant.layer, layer)))
+            layers.append(basename(layer))
+        variant.writeModule(layers)
+        self.buildIsoFile(variant.bootPath, isoFileName, variant.volume)
+        self.checkpoints.done(stage, inputHash, self.getIsoOutputs(isoFileName))
+        return isoFileName
+
+    # Input of a variant: its spec, the squashed root, the base boot directory
+    # and the files of the working directory the spec refers to
+    def getVariantInputHash(self, variant, spec):
+        self.index.refresh("boot")
+        data = {'spec': spec,
+                'root': self.rootHash,
+                'boot': self.index.getManifest("boot", BOOT_DERIVED)[0],
+                'name': self.isoName,
+                'profile': self.options['profile'],
+                'layerExcludes': LAYER_EXCLUDES,
+                'files': {}}
+        if spec.get('isolinux'):
+            path = join(self.distroPath, spec['isolinux'])
+            data['files'][spec['isolinux']] = getFileHash(path) if exists(path) else None
+        if variant.layer is not None and exists(variant.layer):
+            layerTree = self.index.getTreeName(variant.layer)
+            self.index.refresh(layerTree)
+            data['files'][spec['layer']] = self.index.getManifest(layerTree)[0]
+        return getInputHash(data)
+
+    # Run a command with SOURCE_DATE_EPOCH set to the newest file in root
+    # for reproducible timestamps (honoured by mksquashfs 4.4 and later)
+    def getSourceDateCommand(self, cmd):
+        if self.sourceDateEpoch is None:
+            return cmd
+        return "SOURCE_DATE_EPOCH={} {}".format(self.sourceDateEpoch, cmd)
+
+    def getWebseeds(self, isoBaseName):
+        return ",".join(["%s/%s" % (url, isoBaseName) for url in self.webseedUrls])
+
     def copy_file(self, file_path, destination):
         if exists(file_path):
             try:
@@ -412,23 +833,82 @@ class BuildIso(threading.Thread):
         else:
             print(("ERROR: BuildIso.copy_file: cannot find {}".format(file_path)))
 
+    # Replace a file instead of writing into it: boot files can be hardlinked by variants
+    # Unchanged files are left alone to keep the build fingerprint stable
+    def write_file(self, file_path, content):
+        if exists(file_path):
+            with open(file_path, 'r') as f:
+                if f.read() == content:
+                    return
+        tmpPath = "{}.tmp".format(file_path)
+        with open(tmpPath, 'w') as f:
+            f.write(content)
+        replace(tmpPath, file_path)
+
 
 # Class to create a chrooted terminal for a given directory
 # https://wiki.debian.org/chroot
 class EditDistro(object):
 
-    def __init__(self, distroPath):
-        self.ec = ExecCmd()
+    def __init__(self, distroPath, cancelEvent=None):
+        self.ec = ExecCmd(cancelEvent=cancelEvent)
+        self.mounts = MountManager()
         self.dg = DistroGeneral(distroPath)
         distroPath = distroPath.rstrip('/')
         if basename(distroPath) == "root":
             distroPath = dirname(distroPath)
         self.rootPath = join(distroPath, "root")
+        self.scriptDir = abspath(dirname(__file__))
 
         # ISO edition
         self.edition = self.dg.edition
 
-    def openTerminal(self, command=""):
+    # Copy a script from the files directory into the root directory, run it and remove it again
+    # Not interactive: run without terminal window
+    # Not mount: run chrooted without the host mounts
+    # Not cancellable: a cancel does not kill the script (e.g. while dpkg changes root)
+    def runScript(self, script, arguments="", interactive=True, mount=True, cancellable=True):
+        scriptSource = join(self.scriptDir, "files/{}".format(script))
+        scriptTarget = join(self.rootPath, script)
+        if not exists(scriptSource):
+            print((">> Cannot find: %s" % scriptSource))
+            return
+        copy(scriptSource, scriptTarget)
+        self.ec.run("chmod a+x %s" % scriptTarget)
+        self.ec.cancellable = cancellable
+        try:
+            if mount:
+                self.openTerminal("/bin/bash {} {}".format(script, arguments), interactive)
+            else:
+                self.ec.run("chroot '{}' /bin/bash /{} {}".format(self.rootPath, script, arguments))
+        finally:
+            self.ec.cancellable = True
+            remove(scriptTarget)
+
+    # Start a session: expensive triggers (update-initramfs, man-db,
+    # desktop/mime caches and the gdk-pixbuf loader cache) are queued
+    def startSession(self):
+        self.runScript("triggers.sh", "defer", interactive=False, mount=False, cancellable=False)
+
+    # End the session: queued triggers run once
+    def endSession(self, interactive=True):
+        self.runScript("triggers.sh", "flush", interactive, cancellable=False)
+
+    # Localize the distribution in one session
+    # Without locale and timezone, these are configured interactively
+    def localize(self, locale="", timezone="", interactive=True):
+        self.startSession()
+        self.runScript("setlocale.sh", "{} {}".format(locale, timezone).strip(), interactive, cancellable=False)
+        self.endSession(interactive)
+
+    # Check for triggers left by a session that was not ended
+    def hasDeferredTriggers(self):
+        return exists(join(self.rootPath, "usr/sbin/update-initramfs.constructor")) or \
+               exists(join(self.rootPath, "var/lib/constructor/deferred/queue"))
+
+    # Run a command chrooted in a terminal window
+    # When not interactive, the command runs without terminal window
+    def openTerminal(self, command="", interactive=True):
         # Set some paths
         resolveCnfHost = "/etc/resolv.conf"
         resolveCnf = join(self.rootPath, "etc/resolv.conf")
@@ -461,10 +941,10 @@ class EditDistro(object):
             self.unmount([pts, dev, proc, sys])
 
             # mount /proc /dev /dev/pts /sys /run /sys
-            self.ec.run("mount --bind /proc '%s'" % proc)
-            self.ec.run("mount --bind /dev '%s'" % dev)
-            self.ec.run("mount --bind /dev/pts '%s'" % pts)
-            self.ec.run("mount --bind /sys '%s'" % sys)
+            self.mounts.bind("/proc", proc)
+            self.mounts.bind("/dev", dev)
+            self.mounts.bind("/dev/pts", pts)
+            self.mounts.bind("/sys", sys)
 
             # copy apt.conf
             #copy("/etc/apt/apt.conf", join(self.rootPath, "etc/apt/apt.conf"))
@@ -492,7 +972,9 @@ class EditDistro(object):
             with open(terminal, 'w') as f:
                 f.write(scr)
             self.ec.run("chmod a+x %s" % terminal)
-            if self.ec.run('which x-terminal-emulator'):
+            if not interactive and command != "":
+                self.ec.run('export HOME=/root ; export DEBIAN_FRONTEND=noninteractive ; %s' % terminal)
+            elif self.ec.run('which x-terminal-emulator'):
                 # use x-terminal-emulator if xterm isn't available
                 if exists("/usr/bin/xterm"):
                     self.ec.run('export HOME=/root ; xterm -bg black -fg white -rightbar -title \"%s\" -e %s' % (self.edition, terminal))
@@ -564,13 +1046,17 @@ class EditDistro(object):
             # cleanup /run
             self.ec.run("rm -rf %s/run/*" % self.rootPath)
 
+            # The chroot is restored: a cancelled build stops here
+            if isinstance(detail, CommandCancelled):
+                raise
+
             errText = 'Error launching terminal: '
             print((errText, detail))
 
+    # Unmount what is mounted: the mount table is checked, no umount is run for nothing
     def unmount(self, mounts=[]):
         for mount in mounts:
-            self.ec.run("umount --force '%s'" % mount)
-            self.ec.run("umount -l '%s'" % mount)
+            self.mounts.umount(mount)
 
 
 class DistroGeneral(object):
@@ -582,6 +1068,8 @@ class DistroGeneral(object):
             distroPath = dirname(distroPath)
         self.distroPath = distroPath
         self.rootPath = join(distroPath, "root")
+        # Build state (manifests, caches, metrics) that is not part of the ISO
+        self.statePath = join(distroPath, ".constructor")
 
         self.edition = basename(distroPath)
         self.description = "SolydXK"
@@ -590,6 +1078,30 @@ class DistroGeneral(object):
             self.edition = self.ec.run(cmd="grep EDITION= {} | cut -d'=' -f 2".format(infoPath), returnAsList=False).strip('"')
             self.description = self.ec.run(cmd="grep DESCRIPTION= {} | cut -d'=' -f 2".format(infoPath), returnAsList=False).strip('"')
 
+    # Return the path of a file in the state directory
+    def getStateFile(self, name):
+        if not exists(self.statePath):
+            makedirs(self.statePath)
+        return join(self.statePath, name)
+
+    # Write build metrics to <working directory>/.constructor/metrics/<name>.json
+    def writeMetrics(self, name, data):
+        metricsPath = join(self.statePath, "metrics")
+        if not exists(metricsPath):
+            makedirs(metricsPath)
+        metricsFile = join(metricsPath, "%s.json" % name)
+        with open("%s.tmp" % metricsFile, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        replace("%s.tmp" % metricsFile, metricsFile)
+
+    # Return the build metrics of <name>, or None
+    def readMetrics(self, name):
+        metricsFile = join(self.statePath, "metrics", "%s.json" % name)
+        if exists(metricsFile):
+            with open(metricsFile, 'r') as f:
+                return json.load(f)
+        return None
+
     def getPlymouthTheme(self):
         plymouthTheme = ""
         if exists(join(self.rootPath, "usr/share/plymouth/themes/solydk-logo")):
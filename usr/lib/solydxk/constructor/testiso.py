@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+
+import os
+from queue import Queue
+from shutil import rmtree, copy
+from os.path import join, exists, basename, dirname, abspath
+from solydxk import BuildIso, DistroGeneral
+from variants import Variant
+from buildcache import getIsoArtifacts
+
+
+# A throwaway variant of a working directory's ISO for tests in QEMU
+# Its extra layer holds a script from the files directory and the systemd units that run it:
+# <working directory>/.constructor/<name>/layer
+class TestIso(object):
+
+    # script: script in the files directory, installed as /usr/local/sbin/constructor-<name>
+    # units: [(unit name, wanted by, unit file)]
+    # spec: extra keys of the variant spec (e.g. timeout)
+    # options: extra build options of BuildIso (e.g. efiBoot)
+    def __init__(self, distroPath, name, script, units, spec={}, options={}):
+        distroPath = distroPath.rstrip('/')
+        if basename(distroPath) == "root":
+            distroPath = dirname(distroPath)
+        self.distroPath = distroPath
+        self.dg = DistroGeneral(distroPath)
+        self.scriptDir = abspath(dirname(__file__))
+        self.name = name
+        self.script = script
+        self.units = units
+        self.path = join(self.dg.statePath, name)
+        self.layerPath = join(self.path, "layer")
+        self.spec = {'name': name, 'layer': os.path.relpath(self.layerPath, distroPath), 'offline': False}
+        self.spec.update(spec)
+        self.variant = Variant(distroPath, self.spec)
+        self.options = {'variants': [self.spec]}
+        self.options.update(options)
+        self.isoFile = None
+
+    # Write the script and the systemd units
+    def buildLayer(self):
+        if exists(self.layerPath):
+            rmtree(self.layerPath)
+        sbinPath = join(self.layerPath, "usr/local/sbin")
+        unitPath = join(self.layerPath, "etc/systemd/system")
+        os.makedirs(sbinPath)
+        os.makedirs(unitPath)
+        script = join(sbinPath, "constructor-%s" % self.name)
+        copy(join(self.scriptDir, "files", self.script), script)
+        os.chmod(script, 0o755)
+        for name, wantedBy, content in self.units:
+            with open(join(unitPath, name), 'w') as f:
+                f.write(content)
+            wantsPath = join(unitPath, "%s.wants" % wantedBy)
+            if not exists(wantsPath):
+                os.makedirs(wantsPath)
+            os.symlink("../%s" % name, join(wantsPath, name))
+
+    # Build the ISO from the current root and return its path
+    def build(self):
+        self.buildLayer()
+        queue = Queue()
+        bi = BuildIso(self.distroPath, queue, self.options)
+        bi.run()
+        ret = queue.get()
+        if ret is None or "error" in ret.lower():
+            raise Exception("Cannot build the %s ISO: %s" % (self.name, ret))
+        self.isoFile = join(self.distroPath, self.variant.getIsoBaseName(bi.isoBaseName))
+        return self.isoFile
+
+    def getLogFile(self, name):
+        return join(self.path, "%s.log" % name)
+
+    # Remove the ISO and the variant directory
+    def remove(self):
+        if self.isoFile is not None:
+            for path in getIsoArtifacts(self.isoFile):
+                if exists(path):
+                    os.remove(path)
+        if exists(self.variant.path):
+            rmtree(self.variant.path)
@@ -11,6 +11,10 @@ from gi.repository import Gtk, GObject, GdkPixbuf
 #self.myTreeView = TreeViewHandler(self.myTreeView, self.myLogObject)
 #self.myTreeView.connect('checkbox-toggled', self.myCallback)
 
+# Column types of fillTreeview by name
+COLUMN_TYPES = {'bool': bool, 'str': str, 'int': int, 'float': float, 'GdkPixbuf.Pixbuf': GdkPixbuf.Pixbuf}
+
+
 class TreeViewHandler(GObject.GObject):
 
     __gsignals__ = {
@@ -18,11 +22,22 @@ class TreeViewHandler(GObject.GObject):
                             (GObject.TYPE_STRING, GObject.TYPE_INT, GObject.TYPE_BOOLEAN,))
         }
 
-    def __init__(self, treeView, loggerObject=None):
+    # Pixbufs loaded from disk, shared by all treeviews: {(path, height): pixbuf}
+    pixbufCache = {}
+
+    def __init__(self, treeView, loggerObject=None, debug=False):
         GObject.GObject.__init__(self)
         self.log = loggerObject
+        self.debug = debug
         self.treeview = treeView
 
+    # Print and log debug messages, only when debugging is switched on
+    def debugMessage(self, msg):
+        if self.debug:
+            print(msg)
+            if self.log:
+                self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
+
     # Clear treeview
     def clearTreeView(self):
         liststore = self.treeview.get_model()
@@ -30,6 +45,20 @@ class TreeViewHandler(GObject.GObject):
             liststore.clear()
             self.treeview.set_model(liststore)
 
+    # Return the pixbuf of an image file, optionally scaled to a fixed height
+    def getPixbuf(self, path, fixedImgHeight=None):
+        if not os.path.isfile(path):
+            return None
+        key = (path, fixedImgHeight)
+        pb = self.pixbufCache.get(key)
+        if pb is None:
+            pb = GdkPixbuf.Pixbuf.new_from_file(path)
+            if fixedImgHeight:
+                nw = pb.get_width() * (fixedImgHeight / pb.get_height())
+                pb = pb.scale_simple(int(nw), fixedImgHeight, GdkPixbuf.InterpType.BILINEAR)
+            self.pixbufCache[key] = pb
+        return pb
+
     # General function to fill a treeview
     # Set setCursorWeight to 400 if you don't want bold font
     def fillTreeview(self, contentList, columnTypesList, setCursor=0, setCursorWeight=400, firstItemIsColName=False, appendToExisting=False, appendToTop=False, fontSize=10000, fixedImgHeight=None):
@@ -40,196 +69,103 @@ class TreeViewHandler(GObject.GObject):
         if len(contentList) == 0:
             # Empty treeview
             self.clearTreeView()
+            return
+
+        # Column types plus the weight and font size columns
+        types = [COLUMN_TYPES.get(str(colType), colType) for colType in columnTypesList] + [int, int]
+        liststore = self.treeview.get_model()
+        if liststore is None or not appendToExisting:
+            if liststore is not None:
+                # Existing list store: remove all columns
+                for col in self.treeview.get_columns():
+                    self.treeview.remove_column(col)
+            self.debugMessage("Create list store: %(types)s" % { "types": str(types) })
+            liststore = Gtk.ListStore(*types)
+
+        # Create list with column names
+        if multiCols:
+            for i in range(len(contentList[0])):
+                if firstItemIsColName:
+                    colNameList.append(contentList[0][i])
+                else:
+                    colNameList.append('Column ' + str(i))
         else:
-            liststore = self.treeview.get_model()
-            if liststore is None:
-                # Dirty but need to dynamically create a list store
-                dynListStore = 'Gtk.ListStore('
-                for i in range(len(columnTypesList)):
-                    dynListStore += str(columnTypesList[i]) + ', '
-                dynListStore += 'int, int)'
-                msg = "Create list store eval string: %(eval)s" % { "eval": dynListStore }
-                print(msg)
-                if self.log:
-                    self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                liststore = eval(dynListStore)
+            if firstItemIsColName:
+                colNameList.append(contentList[0])
             else:
-                if not appendToExisting:
-                    # Existing list store: clear all rows and columns
-                    msg = "Clear existing list store"
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    liststore.clear()
-                    for col in self.treeview.get_columns():
-                        self.treeview.remove_column(col)
-
-            # Create list with column names
+                colNameList.append('Column 0')
+        self.debugMessage("Create column names: %(cols)s" % { "cols": str(colNameList) })
+
+        # Detach the list store while adding rows: the view does not update for every row
+        self.treeview.set_model(None)
+        pixbufCols = [j for j in range(len(columnTypesList)) if str(columnTypesList[j]) == 'GdkPixbuf.Pixbuf']
+        strCols = [j for j in range(len(columnTypesList)) if str(columnTypesList[j]) == 'str']
+        weightRow = setCursor
+        if firstItemIsColName:
+            weightRow += 1
+        rows = []
+        for i in range(1 if firstItemIsColName else 0, len(contentList)):
+            weight = setCursorWeight if i == weightRow else 400
             if multiCols:
-                for i in range(len(contentList[0])):
-                    if firstItemIsColName:
-                        msg = "First item is column name (multi-column list): %(iscolname)s" % { "iscolname": contentList[0][i] }
-                        print(msg)
-                        if self.log:
-                            self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        colNameList.append(contentList[0][i])
-                    else:
-                        colNameList.append('Column ' + str(i))
+                row = list(contentList[i])
+                for j in strCols:
+                    row[j] = str(row[j])
+                for j in pixbufCols:
+                    row[j] = self.getPixbuf(str(row[j]), fixedImgHeight)
+                row += [weight, fontSize]
             else:
-                if firstItemIsColName:
-                    msg = "First item is column name (single-column list): %(iscolname)s" % { "iscolname": contentList[0][i] }
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    colNameList.append(contentList[0])
-                else:
-                    colNameList.append('Column 0')
-
-            msg = "Create column names: %(cols)s" % { "cols": str(colNameList) }
-            print(msg)
-            if self.log:
-                self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-
-            # Add data to the list store
-            for i in range(len(contentList)):
-                # Skip first row if that is a column name
-                skip = False
-                if firstItemIsColName and i == 0:
-                    msg = "First item is column name: skip first item"
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    skip = True
-
-                if not skip:
-                    weight = 400
-                    weightRow = setCursor
-                    if firstItemIsColName:
-                        weightRow += 1
-                    if i == weightRow:
-                        weight = setCursorWeight
-                    if multiCols:
-                        # Dynamically add data for multi-column list store
-                        if appendToTop:
-                            dynListStoreAppend = 'liststore.insert(0, ['
-                        else:
-                            dynListStoreAppend = 'liststore.append(['
-                        for j in range(len(contentList[i])):
-                            val = str(contentList[i][j])
-                            if str(columnTypesList[j]) == 'str':
-                                val = '"' + val + '"'
-                            if str(columnTypesList[j]) == 'GdkPixbuf.Pixbuf':
-                                if os.path.isfile(val):
-                                    if fixedImgHeight:
-                                        pb = GdkPixbuf.Pixbuf.new_from_file(val)
-                                        nw = pb.get_width() * (fixedImgHeight / pb.get_height())
-                                        val = 'GdkPixbuf.Pixbuf.new_from_file("%(val)s").scale_simple(%(width)s, %(height)s, GdkPixbuf.InterpType.BILINEAR)' % { "val": val, "width": nw, "height": fixedImgHeight }
-                                    else:
-                                        val = 'GdkPixbuf.Pixbuf.new_from_file("%(val)s")' % { "val": val }
-                                else:
-                                    val = None
-                            dynListStoreAppend += '%s, ' % val
-                        dynListStoreAppend += '%s, %s])' % (str(weight), fontSize)
-
-                        msg = "Add data to list store: %(data)s" % { "data": dynListStoreAppend }
-                        print(msg)
-                        if self.log:
-                            self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        eval(dynListStoreAppend)
-                    else:
-                        if appendToTop:
-                            msg = "Add data to top of list store: %(totop)s" % { "totop": str(contentList[i]) }
-                            print(msg)
-                            if self.log:
-                                self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                            liststore.insert(0, [contentList[i], weight, fontSize])
-                        else:
-                            msg = "Add data to bottom of list store: %(tobottom)s" % { "tobottom": str(contentList[i]) }
-                            print(msg)
-                            if self.log:
-                                self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                            liststore.append([contentList[i], weight, fontSize])
-
-            # Create columns
-            for i in range(len(colNameList)):
-                # Create a column only if it does not exist
-                colFound = ''
-                cols = self.treeview.get_columns()
-                for col in cols:
-                    if col.get_title() == colNameList[i]:
-                        colFound = col.get_title()
-                        break
-
-                if colFound == '':
-                    # Build renderer and attributes to define the column
-                    # Possible attributes for text: text, foreground, background, weight
-                    attr = ', text=' + str(i) + ', weight=' + str(len(colNameList)) + ', size=' + str(len(colNameList) + 1)
-                    renderer = 'Gtk.CellRendererText()'  # an object that renders text into a Gtk.TreeView cell
-                    if str(columnTypesList[i]) == 'bool':
-                        renderer = 'Gtk.CellRendererToggle()'  # an object that renders a toggle button into a TreeView cell
-                        attr = ', active=' + str(i)
-                    if str(columnTypesList[i]) == 'GdkPixbuf.Pixbuf':
-                        renderer = 'Gtk.CellRendererPixbuf()'  # an object that renders a pixbuf into a Gtk.TreeView cell
-                        attr = ', pixbuf=' + str(i)
-                    dynCol = 'Gtk.TreeViewColumn("' + str(colNameList[i]) + '", ' + renderer + attr + ')'
-
-                    msg = "Create column: %(col)s" % { "col": dynCol }
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                    col = eval(dynCol)
-
-                    # Get the renderer of the column and add type specific properties
-                    rend = col.get_cells()[0]
-                    #if str(columnTypesList[i]) == 'str':
-                        # TODO: Right align text in column - add parameter to function
-                        #rend.set_property('xalign', 1.0)
-                    if str(columnTypesList[i]) == 'bool':
-                        # If checkbox column, add toggle function
-                        msg = "Check box found: add toggle function"
-                        print(msg)
-                        if self.log:
-                            self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        rend.connect('toggled', self.tvchk_on_toggle, liststore, i)
-
-                    # Let the last colum fill the treeview
-                    if i == len(colNameList):
-                        msg = "Last column fills treeview: %(colnr)d" % { "colnr": i }
-                        print(msg)
-                        if self.log:
-                            self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
-
-                    # Finally add the column
-                    self.treeview.append_column(col)
-                    msg = "Column added: %(col)s" % { "col": col.get_title() }
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-                else:
-                    msg = "Column already exists: %(col)s" % { "col": colFound }
-                    print(msg)
-                    if self.log:
-                        self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
-
-            # Add liststore, set cursor and set the headers
-            self.treeview.set_model(liststore)
-            if setCursor >= 0:
-                self.treeview.set_cursor(setCursor)
-            self.treeview.set_headers_visible(firstItemIsColName)
-            if self.log:
-                self.log.write("Add Liststore to Treeview", 'self.treeview.fillTreeview', 'debug')
-
-            # Scroll to selected cursor
-            selection = self.treeview.get_selection()
-            tm, treeIter = selection.get_selected()
-            if treeIter:
-                path = tm.get_path(treeIter)
-                self.treeview.scroll_to_cell(path)
-                msg = "Scrolled to selected row: %(row)d" % { "row": setCursor }
-                print(msg)
-                if self.log:
-                    self.log.write(msg, 'self.treeview.fillTreeview', 'debug')
+                row = [contentList[i], weight, fontSize]
+            rows.append(row)
+        if appendToTop:
+            for row in rows:
+                liststore.insert(0, row)
+        else:
+            for row in rows:
+                liststore.append(row)
+        self.debugMessage("Added %(rows)d rows to list store" % { "rows": len(rows) })
+
+        # Create columns
+        existingCols = [col.get_title() for col in self.treeview.get_columns()]
+        for i in range(len(colNameList)):
+            # Create a column only if it does not exist
+            if colNameList[i] in existingCols:
+                self.debugMessage("Column already exists: %(col)s" % { "col": colNameList[i] })
+                continue
+
+            # Build renderer and attributes to define the column
+            # Possible attributes for text: text, foreground, background, weight
+            colType = str(columnTypesList[i])
+            if colType == 'bool':
+                # Renders a toggle button into a TreeView cell
+                rend = Gtk.CellRendererToggle()
+                col = Gtk.TreeViewColumn(str(colNameList[i]), rend, active=i)
+                # If checkbox column, add toggle function
+                rend.connect('toggled', self.tvchk_on_toggle, liststore, i)
+            elif colType == 'GdkPixbuf.Pixbuf':
+                # Renders a pixbuf into a TreeView cell
+                col = Gtk.TreeViewColumn(str(colNameList[i]), Gtk.CellRendererPixbuf(), pixbuf=i)
+            else:
+                # Renders text into a TreeView cell
+                col = Gtk.TreeViewColumn(str(colNameList[i]), Gtk.CellRendererText(), text=i,
+                                         weight=len(colNameList), size=len(colNameList) + 1)
+
+            # Finally add the column
+            self.treeview.append_column(col)
+            self.debugMessage("Column added: %(col)s" % { "col": col.get_title() })
+
+        # Add liststore, set cursor and set the headers
+        self.treeview.set_model(liststore)
+        if setCursor >= 0 and len(liststore) > 0:
+            self.treeview.set_cursor(setCursor)
+        self.treeview.set_headers_visible(firstItemIsColName)
+
+        # Scroll to selected cursor
+        selection = self.treeview.get_selection()
+        tm, treeIter = selection.get_selected()
+        if treeIter:
+            path = tm.get_path(treeIter)
+            self.treeview.scroll_to_cell(path)
+            self.debugMessage("Scrolled to selected row: %(row)d" % { "row": setCursor })
 
     def tvchk_on_toggle(self, cell, path, liststore, colNr, *ignore):
         if path is not None:
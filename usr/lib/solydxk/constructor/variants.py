@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+import os
+import re
+import json
+from shutil import rmtree, copy
+from os.path import join, exists
+from execcmd import ExecCmd
+from overlay import Overlay
+
+# Paths (relative to the root) that are left out of a variant's squashfs layer (mksquashfs wildcards)
+# The initrd that the session regenerates is left out too: the live ISO boots with the initrd of root
+LAYER_EXCLUDES = ['run', 'tmp', 'var/tmp', 'var/log', 'var/lib/apt/lists', 'var/cache/apt', 'boot/initrd.img-*']
+
+
+# Return the variants defined in <working directory>/variants.json
+# Keys:
+# name: name of the variant (required)
+# locale, timezone: localize the variant in an extra squashfs layer
+# suffix: ISO file name suffix (default: language or name)
+# offline: false to leave out boot/offline
+# isolinux: isolinux.cfg to use, relative to the working directory
+# volume: ISO volume name
+# layer: directory, relative to the working directory, added as an extra squashfs layer
+# timeout: boot menu timeout in seconds
+# Example:
+# [
+#   {"name": "de", "locale": "de_DE.UTF-8", "timezone": "Europe/Berlin"},
+#   {"name": "nl", "locale": "nl_NL.UTF-8", "timezone": "Europe/Amsterdam"},
+#   {"name": "online", "offline": false, "isolinux": "isolinux-online.cfg", "volume": "SolydXK online"}
+# ]
+def loadVariants(distroPath):
+    variants = []
+    variantsFile = join(distroPath, "variants.json")
+    if exists(variantsFile):
+        with open(variantsFile, 'r') as f:
+            variants = json.load(f)
+        for spec in variants:
+            if 'name' not in spec:
+                raise Exception("Variant without name in %s" % variantsFile)
+    return variants
+
+
+# A variant of a working directory's ISO
+# Its files are in <working directory>/variants/<name>:
+# boot: hardlinked copy of the base boot directory
+# upper, work, root: overlay on the base root to localize the variant
+class Variant(object):
+
+    # rootPath: base root of the overlay (default: <working directory>/root)
+    def __init__(self, distroPath, spec, rootPath=None):
+        self.ec = ExecCmd()
+        self.spec = spec
+        self.name = spec['name']
+        self.locale = spec.get('locale', '')
+        self.timezone = spec.get('timezone', '')
+        self.volume = spec.get('volume')
+        self.layer = join(distroPath, spec['layer']) if spec.get('layer') else None
+        self.distroPath = distroPath
+        self.path = join(distroPath, "variants", self.name)
+        self.bootPath = join(self.path, "boot")
+        self.overlay = Overlay(rootPath or join(distroPath, "root"), self.path)
+        self.upperPath = self.overlay.upperPath
+
+    # Hardlink the base boot directory: only new or changed files take space
+    def linkBoot(self, baseBootPath):
+        if exists(self.bootPath):
+            rmtree(self.bootPath)
+        if not exists(self.path):
+            os.makedirs(self.path)
+        self.ec.run("cp -al '{}' '{}'".format(baseBootPath, self.bootPath))
+
+    # Apply the boot directory differences of the variant
+    # Files are removed or replaced, never written into: they are hardlinks
+    def applyBootChanges(self):
+        if not self.spec.get('offline', True):
+            offlinePath = join(self.bootPath, "offline")
+            if exists(offlinePath):
+                rmtree(offlinePath)
+        isolinux = self.spec.get('isolinux')
+        if isolinux:
+            isolinuxSource = join(self.distroPath, isolinux)
+            if not exists(isolinuxSource):
+                raise Exception("Cannot find isolinux configuration of variant %s: %s" % (self.name, isolinuxSource))
+            isolinuxTarget = join(self.bootPath, "isolinux/isolinux.cfg")
+            if exists(isolinuxTarget):
+                os.remove(isolinuxTarget)
+            copy(isolinuxSource, isolinuxTarget)
+        timeout = self.spec.get('timeout')
+        if timeout is not None:
+            # isolinux counts in tenths of a second
+            self.replaceInFile(join(self.bootPath, "isolinux/isolinux.cfg"),
+                               r'(?im)^(\s*timeout\s+)\d+', r'\g<1>%d' % (int(timeout) * 10))
+            self.replaceInFile(join(self.bootPath, "boot/grub/grub.cfg"),
+                               r'set timeout=\d+', 'set timeout=%d' % int(timeout))
+
+    # Replace a regular expression in a (hardlinked) boot file
+    def replaceInFile(self, path, regExp, replacement):
+        if exists(path):
+            with open(path, 'r') as f:
+                content = f.read()
+            os.remove(path)
+            with open(path, 'w') as f:
+                f.write(re.sub(regExp, replacement, content))
+
+    def mountOverlay(self):
+        self.overlay.mount(reset=True)
+
+    def umountOverlay(self):
+        self.overlay.umount()
+
+    def getLanguage(self):
+        return self.locale.split('_')[0].split('.')[0]
+
+    # Squashfs layer with the differences of the variant
+    def getLayerPath(self):
+        return join(self.bootPath, "live", "locale-{}.squashfs".format(self.getLanguage()))
+
+    # Squashfs layer with the files of the layer directory
+    def getExtraLayerPath(self):
+        return join(self.bootPath, "live", "{}.squashfs".format(self.name))
+
+    # Tell live-boot which images to stack (lowest first)
+    def writeModule(self, layers):
+        modulePath = join(self.bootPath, "live/filesystem.module")
+        if exists(modulePath):
+            os.remove(modulePath)
+        if layers:
+            with open(modulePath, 'w') as f:
+                f.write("\n".join(["filesystem.squashfs"] + layers) + "\n")
+
+    # ISO file name of the variant, e.g.: solydx_201511.iso -> solydx_201511_de.iso
+    def getIsoBaseName(self, baseIsoName):
+        suffix = self.spec.get('suffix', self.getLanguage() or self.name)
+        return "{}_{}.iso".format(baseIsoName[:-4], suffix)